@@ -11,8 +11,13 @@
 from werkzeug.exceptions import HTTPException
 
 from .blueprints import (
+    BaseHandler,
     CalendarHandler,
+    ChangesHandler,
     DocumentsHandler,
+    EffectiveHandler,
+    EmptyClassroomsHandler,
+    EventsHandler,
     FeedHandler,
     ListHandler,
     MenusHandler,
@@ -27,15 +32,23 @@
     update_solsis_command,
     cleanup_database_command,
     update_timetable_command,
+    export_static_command,
+    extraction_cache_command,
+    reparse_command,
+    scheduler_command,
 )
 from .config import Config
 from .database import Session, SessionFactory
 from .errors import ConfigError, ConfigParseError, ConfigReadError, ConfigValidationError
+from .utils.cache import ResponseCache
 from .utils.errors import format_exception
+from .utils.extraction import configure_extraction_cache
 from .utils.flask import DateConverter, ListConverter
+from .utils.pdf import configure_extraction
+from .utils.store import configure_document_store
 
 if typing.TYPE_CHECKING:
-    from typing import Any
+    from typing import Any, ClassVar
     from sqlalchemy.engine import Engine
     from werkzeug import Response
     from flask.typing import ResponseReturnValue
@@ -48,9 +61,25 @@ class GimVicUrnik:
     and application routes.
     """
 
+    handlers: ClassVar[list[type[BaseHandler]]] = [
+        ListHandler,
+        TimetableHandler,
+        EmptyClassroomsHandler,
+        SubstitutionsHandler,
+        EffectiveHandler,
+        MenusHandler,
+        ScheduleHandler,
+        DocumentsHandler,
+        FeedHandler,
+        CalendarHandler,
+        EventsHandler,
+        ChangesHandler,
+    ]
+
     app: Flask
     config: Config
     engine: Engine
+    cache: ResponseCache | None
 
     def __init__(self, configfile: str) -> None:
         try:
@@ -68,6 +97,8 @@ def __init__(self, configfile: str) -> None:
         self.configure_logging()
         self.configure_sentry()
         self.configure_database()
+        self.configure_cache()
+        self.configure_extraction()
 
         self.app = Flask("gimvicurnik", static_folder=None, template_folder=None)
         self.app.config["GIMVICURNIK"] = self
@@ -164,6 +195,36 @@ def configure_database(self) -> None:
         self.engine = create_engine(self.config.database, pool_size=10, pool_recycle=14400)
         SessionFactory.configure(bind=self.engine)
 
+    def configure_cache(self) -> None:
+        """Configure response cache."""
+
+        if self.config.responseCache.enabled:
+            self.cache = ResponseCache(self.config.responseCache.maxEntries, self.config.responseCache.ttl)
+        else:
+            self.cache = None
+
+    def configure_extraction(self) -> None:
+        """Configure process pool for PDF extraction, extraction cache and document store."""
+
+        configure_extraction(
+            self.config.pdfExtraction.workers,
+            self.config.pdfExtraction.timeout,
+            self.config.pdfExtraction.memoryLimit,
+        )
+
+        if self.config.extractionCache:
+            configure_extraction_cache(
+                self.config.extractionCache.directory,
+                self.config.extractionCache.maxSize * 1024 * 1024,
+            )
+        else:
+            configure_extraction_cache(None, 0)
+
+        if self.config.documentStore:
+            configure_document_store(self.config.documentStore.directory)
+        else:
+            configure_document_store(None)
+
     def create_error_hooks(self) -> None:
         """Add error handlers that shows errors as JSON."""
 
@@ -252,18 +313,16 @@ def register_commands(self) -> None:
         self.app.cli.add_command(update_solsis_command)
         self.app.cli.add_command(cleanup_database_command)
         self.app.cli.add_command(create_database_command)
+        self.app.cli.add_command(export_static_command)
+        self.app.cli.add_command(extraction_cache_command)
+        self.app.cli.add_command(reparse_command)
+        self.app.cli.add_command(scheduler_command)
 
     def register_routes(self) -> None:
         """Register all application routes."""
 
-        ListHandler.register(self.app, self.config)
-        TimetableHandler.register(self.app, self.config)
-        SubstitutionsHandler.register(self.app, self.config)
-        MenusHandler.register(self.app, self.config)
-        ScheduleHandler.register(self.app, self.config)
-        DocumentsHandler.register(self.app, self.config)
-        FeedHandler.register(self.app, self.config)
-        CalendarHandler.register(self.app, self.config)
+        for handler in self.handlers:
+            handler.register(self.app, self.config)
 
 
 def create_app() -> Flask:
@@ -1,8 +1,12 @@
+from .base import BaseHandler
 from .calendar import CalendarHandler
+from .changes import ChangesHandler
 from .documents import DocumentsHandler
+from .effective import EffectiveHandler
+from .events import EventsHandler
 from .feed import FeedHandler
 from .list import ListHandler
 from .menus import MenusHandler
 from .schedule import ScheduleHandler
 from .substitutions import SubstitutionsHandler
-from .timetable import TimetableHandler
+from .timetable import EmptyClassroomsHandler, TimetableHandler
@@ -1,13 +1,53 @@
 from __future__ import annotations
 
 import typing
+from datetime import date, timezone
+from functools import cache
+from hashlib import sha256
 
-from flask import Blueprint
+from flask import Blueprint, Response, current_app, g, request
+
+from ..database import DataVersion
+from ..utils.dates import get_weekdays
 
 if typing.TYPE_CHECKING:
-    from typing import ClassVar
+    from typing import Any, ClassVar
+    from collections.abc import Hashable
     from flask import Flask
     from ..config import Config
+    from ..database import DocumentType
+    from ..utils.cache import ResponseCache
+
+
+def get_cache_key() -> Hashable:
+    """Get the cache key of the current request from its endpoint and normalized arguments."""
+
+    # Weekly routes return the same response for all dates of the week
+    weekly = request.url_rule is not None and "/week/" in request.url_rule.rule
+
+    def _normalize(value: Any) -> Any:
+        # Lists are sorted because entity order does not affect the response
+        if isinstance(value, list):
+            return tuple(sorted(set(value)))
+        if weekly and isinstance(value, date):
+            return get_weekdays(value)[0]
+        return value
+
+    args = tuple((name, _normalize(value)) for name, value in sorted((request.view_args or {}).items()))
+
+    return request.endpoint, args, tuple(sorted(request.args.items(multi=True)))
+
+
+@cache
+def get_package_version() -> str:
+    """Get the package version, so data versions change when the application changes."""
+
+    from importlib import metadata
+
+    try:
+        return metadata.version("gimvicurnik")
+    except metadata.PackageNotFoundError:
+        return "0.0.0"
 
 
 class BaseHandler:
@@ -22,11 +62,74 @@ class BaseHandler:
     template_folder: ClassVar[str | None] = None
     """Path to a folder of template files. May be set by subclasses."""
 
+    data_types: ClassVar[tuple[DocumentType, ...]] = ()
+    """Types of data that handler responses depend on. May be set by subclasses."""
+
     @classmethod
     def routes(cls, bp: Blueprint, config: Config) -> None:
         """Handler routes. Must be set by subclasses."""
         pass
 
+    @classmethod
+    def versioning(cls, bp: Blueprint) -> None:
+        """Make handler responses conditional on versions of data they depend on and cache them."""
+
+        @bp.before_request
+        def _check_data_version() -> Response | None:
+            generations, modified = DataVersion.get_versions(cls.data_types)
+
+            version = ",".join(f"{type_.value}:{generation}" for type_, generation in generations.items())
+            version = sha256(f"{get_package_version()}|{version}".encode()).hexdigest()
+
+            # Last-Modified only has a precision of seconds
+            if modified:
+                modified = modified.replace(microsecond=0)
+                modified = modified.replace(tzinfo=timezone.utc) if not modified.tzinfo else modified
+
+            g.data_version = version
+            g.data_modified = modified
+
+            # Respond without the content if the client already has the current data
+            # The modified date is only checked if the client does not provide the ETag
+            if request.if_none_match:
+                if request.if_none_match.contains_weak(version):
+                    return Response(status=304)
+            elif request.if_modified_since and modified:
+                if modified <= request.if_modified_since:
+                    return Response(status=304)
+
+            response_cache: ResponseCache | None = current_app.config["GIMVICURNIK"].cache
+
+            # Respond with the cached content if it was generated from the current data
+            if response_cache:
+                response_cache.invalidate(generations)
+                g.data_cache_key = get_cache_key()
+
+                if cached := response_cache.get(g.data_cache_key, version):
+                    g.data_cached = True
+                    return Response(cached.data, mimetype=cached.mimetype)
+
+            return None
+
+        @bp.after_request
+        def _set_data_version(response: Response) -> Response:
+            if "data_version" not in g or response.status_code not in (200, 304):
+                return response
+
+            response_cache: ResponseCache | None = current_app.config["GIMVICURNIK"].cache
+
+            # Store the generated content to the cache
+            if response_cache and response.status_code == 200 and "data_cached" not in g:
+                data = response.get_data()
+                response_cache.set(g.data_cache_key, g.data_version, cls.data_types, data, response.mimetype)
+
+            # Clients may store responses, but must revalidate them before use
+            response.set_etag(g.data_version)
+            response.last_modified = g.data_modified
+            response.cache_control.no_cache = True
+
+            return response
+
     @classmethod
     def register(cls, app: Flask, config: Config) -> None:
         """Create a blueprint and register it to the provided app."""
@@ -39,6 +142,10 @@ def register(cls, app: Flask, config: Config) -> None:
             template_folder=cls.template_folder,
         )
 
+        # Register data versioning if the handler depends on any data
+        if cls.data_types:
+            cls.versioning(bp)
+
         # Register routes to the blueprint
         cls.routes(bp, config)
 
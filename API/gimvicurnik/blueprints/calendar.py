@@ -1,256 +1,124 @@
 from __future__ import annotations
 
-import logging
 import typing
-from datetime import date, datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from hashlib import sha256
 
-from flask import make_response, request
-from icalendar import Calendar, Event, vDuration, vRecur
+from flask import Response, request, stream_with_context
+from icalendar import vCalAddress
+from sqlalchemy import select
 
-from .base import BaseHandler
-from ..database import Class, LunchSchedule, Session
-from ..utils.sentry import start_span, with_span
+from .base import BaseHandler, get_package_version
+from ..database import CalendarFragment, Class, DataVersion, DocumentType, LunchSchedule, Session
+from ..utils.calendar import write_calendar, write_event
 
 if typing.TYPE_CHECKING:
-    from typing import Any
-    from collections.abc import Iterator
-    from flask import Blueprint, Response
+    from collections.abc import Iterable, Iterator
+    from flask import Blueprint
     from sqlalchemy.orm.query import RowReturningQuery
-    from ..config import Config, ConfigLessonTime
+    from ..config import Config
 
 
-def create_calendar(name: str, url: str) -> Calendar:
-    calendar = Calendar()
+def create_calendar_response(name: str, url: str, events: Iterable[str], version: str) -> Response:
+    """
+    Create a response that streams the calendar while its events are generated.
 
-    calendar.add("PRODID", "gimvicurnik")
-    calendar.add("VERSION", "2.0")
-    calendar.add("X-WR-TIMEZONE", "Europe/Ljubljana")
-    calendar.add("X-WR-CALNAME", name)
-    calendar.add("X-WR-CALDESC", name)
-    calendar.add("NAME", name)
-    calendar.add("URL", url)
-    calendar.add("SOURCE", url)
-    calendar.add("UID", sha256(url.encode("utf-8")).hexdigest())
-    calendar.add("X-PUBLISHED-TTL", vDuration(timedelta(hours=1)))
-    calendar.add("REFRESH-INTERVAL", vDuration(timedelta(hours=1)))
+    The calendar version is used for the ETag, so clients that already have
+    the current calendar receive an empty response without generating events.
+    The ETag is weak, as exclusions of past dates may differ between calendars
+    with the same version.
+    """
 
-    return calendar
+    etag = sha256(f"{get_package_version()}|{name}|{url}|{version}".encode()).hexdigest()
+
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = Response(stream_with_context(write_calendar(name, url, events)))
+        response.headers["Content-Disposition"] = "attachment; filename=calendar.ics"
+        response.headers["Content-Type"] = "text/calendar; charset=utf-8"
+
+    # Clients may store calendars, but must revalidate them before use
+    response.set_etag(etag, weak=True)
+    response.cache_control.no_cache = True
+
+    return response
 
 
-@with_span(op="generate")
 def create_school_calendar(
-    substitutions: Iterator[dict[str, Any]],
-    lessons: Iterator[dict[str, Any]],
-    times: list[ConfigLessonTime],
+    classes: list[str],
+    kinds: list[str],
     name: str,
     url: str,
-    include_timetable: bool = True,
-    include_substitutions: bool = True,
 ) -> Response:
-    """Create a school calendar from substitutions and timetable."""
-
-    logger = logging.getLogger(__name__)
-    calendar = create_calendar(name, url)
-
-    today = datetime.now().date()
-    year = today.year if today >= date(today.year, 9, 1) else today.year - 1
-
-    weekdays = ["SU", "MO", "TU", "WE", "TH", "FR", "SA"]
-    weektable: list[list[Event | None]] = [[None for _ in range(11)] for _ in range(6)]
-
-    if include_timetable:
-        for subject in lessons:
-            with start_span(op="event") as span:
-                span.set_tag("event.type", "timetable")
-                span.set_tag("event.day", subject["day"])
-                span.set_tag("event.time", subject["time"])
-                span.set_data("event.source", subject)
-
-                logger.debug(
-                    "Preparing iCalendar event",
-                    extra={"type": "timetable", "source": subject},
-                )
-
-                # Create event and add internal properties
-                event = Event()
-                event.add("DTSTAMP", datetime.now())
-                event.add("CATEGORIES", ["Lesson", "Normal"])
-                event.add("COLOR", "darkgreen")
-                event.add(
-                    "UID",
-                    sha256(
-                        (
-                            str(subject["day"])
-                            + str(subject["time"])
-                            + str(subject["subject"])
-                            + str(subject["class"])
-                            + str(subject["classroom"])
-                            + str(subject["teacher"])
-                        ).encode("utf-8")
-                    ).hexdigest(),
-                )
-
-                # Add basic lesson properties
-                event.add("SUMMARY", subject["subject"])
-                event.add("ATTENDEE", subject["class"])
-                event.add("ORGANIZER", subject["teacher"])
-                event.add("LOCATION", subject["classroom"])
-                event.add("DURATION", timedelta(minutes=45))
-
-                # Lesson "starts" on -08-31, so it can repeat properly
-                start = datetime(year, 8, 31) + times[subject["time"]].start
-                event.add("DTSTART", start)
-                event.add("EXDATE", start)
-
-                # Lesson repeats every week
-                event.add(
-                    "RRULE",
-                    vRecur(
-                        freq="WEEKLY",
-                        byday=weekdays[subject["day"]],
-                        until=datetime(year + 1, 6, 25),
-                    ),
-                )
-
-                # Add lesson to the week table
-                weektable[subject["day"]][subject["time"]] = event
+    """Create a school calendar from rendered calendar fragments of the classes."""
 
-    if include_substitutions:
-        for subject in substitutions:
-            with start_span(op="event") as span:
-                span.set_tag("event.type", "substitution")
-                span.set_tag("event.date", subject["date"])
-                span.set_tag("event.day", subject["day"])
-                span.set_tag("event.time", subject["time"])
-                span.set_data("event.source", subject)
+    # Fragment hashes only change when their events change, so they identify the calendar version
+    hashes = Session.scalars(
+        select(CalendarFragment.hash)
+        .where(CalendarFragment.class_.in_(classes), CalendarFragment.kind.in_(kinds))
+        .order_by(CalendarFragment.class_, CalendarFragment.kind)
+    )
 
-                logger.debug(
-                    "Preparing iCalendar event",
-                    extra={"type": "substitution", "source": subject},
-                )
+    fragments = (
+        Session.query(CalendarFragment.content)
+        .filter(CalendarFragment.class_.in_(classes), CalendarFragment.kind.in_(kinds))
+        .order_by(CalendarFragment.class_, CalendarFragment.kind)
+        .yield_per(16)
+    )
 
-                # Create event and add internal properties
-                event = Event()
-                event.add("DTSTAMP", datetime.now())
-                event.add("CATEGORIES", ["Lesson", "Substitution"])
-                event.add("COLOR", "darkred")
-                event.add(
-                    "UID",
-                    sha256(
-                        (
-                            str(subject["date"])
-                            + str(subject["day"])
-                            + str(subject["time"])
-                            + str(subject["subject"])
-                            + str(subject["class"])
-                            + str(subject["classroom"])
-                            + str(subject["teacher"])
-                            + str(subject["original-classroom"])
-                            + str(subject["original-teacher"])
-                        ).encode("utf-8")
-                    ).hexdigest(),
-                )
+    return create_calendar_response(name, url, (model.content for model in fragments), ",".join(hashes))
 
-                # Add basic substitution properties
-                event.add("SUMMARY", subject["subject"])
-                event.add("DESCRIPTION", subject["notes"] or "")
-                event.add("ATTENDEE", subject["class"])
-                event.add("ORGANIZER", subject["teacher"])
-                event.add("LOCATION", subject["classroom"])
 
-                # Add start and end dates
-                date_ = datetime.strptime(subject["date"], "%Y-%m-%d")
-                event.add("DTSTART", date_ + times[subject["time"]].start)
-                event.add("DTEND", date_ + times[subject["time"]].end)
-
-                # Exclude normal lesson at that time
-                if weektable[date_.isoweekday()][subject["time"]]:
-                    original: Event = weektable[date_.isoweekday()][subject["time"]]
-                    original.add("EXDATE", event.get("DTSTART"))
-
-                # Add substitution to the calendar
-                calendar.add_component(event)
-
-    # Add all lessons to the calendar
-    for day in range(len(weektable)):
-        for time in range(len(weektable[0])):
-            if event := weektable[day][time]:  # type: ignore[assignment]
-                calendar.add_component(event)
-
-    # Convert to iCal and return response
-    response = make_response(calendar.to_ical().decode("utf-8").replace("\\", ""))
-    response.headers["Content-Disposition"] = "attachment; filename=calendar.ics"
-    response.headers["Content-Type"] = "text/calendar; charset=utf-8"
-    return response
-
-
-@with_span(op="generate")
 def create_schedule_calendar(
     query: RowReturningQuery[tuple[LunchSchedule, str]],
     name: str,
     url: str,
 ) -> Response:
-    logger = logging.getLogger(__name__)
-    calendar = create_calendar(name, url)
+    """Create a lunch schedule calendar from the lunch schedules and their class names."""
 
-    for model, classname in query:
-        with start_span(op="event") as span:
-            span.set_tag("event.type", "lunch-schedule")
-            span.set_tag("event.date", model.date)
-            span.set_tag("event.time", model.time)
-            span.set_data("event.source", model)
+    generations, modified = DataVersion.get_versions([DocumentType.LUNCH_SCHEDULE])
+    version = str(generations[DocumentType.LUNCH_SCHEDULE])
 
+    # Schedules are stamped with the time of their last change, so unchanged calendars stay the same
+    stamp = modified or datetime.now(timezone.utc)
+    stamp = stamp.replace(tzinfo=timezone.utc) if not stamp.tzinfo else stamp
+
+    def _generate() -> Iterator[str]:
+        for model, classname in query:
             # Skip schedules without time
             if not model.time:
-                logger.debug(
-                    "Skipping iCalendar event",
-                    extra={"type": "lunch-schedule", "source": model},
-                )
-
                 continue
 
-            logger.debug(
-                "Preparing iCalendar event",
-                extra={"type": "lunch-schedule", "source": model},
-            )
+            uid = sha256(
+                (
+                    str(model.date)
+                    + str(model.time)
+                    + str(classname)
+                    + str(model.location)
+                    + str(model.notes)
+                ).encode("utf-8")
+            ).hexdigest()
 
-            # Create event and add internal properties
-            event = Event()
-            event.add("DTSTAMP", datetime.now())
-            event.add("CATEGORIES", ["Lunch"])
-            event.add("COLOR", "darkblue")
-            event.add(
-                "UID",
-                sha256(
-                    (
-                        str(model.date)
-                        + str(model.time)
-                        + str(classname)
-                        + str(model.location)
-                        + str(model.notes)
-                    ).encode("utf-8")
-                ).hexdigest(),
-            )
-
-            # Add lunch schedule properties
             start = datetime.combine(model.date, model.time)
             end = start + timedelta(minutes=15)
-            event.add("SUMMARY", "Kosilo")
-            event.add("DESCRIPTION", model.notes or "")
-            event.add("LOCATION", model.location or "")
-            event.add("ATTENDEE", classname)
-            event.add("DTSTART", start)
-            event.add("DTEND", end)
 
-            # Add lunch schedule to the calendar
-            calendar.add_component(event)
+            yield write_event(
+                [
+                    ("DTSTAMP", stamp),
+                    ("CATEGORIES", ["Lunch"]),
+                    ("COLOR", "darkblue"),
+                    ("UID", uid),
+                    ("SUMMARY", "Kosilo"),
+                    ("DESCRIPTION", model.notes or ""),
+                    ("LOCATION", model.location or ""),
+                    ("ATTENDEE", vCalAddress(classname)),
+                    ("DTSTART", start),
+                    ("DTEND", end),
+                ]
+            )
 
-    # Convert to iCal and return response
-    response = make_response(calendar.to_ical().decode("utf-8").replace("\\", ""))
-    response.headers["Content-Disposition"] = "attachment; filename=calendar.ics"
-    response.headers["Content-Type"] = "text/calendar; charset=utf-8"
-    return response
+    return create_calendar_response(name, url, _generate(), version)
 
 
 class CalendarHandler(BaseHandler):
@@ -261,9 +129,8 @@ def routes(cls, bp: Blueprint, config: Config) -> None:
         @bp.route("/calendar/combined/<list:classes>")
         def get_combined_calendar_for_classes(classes: list[str]) -> Response:
             return create_school_calendar(
-                Class.get_substitutions(None, classes),
-                Class.get_lessons(classes),
-                config.lessonTimes,
+                classes,
+                ["lessons", "substitutions"],
                 f"Koledar \u2013 {', '.join(classes)} \u2013 Gimnazija Vič",
                 config.urls.api + request.path,
             )
@@ -271,23 +138,19 @@ def get_combined_calendar_for_classes(classes: list[str]) -> Response:
         @bp.route("/calendar/timetable/<list:classes>")
         def get_timetable_calendar_for_classes(classes: list[str]) -> Response:
             return create_school_calendar(
-                Class.get_substitutions(None, classes),
-                Class.get_lessons(classes),
-                config.lessonTimes,
+                classes,
+                ["timetable"],
                 f"Urnik \u2013 {', '.join(classes)} \u2013 Gimnazija Vič",
                 config.urls.api + request.path,
-                include_substitutions=False,
             )
 
         @bp.route("/calendar/substitutions/<list:classes>")
         def get_substitutions_calendar_for_classes(classes: list[str]) -> Response:
             return create_school_calendar(
-                Class.get_substitutions(None, classes),
-                Class.get_lessons(classes),
-                config.lessonTimes,
+                classes,
+                ["substitutions"],
                 f"Nadomeščanja \u2013 {', '.join(classes)} \u2013 Gimnazija Vič",
                 config.urls.api + request.path,
-                include_timetable=False,
             )
 
         @bp.route("/calendar/schedules/<list:classes>")
@@ -0,0 +1,57 @@
+from __future__ import annotations
+
+import typing
+
+from flask import request
+from werkzeug.exceptions import Gone
+
+from .base import BaseHandler
+from ..database import Change, ChangeSequence, Session
+from ..utils.events import get_changes
+
+if typing.TYPE_CHECKING:
+    from typing import Any
+    from flask import Blueprint
+    from ..config import Config
+
+
+class ChangesHandler(BaseHandler):
+    name = "changes"
+
+    @classmethod
+    def routes(cls, bp: Blueprint, config: Config) -> None:
+        limit = 1000
+
+        def _serialize_change(change: Change) -> dict[str, Any]:
+            return {
+                "sequence": change.sequence,
+                "type": change.type.value,
+                "entity": change.entity,
+                "date": change.date.isoformat() if change.date else None,
+                "before": change.before,
+                "after": change.after,
+            }
+
+        @bp.route("/changes")
+        def get_changes_since() -> dict[str, Any]:
+            since = request.args.get("since", type=int)
+
+            sequence = Session.query(ChangeSequence).first()
+            current = sequence.value if sequence else 0
+            removed = sequence.removed if sequence else 0
+
+            # Clients without a cursor should fetch the data and then sync from the current sequence number
+            if since is None:
+                return {"sequence": current, "more": False, "changes": []}
+
+            # Clients with an outdated or unknown cursor cannot sync from it and need to fetch the data again
+            if since < removed or since > current:
+                raise Gone("Changes since the provided sequence number are not available")
+
+            changes = get_changes(Session(), since, limit)
+
+            return {
+                "sequence": changes[-1].sequence if changes else since,
+                "more": len(changes) == limit,
+                "changes": [_serialize_change(change) for change in changes],
+            }
@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+import typing
+
+from .base import BaseHandler
+from ..database import Class, Classroom, DocumentType, Teacher
+from ..utils.dates import get_weekdays
+
+if typing.TYPE_CHECKING:
+    import datetime
+    from typing import Any
+    from collections.abc import Iterable
+    from flask import Blueprint
+    from ..config import Config
+    from ..database import Entity
+
+
+def merge_substitutions(
+    lessons: Iterable[dict[str, Any]],
+    substitutions: Iterable[dict[str, Any]],
+) -> list[list[list[dict[str, Any]]]]:
+    """
+    Merge substitutions with lessons into a grid of effective lessons.
+
+    The grid is organized by time and day, where each cell contains lessons
+    of that time and day. Lessons are merged with the first substitution of
+    their original teacher at the same time, and all substitutions are added
+    to their cells and deduplicated by their class, original teacher and
+    displayed data, preferring substitutions with notes.
+    """
+
+    lessons = list(lessons)
+    substitutions = list(substitutions)
+
+    # Substitutions are matched with lessons by their time and the original teacher
+    matching: dict[tuple[int, int, str | None], dict[str, Any]] = {}
+
+    for substitution in substitutions:
+        matching.setdefault(
+            (substitution["day"], substitution["time"], substitution["original-teacher"]), substitution
+        )
+
+    max_time = max((lesson["time"] for lesson in lessons + substitutions), default=-1)
+    grid: list[list[list[dict[str, Any]]]] = [[[] for _ in range(5)] for _ in range(max_time + 1)]
+
+    for lesson in lessons:
+        matched = matching.get((lesson["day"], lesson["time"], lesson["teacher"]))
+
+        grid[lesson["time"]][lesson["day"] - 1].append(
+            {
+                "day": lesson["day"],
+                "time": lesson["time"],
+                "subject": lesson["subject"],
+                "class": lesson["class"],
+                "teacher": lesson["teacher"],
+                "classroom": lesson["classroom"],
+                "is-substitution": matched is not None,
+                "substitution-subject": (matched["subject"] or None) if matched else None,
+                "substitution-teacher": (matched["teacher"] or None) if matched else None,
+                "substitution-classroom": (matched["classroom"] or None) if matched else None,
+                "notes": (matched["notes"] or None) if matched else None,
+            }
+        )
+
+    # Substitutions of lessons that are not in the timetable are added as well
+    for substitution in substitutions:
+        grid[substitution["time"]][substitution["day"] - 1].append(
+            {
+                "day": substitution["day"],
+                "time": substitution["time"],
+                "subject": substitution["subject"] if substitution["original-teacher"] else None,
+                "class": substitution["class"],
+                "teacher": substitution["original-teacher"],
+                "classroom": substitution["original-classroom"],
+                "is-substitution": True,
+                "substitution-subject": substitution["subject"],
+                "substitution-teacher": substitution["teacher"],
+                "substitution-classroom": substitution["classroom"],
+                "notes": substitution["notes"],
+            }
+        )
+
+    # Deduplicate substitutions, while normal lessons are kept as they are
+    for row in grid:
+        for index, cell in enumerate(row):
+            unique: dict[Any, dict[str, Any]] = {}
+
+            for position, lesson in enumerate(cell):
+                if not lesson["is-substitution"]:
+                    unique[position] = lesson
+                    continue
+
+                key = (
+                    lesson["class"],
+                    lesson["teacher"],
+                    lesson["substitution-subject"],
+                    lesson["substitution-teacher"],
+                    lesson["substitution-classroom"],
+                )
+
+                if key not in unique or unique[key]["notes"] is None:
+                    unique[key] = lesson
+
+            row[index] = list(unique.values())
+
+    return grid
+
+
+class EffectiveHandler(BaseHandler):
+    name = "effective"
+    data_types = (DocumentType.TIMETABLE, DocumentType.SUBSTITUTIONS)
+
+    @classmethod
+    def routes(cls, bp: Blueprint, config: Config) -> None:
+        def _fetch_week_effective(
+            date: datetime.date,
+            entity: type[Entity],
+            names: list[str],
+        ) -> list[list[list[dict[str, Any]]]]:
+            """Fetch the timetable merged with substitutions for a week containing the given date."""
+
+            return merge_substitutions(
+                entity.get_lessons(names),
+                entity.get_substitutions(get_weekdays(date), names),
+            )
+
+        @bp.route("/effective/week/<date:date>/classes/<list:classes>")
+        def get_week_effective_for_classes(
+            date: datetime.date,
+            classes: list[str],
+        ) -> list[list[list[dict[str, Any]]]]:
+            return _fetch_week_effective(date, Class, classes)
+
+        @bp.route("/effective/week/<date:date>/teachers/<list:teachers>")
+        def get_week_effective_for_teachers(
+            date: datetime.date,
+            teachers: list[str],
+        ) -> list[list[list[dict[str, Any]]]]:
+            return _fetch_week_effective(date, Teacher, teachers)
+
+        @bp.route("/effective/week/<date:date>/classrooms/<list:classrooms>")
+        def get_week_effective_for_classrooms(
+            date: datetime.date,
+            classrooms: list[str],
+        ) -> list[list[list[dict[str, Any]]]]:
+            return _fetch_week_effective(date, Classroom, classrooms)
@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+import queue
+import typing
+
+from flask import Response, request
+
+from .base import BaseHandler
+from ..database import Session
+from ..utils.events import ChangeBroadcaster, format_event, iter_changes, summarize_changes
+
+if typing.TYPE_CHECKING:
+    from collections.abc import Iterator
+    from flask import Blueprint
+    from ..config import Config
+
+
+class EventsHandler(BaseHandler):
+    name = "events"
+
+    @classmethod
+    def routes(cls, bp: Blueprint, config: Config) -> None:
+        if not config.events.enabled:
+            return
+
+        broadcaster = ChangeBroadcaster(config.events.pollInterval)
+        keepalive = config.events.keepaliveInterval
+
+        @bp.route("/events")
+        def get_events() -> Response:
+            subscriber = broadcaster.subscribe()
+
+            # Clients that reconnect receive changes they have missed while disconnected
+            # This happens after subscribing, so no changes are missed in between
+            # All missed changes are loaded, as later events only include changes after the last sent one
+            last_id = request.headers.get("Last-Event-ID", type=int)
+            missed = summarize_changes(iter_changes(Session(), last_id)) if last_id is not None else []
+
+            def _stream() -> Iterator[str]:
+                sent = last_id or 0
+
+                try:
+                    yield "retry: 5000\n\n"
+
+                    for id_, data in missed:
+                        sent = max(sent, id_)
+                        yield format_event(id_, data)
+
+                    while True:
+                        try:
+                            event = subscriber.get(timeout=keepalive)
+                        except queue.Empty:
+                            yield ": keepalive\n\n"
+                            continue
+
+                        # The subscriber has been disconnected because it was too slow
+                        if event is None:
+                            return
+
+                        # Skip events that have already been sent as missed changes
+                        if event[0] > sent:
+                            sent = event[0]
+                            yield format_event(*event)
+
+                finally:
+                    broadcaster.unsubscribe(subscriber)
+
+            return Response(
+                _stream(),
+                mimetype="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+            )
@@ -3,7 +3,7 @@
 import typing
 
 from .base import BaseHandler
-from ..database import Class, Classroom, Session, Teacher
+from ..database import Class, Classroom, DocumentType, Session, Teacher
 
 if typing.TYPE_CHECKING:
     from flask import Blueprint
@@ -13,6 +13,7 @@
 
 class ListHandler(BaseHandler):
     name = "list"
+    data_types = (DocumentType.TIMETABLE, DocumentType.SUBSTITUTIONS, DocumentType.LUNCH_SCHEDULE)
 
     @classmethod
     def routes(cls, bp: Blueprint, config: Config) -> None:
@@ -3,7 +3,7 @@
 import typing
 
 from .base import BaseHandler
-from ..database import LunchMenu, Session, SnackMenu
+from ..database import DocumentType, LunchMenu, Session, SnackMenu
 from ..utils.dates import get_weekdays
 
 if typing.TYPE_CHECKING:
@@ -14,6 +14,7 @@
 
 class MenusHandler(BaseHandler):
     name = "menus"
+    data_types = (DocumentType.SNACK_MENU, DocumentType.LUNCH_MENU)
 
     @classmethod
     def routes(cls, bp: Blueprint, config: Config) -> None:
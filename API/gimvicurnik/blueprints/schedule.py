@@ -3,7 +3,7 @@
 import typing
 
 from .base import BaseHandler
-from ..database import Class, LunchSchedule, Session
+from ..database import Class, DocumentType, LunchSchedule, Session
 from ..utils.dates import get_weekdays
 
 if typing.TYPE_CHECKING:
@@ -15,6 +15,7 @@
 
 class ScheduleHandler(BaseHandler):
     name = "schedule"
+    data_types = (DocumentType.LUNCH_SCHEDULE,)
 
     @classmethod
     def routes(cls, bp: Blueprint, config: Config) -> None:
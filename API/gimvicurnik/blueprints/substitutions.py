@@ -4,7 +4,7 @@
 
 from ..utils.dates import get_weekdays
 from .base import BaseHandler
-from ..database import Class, Classroom, Entity, Teacher
+from ..database import Class, Classroom, DocumentType, Entity, Teacher
 
 if typing.TYPE_CHECKING:
     import datetime
@@ -15,6 +15,7 @@
 
 class SubstitutionsHandler(BaseHandler):
     name = "substitutions"
+    data_types = (DocumentType.SUBSTITUTIONS,)
 
     @classmethod
     def routes(cls, bp: Blueprint, config: Config) -> None:
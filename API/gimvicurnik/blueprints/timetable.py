@@ -2,10 +2,13 @@
 
 import typing
 
+from flask import Response
+
 from .base import BaseHandler
-from ..database import Class, Classroom, Entity, Teacher
+from ..database import Class, Classroom, DocumentType, Entity, Teacher
 
 if typing.TYPE_CHECKING:
+    import datetime
     from typing import Any
     from flask import Blueprint
     from ..config import Config
@@ -13,25 +16,39 @@
 
 class TimetableHandler(BaseHandler):
     name = "timetable"
+    data_types = (DocumentType.TIMETABLE,)
 
     @classmethod
     def routes(cls, bp: Blueprint, config: Config) -> None:
+        # Timetables are served as they were serialized by the updater
         @bp.route("/timetable")
-        def get_timetable() -> list[dict[str, Any]]:
-            return list(Entity.get_lessons())
+        def get_timetable() -> Response:
+            return Response(Entity.get_lessons_json(), mimetype="application/json")
 
         @bp.route("/timetable/classes/<list:classes>")
-        def get_timetable_for_classes(classes: list[str]) -> list[dict[str, Any]]:
-            return list(Class.get_lessons(classes))
+        def get_timetable_for_classes(classes: list[str]) -> Response:
+            return Response(Class.get_lessons_json(classes), mimetype="application/json")
 
         @bp.route("/timetable/teachers/<list:teachers>")
-        def get_timetable_for_teachers(teachers: list[str]) -> list[dict[str, Any]]:
-            return list(Teacher.get_lessons(teachers))
+        def get_timetable_for_teachers(teachers: list[str]) -> Response:
+            return Response(Teacher.get_lessons_json(teachers), mimetype="application/json")
 
         @bp.route("/timetable/classrooms/<list:classrooms>")
-        def get_timetable_for_classrooms(classrooms: list[str]) -> list[dict[str, Any]]:
-            return list(Classroom.get_lessons(classrooms))
+        def get_timetable_for_classrooms(classrooms: list[str]) -> Response:
+            return Response(Classroom.get_lessons_json(classrooms), mimetype="application/json")
 
         @bp.route("/timetable/classrooms/empty")
         def get_timetable_for_empty_classrooms() -> list[dict[str, Any]]:
             return list(Classroom.get_empty())
+
+
+class EmptyClassroomsHandler(BaseHandler):
+    name = "empty-classrooms"
+    data_types = (DocumentType.TIMETABLE, DocumentType.SUBSTITUTIONS)
+
+    @classmethod
+    def routes(cls, bp: Blueprint, config: Config) -> None:
+        # Empty classrooms on a date also depend on substitutions, so they are cached separately
+        @bp.route("/timetable/classrooms/empty/date/<date:date>")
+        def get_timetable_for_empty_classrooms_on_date(date: datetime.date) -> list[dict[str, Any]]:
+            return list(Classroom.get_empty(date))
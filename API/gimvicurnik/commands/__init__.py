@@ -1,18 +1,215 @@
+from __future__ import annotations
+
+import functools
 import logging
 import typing
+from contextlib import contextmanager
 
 import click
 from flask import current_app
 
-from datetime import datetime, timedelta
-from sqlalchemy import and_, or_
-
-from ..database import Base, SessionFactory, Document, DocumentType
+from datetime import date, datetime, time, timedelta, timezone
+from sqlalchemy import and_, func, or_
+
+from ..database import (
+    Base,
+    CalendarFragment,
+    Change,
+    ChangeSequence,
+    DataVersion,
+    Session,
+    SessionFactory,
+    Document,
+    DocumentType,
+    UpdateHistory,
+)
 from ..updaters import EClassroomUpdater, MenuUpdater, TimetableUpdater, SolsisUpdater
+from ..utils.calendar import render_calendars
+from ..utils.database import (
+    EntityResolver,
+    data_lock,
+    materialize_timetables,
+    refresh_substitutions,
+    seed_change_sequence,
+    seed_data_locks,
+    seed_data_versions,
+    upgrade_tables,
+)
+from ..utils.export import export_static
+from ..utils.extraction import get_extraction_cache
+from ..utils.scheduler import PollingPolicy, Scheduler
 from ..utils.sentry import with_transaction
+from ..utils.store import get_document_store
 
 if typing.TYPE_CHECKING:
+    from collections.abc import Callable, Iterator
+    import requests
     from .. import GimVicUrnik
+    from ..config import ConfigSchedulerJob
+
+
+@contextmanager
+def export_changes(*types: DocumentType) -> Iterator[None]:
+    """Export static files of the specified data types if the data changes within the block."""
+
+    gimvicurnik: GimVicUrnik = current_app.config["GIMVICURNIK"]
+
+    if not gimvicurnik.config.export:
+        yield
+        return
+
+    before, _ = DataVersion.get_versions(types)
+    Session.remove()
+
+    yield
+
+    after, _ = DataVersion.get_versions(types)
+    changed = [type_ for type_ in types if before[type_] != after[type_]]
+
+    if changed:
+        logging.getLogger(__name__).info("Exporting static files of the changed data")
+
+        export_config = gimvicurnik.config.export
+        export_static(
+            gimvicurnik.app, gimvicurnik.handlers, export_config.directory, changed, export_config.weeks
+        )
+
+    Session.remove()
+
+
+# Calendars depend on the timetable and substitutions, so updaters that render them need to lock both
+CALENDAR_TYPES = (DocumentType.TIMETABLE, DocumentType.SUBSTITUTIONS)
+
+
+@contextmanager
+def render_calendar_changes() -> Iterator[None]:
+    """
+    Render calendar fragments of classes whose timetable or substitutions change within the block.
+
+    Fragments of all classes are rendered if they were rendered on a previous day,
+    so substitutions move in and out of the calendar window. The block must hold
+    data locks of calendar types, so concurrent updaters do not render at once.
+    """
+
+    gimvicurnik: GimVicUrnik = current_app.config["GIMVICURNIK"]
+
+    before = Session.query(func.max(Change.sequence)).scalar() or 0
+    Session.remove()
+
+    yield
+
+    changes = (
+        Session.query(Change.classes).filter(Change.sequence > before, Change.type.in_(CALENDAR_TYPES)).all()
+    )
+    stale = Session.query(CalendarFragment.id).filter(CalendarFragment.rendered < date.today()).first()
+
+    # Changes without classes may affect any class
+    classes = (
+        None
+        if stale or any(model.classes is None for model in changes)
+        else {class_ for model in changes for class_ in model.classes or []}
+    )
+
+    try:
+        if classes is None or classes:
+            render_calendars(Session(), gimvicurnik.config.lessonTimes, gimvicurnik.config.calendar, classes)
+            Session.commit()
+
+    except Exception:
+        # The data changes are already committed, so all fragments are rendered again by the next update
+        Session.rollback()
+        Session.query(CalendarFragment).update({CalendarFragment.rendered: date.today() - timedelta(days=1)})
+        Session.commit()
+        raise
+
+    finally:
+        Session.remove()
+
+
+def update_timetable(requests_session: requests.Session | None = None) -> requests.Session:
+    """Update data from the timetable and return the used requests session."""
+
+    logging.getLogger(__name__).info("Updating the timetable data")
+
+    with (
+        data_lock(DocumentType.TIMETABLE, *CALENDAR_TYPES),
+        export_changes(DocumentType.TIMETABLE),
+        render_calendar_changes(),
+    ):
+        with SessionFactory.begin() as session:
+            gimvicurnik: GimVicUrnik = current_app.config["GIMVICURNIK"]
+            updater = TimetableUpdater(gimvicurnik.config.sources.timetable, session, requests_session)
+            updater.update()
+
+    return updater.requests
+
+
+def update_eclassroom(
+    parse_substitutions: bool,
+    parse_lunch_schedules: bool,
+    extract_circulars: bool,
+    requests_session: requests.Session | None = None,
+) -> requests.Session:
+    """Update data from the e-classroom and return the used requests session."""
+
+    logging.getLogger(__name__).info("Updating the e-classroom data")
+
+    types = (DocumentType.SUBSTITUTIONS, DocumentType.LUNCH_SCHEDULE)
+
+    with data_lock(*types, *CALENDAR_TYPES), export_changes(*types), render_calendar_changes():
+        with SessionFactory.begin() as session:
+            gimvicurnik: GimVicUrnik = current_app.config["GIMVICURNIK"]
+            updater = EClassroomUpdater(
+                gimvicurnik.config.sources.eclassroom,
+                session,
+                parse_substitutions,
+                parse_lunch_schedules,
+                extract_circulars,
+                requests_session,
+            )
+            updater.update()
+
+    return updater.requests
+
+
+def update_menu(requests_session: requests.Session | None = None) -> requests.Session:
+    """Update snack and lunch menu data and return the used requests session."""
+
+    logging.getLogger(__name__).info("Updating the menu data")
+
+    types = (DocumentType.SNACK_MENU, DocumentType.LUNCH_MENU)
+
+    with data_lock(*types), export_changes(*types):
+        with SessionFactory.begin() as session:
+            gimvicurnik: GimVicUrnik = current_app.config["GIMVICURNIK"]
+            updater = MenuUpdater(gimvicurnik.config.sources.menu, session, requests_session)
+            updater.update()
+
+    return updater.requests
+
+
+def update_solsis(
+    date_from: date,
+    date_to: date,
+    requests_session: requests.Session | None = None,
+) -> requests.Session:
+    """Update data from Solsis and return the used requests session."""
+
+    logging.getLogger(__name__).info("Updating the Solsis data (%s - %s)", date_from, date_to)
+
+    with (
+        data_lock(DocumentType.SUBSTITUTIONS, *CALENDAR_TYPES),
+        export_changes(DocumentType.SUBSTITUTIONS),
+        render_calendar_changes(),
+    ):
+        with SessionFactory.begin() as session:
+            gimvicurnik: GimVicUrnik = current_app.config["GIMVICURNIK"]
+            updater = SolsisUpdater(
+                gimvicurnik.config.sources.solsis, session, date_from, date_to, requests_session
+            )
+            updater.update()
+
+    return updater.requests
 
 
 @click.command("update-timetable", help="Update the timetable data.")
@@ -20,12 +217,7 @@
 def update_timetable_command() -> None:
     """Update data from the timetable"""
 
-    logging.getLogger(__name__).info("Updating the timetable data")
-
-    with SessionFactory.begin() as session:
-        gimvicurnik: GimVicUrnik = current_app.config["GIMVICURNIK"]
-        updater = TimetableUpdater(gimvicurnik.config.sources.timetable, session)
-        updater.update()
+    update_timetable()
 
 
 # fmt: off
@@ -38,12 +230,7 @@ def update_timetable_command() -> None:
 def update_eclassroom_command(parse_substitutions: bool, parse_lunch_schedules: bool, extract_circulars: bool) -> None:
     """Update data from the e-classroom."""
 
-    logging.getLogger(__name__).info("Updating the e-classroom data")
-
-    with SessionFactory.begin() as session:
-        gimvicurnik: GimVicUrnik = current_app.config["GIMVICURNIK"]
-        updater = EClassroomUpdater(gimvicurnik.config.sources.eclassroom, session, parse_substitutions, parse_lunch_schedules, extract_circulars)
-        updater.update()
+    update_eclassroom(parse_substitutions, parse_lunch_schedules, extract_circulars)
 
 # fmt: on
 
@@ -53,12 +240,7 @@ def update_eclassroom_command(parse_substitutions: bool, parse_lunch_schedules:
 def update_menu_command() -> None:
     """Update snack and lunch menu data ."""
 
-    logging.getLogger(__name__).info("Updating the menu data")
-
-    with SessionFactory.begin() as session:
-        gimvicurnik: GimVicUrnik = current_app.config["GIMVICURNIK"]
-        updater = MenuUpdater(gimvicurnik.config.sources.menu, session)
-        updater.update()
+    update_menu()
 
 
 @click.command("update-solsis", help="Update the Solsis data.")
@@ -75,18 +257,114 @@ def update_solsis_command(date_span: tuple[str, str]) -> None:
         date_from = datetime.strptime(date_span[0], "%Y-%m-%d").date()
         date_to = datetime.strptime(date_span[1], "%Y-%m-%d").date()
 
-    logging.getLogger(__name__).info("Updating the Solsis data (%s - %s)", date_from, date_to)
+    update_solsis(date_from, date_to)
 
-    with SessionFactory.begin() as session:
-        gimvicurnik: GimVicUrnik = current_app.config["GIMVICURNIK"]
-        updater = SolsisUpdater(gimvicurnik.config.sources.solsis, session, date_from, date_to)
-        updater.update()
+
+@click.command("scheduler", help="Run the updaters periodically.")
+def scheduler_command() -> None:
+    """Run the updaters periodically in a single process, so they can reuse connections and the database engine."""
+
+    gimvicurnik: GimVicUrnik = current_app.config["GIMVICURNIK"]
+    config = gimvicurnik.config.scheduler
+
+    def _update_solsis(requests_session: requests.Session | None) -> requests.Session:
+        # The span is 7 days inclusive, same as the default span of the command
+        date_from = datetime.now().date()
+        return update_solsis(date_from, date_from + timedelta(days=6), requests_session)
+
+    # Substitutions are provided by Solsis, so only other e-classroom documents are parsed
+    _update_eclassroom = functools.partial(update_eclassroom, False, True, True)
+
+    # fmt: off
+    jobs: dict[str, tuple[ConfigSchedulerJob, str, Callable[[requests.Session | None], requests.Session]]] = {
+        "timetable": (config.timetable, TimetableUpdater.source, update_timetable),
+        "eclassroom": (config.eclassroom, EClassroomUpdater.source, _update_eclassroom),
+        "menu": (config.menu, MenuUpdater.source, update_menu),
+        "solsis": (config.solsis, SolsisUpdater.source, _update_solsis),
+    }
+    # fmt: on
+
+    scheduler = Scheduler(gimvicurnik.app)
+
+    for name, (job, source, function) in jobs.items():
+        if not job.enabled:
+            continue
+
+        # Intervals that are not configured do not change, so the interval is fixed by default
+        policy = PollingPolicy(
+            interval=job.interval,
+            active_interval=job.activeInterval or job.interval,
+            max_interval=job.maxInterval or job.interval,
+            backoff=job.backoff,
+            active_weekdays=config.activeWeekdays,
+            active_start=config.activeStart,
+            active_end=config.activeEnd,
+            holiday_after=timedelta(days=config.holidayAfter),
+        )
+
+        scheduler.add(name, source, function, policy, job.jitter)
+
+    logging.getLogger(__name__).info("Starting the scheduler")
+    scheduler.run()
+
+
+@click.command("reparse", help="Reparse stored documents.")
+@click.option(
+    "--type",
+    "-t",
+    "type_",
+    type=click.Choice([type_.value for type_ in DocumentType if type_ != DocumentType.TIMETABLE]),
+    required=True,
+    help="Type of documents to reparse.",
+)
+@click.option("--date-span", "-s", nargs=2, type=str, help="Start and end date of documents to reparse.")
+@with_transaction(name="reparse", op="command")
+def reparse_command(type_: str, date_span: tuple[str, str] | None) -> None:
+    """Reparse stored documents from the document store without downloading them."""
+
+    if not get_document_store():
+        raise click.UsageError("Document store is not configured")
+
+    document_type = DocumentType(type_)
+
+    logging.getLogger(__name__).info("Reparsing the %s documents", document_type.value)
+
+    with data_lock(document_type, *CALENDAR_TYPES), export_changes(document_type), render_calendar_changes():
+        with SessionFactory.begin() as session:
+            gimvicurnik: GimVicUrnik = current_app.config["GIMVICURNIK"]
+            sources = gimvicurnik.config.sources
+
+            updater: MenuUpdater | EClassroomUpdater
+            if document_type in (DocumentType.SNACK_MENU, DocumentType.LUNCH_MENU):
+                updater = MenuUpdater(sources.menu, session)
+            else:
+                updater = EClassroomUpdater(sources.eclassroom, session, True, True, True)
+
+            query = session.query(Document).filter(Document.type == document_type)
+
+            # Documents are matched by their effective date or by their created date if they do not have one
+            if date_span:
+                date_from = datetime.strptime(date_span[0], "%Y-%m-%d").date()
+                date_to = datetime.strptime(date_span[1], "%Y-%m-%d").date()
+
+                query = query.filter(
+                    or_(
+                        Document.effective.between(date_from, date_to),
+                        and_(
+                            Document.effective.is_(None),
+                            Document.created >= datetime.combine(date_from, time()),
+                            Document.created < datetime.combine(date_to + timedelta(days=1), time()),
+                        ),
+                    )
+                )
+
+            updater.reparse(query.order_by(Document.effective, Document.created))
 
 
 @click.command("cleanup-database", help="Clean up the database.")
 @with_transaction(name="cleanup-database", op="command")
 def cleanup_database_command() -> None:
-    """Remove lunch schedules, snack menus and lunch menus older than 2 weeks from the database."""
+    """Remove lunch schedules, snack menus, lunch menus, changes and update history older than 2 weeks from the database."""
 
     logging.getLogger(__name__).info("Cleaning up the database")
 
@@ -102,6 +380,25 @@ def cleanup_database_command() -> None:
             )
         ).delete()
 
+        # Clients that have not synced the removed changes need to fetch the data again
+        removed_criterion = Change.time < datetime.now(timezone.utc) - timedelta(weeks=2)
+        removed = session.query(func.max(Change.sequence)).filter(removed_criterion).scalar()
+        session.query(Change).filter(removed_criterion).delete()
+
+        if removed:
+            session.query(ChangeSequence).update({ChangeSequence.removed: removed})
+
+        # Changes are kept for a year, so polling can still back off after long holidays
+        session.query(UpdateHistory).filter(
+            or_(
+                and_(
+                    UpdateHistory.action.not_in(("created", "updated")),
+                    UpdateHistory.time < datetime.now(timezone.utc) - timedelta(weeks=2),
+                ),
+                UpdateHistory.time < datetime.now(timezone.utc) - timedelta(weeks=52),
+            )
+        ).delete()
+
 
 @click.command("create-database", help="Create the database.")
 @click.option("--recreate", help="Remove existing tables before creating new ones.", is_flag=True)
@@ -121,4 +418,86 @@ def create_database_command(ctx: click.Context, recreate: bool) -> None:
             ctx.abort()
 
     logging.getLogger(__name__).info("Creating the database")
+    upgrade_tables(gimvicurnik.engine)
     Base.metadata.create_all(gimvicurnik.engine)
+
+    with SessionFactory.begin() as session:
+        seed_data_versions(session)
+        seed_data_locks(session)
+        seed_change_sequence(session)
+
+    # Materialized data is only refreshed on changes, so it needs to be built for existing data
+    # It is built under data locks, so it does not collide with running updaters
+    with data_lock(*CALENDAR_TYPES):
+        with SessionFactory.begin() as session:
+            resolver = EntityResolver(session)
+            materialize_timetables(session, resolver)
+            refresh_substitutions(session, resolver)
+
+        render_calendars(Session(), gimvicurnik.config.lessonTimes, gimvicurnik.config.calendar)
+        Session.commit()
+        Session.remove()
+
+
+@click.command("export-static", help="Export the data to static files.")
+@click.option(
+    "--directory", "-d", type=str, help="Directory to export to. Defaults to the configured directory."
+)
+@click.option(
+    "--type",
+    "-t",
+    "types",
+    type=click.Choice(DocumentType.values()),
+    multiple=True,
+    help="Data types to export. Defaults to all types.",
+)
+@with_transaction(name="export-static", op="command")
+def export_static_command(directory: str | None, types: tuple[str, ...]) -> None:
+    """Export responses of the data routes to static files that can be served by a web server."""
+
+    gimvicurnik: GimVicUrnik = current_app.config["GIMVICURNIK"]
+    export_config = gimvicurnik.config.export
+
+    if not directory and not export_config:
+        raise click.UsageError("Export directory is neither configured nor specified")
+
+    logging.getLogger(__name__).info("Exporting the data to static files")
+
+    directory = directory or export_config.directory  # type: ignore[union-attr]
+    weeks = export_config.weeks if export_config else 1
+    data_types = [DocumentType(type_) for type_ in types] if types else None
+
+    export_static(gimvicurnik.app, gimvicurnik.handlers, directory, data_types, weeks)
+
+
+@click.command("extraction-cache", help="Inspect and prune the extraction cache.")
+@click.option("--prune", "-p", type=int, help="Evict the least recently used entries above the size in MiB.")
+@click.option("--clear", "-c", help="Remove all entries.", is_flag=True)
+def extraction_cache_command(prune: int | None, clear: bool) -> None:
+    """Show the extraction cache size by extraction kind and optionally prune it."""
+
+    cache = get_extraction_cache()
+
+    if not cache:
+        raise click.UsageError("Extraction cache is not configured")
+
+    if clear:
+        prune = 0
+
+    if prune is not None:
+        removed, freed = cache.prune(prune * 1024 * 1024)
+        click.echo(f"Removed {removed} entries ({freed / 1024 / 1024:.1f} MiB)")
+
+    kinds: dict[str, tuple[int, int]] = {}
+    for kind, _, size, _ in cache.entries():
+        count, total = kinds.get(kind, (0, 0))
+        kinds[kind] = (count + 1, total + size)
+
+    for kind, (count, total) in sorted(kinds.items()):
+        click.echo(f"{kind}: {count} entries ({total / 1024 / 1024:.1f} MiB)")
+
+    count = sum(count for count, _ in kinds.values())
+    total = sum(total for _, total in kinds.values())
+    click.echo(
+        f"Total: {count} entries ({total / 1024 / 1024:.1f} MiB of {cache.max_size / 1024 / 1024:.1f} MiB)"
+    )
@@ -9,7 +9,10 @@
 # =========== CUSTOM CONVERTORS ============
 
 
-def _timedelta_convertor(value: str) -> timedelta:
+def _timedelta_convertor(value: str | timedelta) -> timedelta:
+    if isinstance(value, timedelta):
+        return value
+
     parsed = datetime.strptime(value, "%H%M")
     return timedelta(hours=parsed.hour, minutes=parsed.minute)
 
@@ -36,11 +39,13 @@ class ConfigSourcesEClassroom:
     pluginFileWebserviceUrl: str
     pluginFileNormalUrl: str
     course: int
+    downloadWorkers: int = 4
 
 
 @define(kw_only=True)
 class ConfigSourcesMenu:
     url: str
+    downloadWorkers: int = 4
 
 
 @define(kw_only=True)
@@ -48,6 +53,9 @@ class ConfigSourcesSolsis:
     url: str
     serverName: str
     apiKey: str
+    downloadWorkers: int = 8
+    retries: int = 3
+    timeout: int = 30
 
 
 @define(kw_only=True)
@@ -98,6 +106,94 @@ class ConfigSentry:
     profilerSampleRate: ConfigSentryProfilerSampleRate = Factory(ConfigSentryProfilerSampleRate)
 
 
+# ---- RESPONSE CACHE CONFIG -----
+
+
+@define(kw_only=True)
+class ConfigResponseCache:
+    enabled: bool = True
+    maxEntries: int = 1000
+    ttl: int = 3600
+
+
+# -------- EVENTS CONFIG ---------
+
+
+@define(kw_only=True)
+class ConfigEvents:
+    enabled: bool = True
+    pollInterval: float = 2
+    keepaliveInterval: int = 30
+
+
+# ------- CALENDAR CONFIG --------
+
+
+@define(kw_only=True)
+class ConfigCalendar:
+    pastWeeks: int = 4
+    futureWeeks: int = 4
+
+
+# -------- EXPORT CONFIG ---------
+
+
+@define(kw_only=True)
+class ConfigExport:
+    directory: str
+    weeks: int = 1
+
+
+# ------ EXTRACTION CONFIG -------
+
+
+@define(kw_only=True)
+class ConfigPdfExtraction:
+    workers: int = 2
+    timeout: int = 120
+    memoryLimit: int = 1024
+
+
+@define(kw_only=True)
+class ConfigExtractionCache:
+    directory: str
+    maxSize: int = 256
+
+
+@define(kw_only=True)
+class ConfigDocumentStore:
+    directory: str
+
+
+# ------- SCHEDULER CONFIG -------
+
+
+@define(kw_only=True)
+class ConfigSchedulerJob:
+    enabled: bool = True
+    interval: int
+    activeInterval: int | None = None
+    maxInterval: int | None = None
+    backoff: float = 0.5
+    jitter: int = 0
+
+
+# fmt: off
+
+@define(kw_only=True)
+class ConfigScheduler:
+    timetable: ConfigSchedulerJob = Factory(lambda: ConfigSchedulerJob(interval=3600, maxInterval=21600, jitter=300))
+    eclassroom: ConfigSchedulerJob = Factory(lambda: ConfigSchedulerJob(interval=900, activeInterval=300, maxInterval=14400, jitter=60))
+    menu: ConfigSchedulerJob = Factory(lambda: ConfigSchedulerJob(interval=3600, maxInterval=43200, jitter=300))
+    solsis: ConfigSchedulerJob = Factory(lambda: ConfigSchedulerJob(interval=300, activeInterval=60, maxInterval=3600, jitter=30))
+    activeWeekdays: list[int] = Factory(lambda: [0, 1, 2, 3, 4])
+    activeStart: timedelta = field(default=timedelta(hours=6), converter=_timedelta_convertor)
+    activeEnd: timedelta = field(default=timedelta(hours=14), converter=_timedelta_convertor)
+    holidayAfter: int = 4
+
+# fmt: on
+
+
 # ------ LESSON TIME CONFIG ------
 
 
@@ -117,6 +213,14 @@ class Config:
     urls: ConfigURLs
     database: str
     cors: list[str] = Factory(list)
+    responseCache: ConfigResponseCache = Factory(ConfigResponseCache)
+    events: ConfigEvents = Factory(ConfigEvents)
+    calendar: ConfigCalendar = Factory(ConfigCalendar)
+    export: ConfigExport | None = None
+    pdfExtraction: ConfigPdfExtraction = Factory(ConfigPdfExtraction)
+    extractionCache: ConfigExtractionCache | None = None
+    documentStore: ConfigDocumentStore | None = None
+    scheduler: ConfigScheduler = Factory(ConfigScheduler)
     sentry: ConfigSentry | None = None
     logging: dict | str | None = field(default=None, converter=_identity_convertor)
     lessonTimes: list[ConfigLessonTime]
@@ -1,7 +1,9 @@
 from __future__ import annotations
 
 import enum
-from collections.abc import Iterator
+import heapq
+import json
+from collections.abc import Collection, Iterable, Iterator, Sequence
 from datetime import date as date_, datetime, time as time_
 from typing import Annotated, Any
 
@@ -9,15 +11,15 @@
     Enum,
     ForeignKey,
     Index,
+    JSON,
     SmallInteger,
+    String,
     Text,
-    func,
-    or_,
+    select,
 )
 from sqlalchemy.orm import (
     DeclarativeBase,
     Mapped,
-    aliased,
     mapped_column,
     relationship,
     scoped_session,
@@ -66,6 +68,12 @@ def column(cls) -> Enum:
         return Enum(cls, values_callable=cls.values)
 
 
+def dump_lessons(lessons: Iterable[dict[str, Any]]) -> str:
+    """Serialize lessons in the same format as JSON responses."""
+
+    return json.dumps(list(lessons), sort_keys=True, separators=(",", ":"))
+
+
 class Base(DeclarativeBase):
     pass
 
@@ -87,85 +95,175 @@ class Document(Base):
     content: Mapped[longtext | None]
 
 
+class DataVersion(Base):
+    __tablename__ = "data_versions"
+
+    type: Mapped[DocumentType] = mapped_column(DocumentType.column(), primary_key=True)
+    generation: Mapped[int]
+    modified: Mapped[datetime]
+
+    @classmethod
+    def get_versions(cls, types: Collection[DocumentType]) -> tuple[dict[DocumentType, int], datetime | None]:
+        """Return generations and the last modification datetime of data with the specified types."""
+
+        models = Session.query(DataVersion).filter(DataVersion.type.in_(types)).all()
+
+        generations = {type_: 0 for type_ in types}
+        generations.update({model.type: model.generation for model in models})
+        modified = max((model.modified for model in models), default=None)
+
+        return generations, modified
+
+
+class DataLock(Base):
+    __tablename__ = "data_locks"
+
+    type: Mapped[DocumentType] = mapped_column(DocumentType.column(), primary_key=True)
+    owner: Mapped[str | None] = mapped_column(String(32))
+    expires: Mapped[datetime | None]
+
+
+class SourceValidator(Base):
+    __tablename__ = "source_validators"
+
+    id: Mapped[intpk]
+    url: Mapped[text]
+    etag: Mapped[text | None]
+    last_modified: Mapped[text | None]
+
+
+class UpdateHistory(Base):
+    __tablename__ = "update_history"
+    __table_args__ = (Index("ix_update_history_source_time", "source", "time"),)
+
+    id: Mapped[intpk]
+    source: Mapped[str] = mapped_column(String(32))
+    time: Mapped[datetime]
+
+    type: Mapped[DocumentType | None] = mapped_column(DocumentType.column())
+    url: Mapped[text | None]
+    action: Mapped[str] = mapped_column(String(16))
+
+
+class Change(Base):
+    __tablename__ = "changes"
+
+    id: Mapped[intpk]
+    sequence: Mapped[int | None] = mapped_column(unique=True)
+    time: Mapped[datetime]
+
+    type: Mapped[DocumentType] = mapped_column(DocumentType.column())
+    date: Mapped[date_ | None]
+
+    entity: Mapped[str | None] = mapped_column(String(32))
+    before: Mapped[dict[str, Any] | None] = mapped_column(JSON())
+    after: Mapped[dict[str, Any] | None] = mapped_column(JSON())
+
+    classes: Mapped[list[str] | None] = mapped_column(JSON())
+    teachers: Mapped[list[str] | None] = mapped_column(JSON())
+    classrooms: Mapped[list[str] | None] = mapped_column(JSON())
+
+
+class ChangeSequence(Base):
+    __tablename__ = "change_sequence"
+
+    id: Mapped[intpk]
+    value: Mapped[int]
+    removed: Mapped[int] = mapped_column(default=0)
+
+
 class Entity:
     __tablename__: str
 
     id: Mapped[intpk]
     name: Mapped[text] = mapped_column(unique=True, index=True)
 
+    @classmethod
+    def _get_timetables(cls, names: list[str] | None) -> list[str]:
+        """Get serialized timetables of the entities, or the whole timetable if names are not provided."""
+
+        query = Session.query(MaterializedTimetable.lessons).order_by(MaterializedTimetable.name)
+
+        if names:
+            query = query.filter(
+                MaterializedTimetable.entity == cls.__tablename__,
+                MaterializedTimetable.name.in_(names),
+            )
+        else:
+            query = query.filter(MaterializedTimetable.entity == "all")
+
+        return [model.lessons for model in query]
+
     @classmethod
     def get_lessons(
         cls,
         names: list[str] | None = None,
     ) -> Iterator[dict[str, Any]]:
-        query = (
-            Session.query(Lesson, Class.name, Teacher.name, Classroom.name)
-            .join(Class, isouter=True)
-            .join(Teacher, isouter=True)
-            .join(Classroom, isouter=True)
-            .order_by(Lesson.day, Lesson.time)
-        )
+        timetables = [json.loads(timetable) for timetable in cls._get_timetables(names)]
 
-        if names:
-            query = query.filter(cls.name.in_(names))
+        # Each timetable is already sorted, so they only need to be merged
+        yield from heapq.merge(*timetables, key=lambda lesson: (lesson["day"], lesson["time"]))
 
-        for model in query:
-            yield {
-                "day": model[0].day,
-                "time": model[0].time,
-                "subject": model[0].subject,
-                "class": model[1],
-                "teacher": model[2],
-                "classroom": model[3],
-            }
+    @classmethod
+    def get_lessons_json(
+        cls,
+        names: list[str] | None = None,
+    ) -> str:
+        timetables = cls._get_timetables(names)
+
+        # A single timetable can be served as it was serialized
+        if len(timetables) == 1:
+            return timetables[0]
+
+        return dump_lessons(cls.get_lessons(names))
 
     @classmethod
     def get_substitutions(
         cls,
         dates: list[date_] | None = None,
         names: list[str] | None = None,
+        window: tuple[date_, date_] | None = None,
     ) -> Iterator[dict[str, Any]]:
-        original_teacher = aliased(Teacher)
-        teacher = aliased(Teacher)
-
-        original_classroom = aliased(Classroom)
-        classroom = aliased(Classroom)
-
-        # fmt: off
-        query = (
-            Session.query(Substitution, Class.name, original_teacher.name, original_classroom.name, teacher.name, classroom.name)
-            .join(Class, isouter=True)
-            .join(original_teacher, Substitution.original_teacher_id == original_teacher.id, isouter=True)
-            .join(original_classroom, Substitution.original_classroom_id == original_classroom.id, isouter=True)
-            .join(teacher, Substitution.teacher_id == teacher.id, isouter=True)
-            .join(classroom, Substitution.classroom_id == classroom.id, isouter=True)
-            .order_by(Substitution.day, Substitution.time)
+        # Substitutions are read from the denormalized table, so no joins are needed
+        query = Session.query(DenormalizedSubstitution).order_by(
+            DenormalizedSubstitution.day,
+            DenormalizedSubstitution.time,
+            DenormalizedSubstitution.id,
         )
-        # fmt: on
 
         if dates:
-            query = query.filter(Substitution.date.in_(dates))
+            query = query.filter(DenormalizedSubstitution.date.in_(dates))
+
+        if window:
+            query = query.filter(DenormalizedSubstitution.date.between(*window))
 
         if names:
-            if cls.__tablename__ == "classes":
-                query = query.filter(Class.name.in_(names))
-            elif cls.__tablename__ == "teachers":
-                query = query.filter(or_(original_teacher.name.in_(names), teacher.name.in_(names)))
-            elif cls.__tablename__ == "classrooms":
-                query = query.filter(or_(original_classroom.name.in_(names), classroom.name.in_(names)))
+            # Entities are looked up in the membership index, which also covers original teachers and classrooms
+            members = select(SubstitutionMembership.substitution_id).where(
+                SubstitutionMembership.entity == cls.__tablename__,
+                SubstitutionMembership.name.in_(names),
+            )
+
+            if dates:
+                members = members.where(SubstitutionMembership.date.in_(dates))
+
+            if window:
+                members = members.where(SubstitutionMembership.date.between(*window))
+
+            query = query.filter(DenormalizedSubstitution.id.in_(members))
 
         for model in query:
             yield {
-                "date": model[0].date.isoformat(),
-                "day": model[0].day,
-                "time": model[0].time,
-                "subject": model[0].subject,
-                "notes": model[0].notes,
-                "class": model[1],
-                "original-teacher": model[2],
-                "original-classroom": model[3],
-                "teacher": model[4],
-                "classroom": model[5],
+                "date": model.date.isoformat(),
+                "day": model.day,
+                "time": model.time,
+                "subject": model.subject,
+                "notes": model.notes,
+                "class": model.class_,
+                "original-teacher": model.original_teacher,
+                "original-classroom": model.original_classroom,
+                "teacher": model.teacher,
+                "classroom": model.classroom,
             }
 
 
@@ -181,21 +279,95 @@ class Classroom(Entity, Base):
     __tablename__ = "classrooms"
 
     @classmethod
-    def get_empty(cls) -> Iterator[dict[str, Any]]:
-        days = (1, 5)
-        times = Session.query(func.min(Lesson.time), func.max(Lesson.time))[0]
+    def get_empty(cls, date: date_ | None = None) -> Iterator[dict[str, Any]]:
+        days = [date.isoweekday()] if date else list(range(1, 6))
 
-        if times[0] is None or times[1] is None:
+        # Occupancies without classrooms contain times of all lessons
+        occupancies = (
+            Session.query(ClassroomOccupancy.day, ClassroomOccupancy.occupied, Classroom.name)
+            .join(Classroom, isouter=True)
+            .filter(ClassroomOccupancy.day.in_(days))
+        )
+
+        lessons = 0
+        occupied: dict[tuple[int, str], int] = {}
+
+        for day, mask, classroom in occupancies:
+            if classroom is None:
+                lessons |= mask
+            else:
+                occupied[day, classroom] = mask
+
+        substitutions: Sequence[tuple[int, str | None, str | None, str | None, str | None]] = []
+
+        # Substitutions move lessons out of their original classrooms and into new classrooms
+        if date:
+            substitutions = (
+                Session.query(
+                    DenormalizedSubstitution.time,
+                    DenormalizedSubstitution.original_teacher,
+                    DenormalizedSubstitution.class_,
+                    DenormalizedSubstitution.original_classroom,
+                    DenormalizedSubstitution.classroom,
+                )
+                .filter(DenormalizedSubstitution.date == date)
+                .all()
+            )
+
+            # Substitutions may also be outside the times of lessons
+            for substitution in substitutions:
+                lessons |= 1 << substitution[0]
+
+        if not lessons:
             yield from ()
             return
 
-        classrooms = Session.query(Classroom.name).order_by(Classroom.name).distinct().all()
-        occupied = set(Session.query(Lesson.day, Lesson.time, Classroom.name).join(Classroom).distinct())
+        # Times between the first and the last lesson of any day
+        first, last = (lessons & -lessons).bit_length() - 1, lessons.bit_length() - 1
+        times = (1 << (last + 1)) - (1 << first)
+
+        if substitutions:
+            day = days[0]
+
+            # Substituted lessons of each original classroom by their time
+            moved: dict[tuple[int, str], list[tuple[str | None, str | None]]] = {}
+            for time, original_teacher, class_, original_classroom, _ in substitutions:
+                if original_classroom:
+                    moved.setdefault((time, original_classroom), []).append((original_teacher, class_))
+
+            # Original classrooms stay occupied if any of their lessons at that time is not substituted
+            # Lessons are not needed if no classroom was left, as empty names would get all lessons
+            rooms = sorted({classroom for _, classroom in moved})
+            for lesson in Classroom.get_lessons(rooms) if rooms else ():
+                key = (lesson["time"], lesson["classroom"])
+                if lesson["day"] != day or key not in moved:
+                    continue
+
+                remaining = not any(
+                    teacher in (None, lesson["teacher"]) and class_ in (None, lesson["class"])
+                    for teacher, class_ in moved[key]
+                )
+
+                if remaining:
+                    moved.pop(key)
 
-        for day in range(days[0], days[1] + 1):
-            for time in range(times[0], times[1] + 1):
-                for (classroom,) in classrooms:
-                    if (day, time, classroom) not in occupied:
+            for time, classroom in moved:
+                occupied[day, classroom] = occupied.get((day, classroom), 0) & ~(1 << time)
+
+            for time, _, _, _, classroom in substitutions:
+                if classroom:
+                    occupied[day, classroom] = occupied.get((day, classroom), 0) | (1 << time)
+
+        classrooms = [
+            model.name for model in Session.query(Classroom.name).order_by(Classroom.name).distinct()
+        ]
+
+        for day in days:
+            empty = [(classroom, times & ~occupied.get((day, classroom), 0)) for classroom in classrooms]
+
+            for time in range(first, last + 1):
+                for classroom, mask in empty:
+                    if mask & (1 << time):
                         yield {
                             "day": day,
                             "time": time,
@@ -226,6 +398,30 @@ class Lesson(Base):
     classroom: Mapped[Classroom | None] = relationship(backref="lessons")
 
 
+class MaterializedTimetable(Base):
+    __tablename__ = "materialized_timetables"
+    __table_args__ = (Index("ix_materialized_timetables_entity_name", "entity", "name", unique=True),)
+
+    id: Mapped[intpk]
+    entity: Mapped[str] = mapped_column(String(16))
+    name: Mapped[text]
+    lessons: Mapped[longtext]
+
+
+class ClassroomOccupancy(Base):
+    __tablename__ = "classroom_occupancy"
+
+    id: Mapped[intpk]
+    day: Mapped[smallint] = mapped_column(index=True)
+
+    # Occupancy of times of all lessons if there is no classroom
+    classroom_id: Mapped[classroom_fk | None]
+    classroom: Mapped[Classroom | None] = relationship()
+
+    # A bitmask where each bit represents a lesson time
+    occupied: Mapped[int]
+
+
 class Substitution(Base):
     __tablename__ = "substitutions"
     __table_args__ = (Index("ix_substitutions_day_time", "day", "time"),)
@@ -254,6 +450,65 @@ class Substitution(Base):
     classroom: Mapped[Classroom | None] = relationship(backref="substitutions", foreign_keys=[classroom_id])
 
 
+class DenormalizedSubstitution(Base):
+    __tablename__ = "denormalized_substitutions"
+    __table_args__ = (Index("ix_denormalized_substitutions_date_day_time", "date", "day", "time"),)
+
+    # The same ID as the substitution
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    date: Mapped[date_]
+
+    day: Mapped[smallint]
+    time: Mapped[smallint]
+    subject: Mapped[text | None]
+    notes: Mapped[text | None]
+
+    class_: Mapped[text | None]
+    original_teacher: Mapped[text | None]
+    original_classroom: Mapped[text | None]
+    teacher: Mapped[text | None]
+    classroom: Mapped[text | None]
+
+
+class SubstitutionMembership(Base):
+    __tablename__ = "substitution_memberships"
+    __table_args__ = (Index("ix_substitution_memberships_entity_name_date", "entity", "name", "date"),)
+
+    id: Mapped[intpk]
+    entity: Mapped[str] = mapped_column(String(16))
+    name: Mapped[text]
+    date: Mapped[date_]
+
+    substitution_id: Mapped[int] = mapped_column(
+        ForeignKey("denormalized_substitutions.id", ondelete="CASCADE")
+    )
+
+
+class CalendarFragment(Base):
+    __tablename__ = "calendar_fragments"
+    __table_args__ = (Index("ix_calendar_fragments_class_kind", "class_", "kind", unique=True),)
+
+    id: Mapped[intpk]
+    class_: Mapped[text]
+    kind: Mapped[str] = mapped_column(String(16))
+    content: Mapped[longtext]
+    hash: Mapped[str] = mapped_column(String(64))
+
+    # Fragments need to be rendered again when their window moves
+    rendered: Mapped[date_]
+
+
+class CalendarEvent(Base):
+    __tablename__ = "calendar_events"
+
+    id: Mapped[intpk]
+    uid: Mapped[str] = mapped_column(String(64), unique=True, index=True)
+    hash: Mapped[str] = mapped_column(String(64))
+    since: Mapped[date_ | None]
+    sequence: Mapped[int]
+    modified: Mapped[datetime]
+
+
 class LunchSchedule(Base):
     __tablename__ = "lunch_schedule"
     __table_args__ = (Index("ix_lunch_schedule_date_time", "date", "time"),)
@@ -10,5 +10,6 @@
     LunchScheduleFormatError,
 )
 from .menu import MenuApiError, MenuDateError, MenuFormatError
+from .pdf import PdfError, PdfExtractionError, PdfTimeoutError
 from .solsis import SolsisApiError
 from .timetable import TimetableApiError
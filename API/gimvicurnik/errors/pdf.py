@@ -0,0 +1,13 @@
+from .base import GimVicUrnikError
+
+
+class PdfError(GimVicUrnikError):
+    pass
+
+
+class PdfExtractionError(PdfError):
+    pass
+
+
+class PdfTimeoutError(PdfError):
+    pass
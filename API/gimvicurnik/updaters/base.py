@@ -1,21 +1,37 @@
 from __future__ import annotations
 
+import contextvars
 import datetime
+import os
 import typing
 from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from hashlib import sha256
 from io import BytesIO
+from urllib.parse import urlparse
 
 import attrs
 import requests
 
 from ..database import Document
+from ..utils.database import (
+    EntityResolver,
+    bump_data_version,
+    get_conditional_headers,
+    record_change,
+    record_history,
+    store_validators,
+)
 from ..utils.sentry import sentry_available, with_span
+from ..utils.store import get_document_store
 
 if typing.TYPE_CHECKING:
-    from typing import ClassVar
-    from collections.abc import Iterator
+    from typing import Any, ClassVar
+    from collections.abc import Iterable, Iterator
+    from concurrent.futures import Future
     from logging import Logger
+    from requests import Session as RequestsSession
     from sqlalchemy.orm import Session
     from sentry_sdk.tracing import Span
     from ..database import DocumentType
@@ -54,6 +70,24 @@ class DocumentInfo:
     """
 
 
+@attrs.define(kw_only=True)
+class DocumentContent:
+    stream: BytesIO | None
+    """
+    The document's content stream.
+    Is `None` if the document has not been modified.
+    """
+
+    hash: str | None
+    """
+    The document's content hash.
+    Is `None` if the document has not been modified.
+    """
+
+    headers: dict[str, str]
+    """The response validator headers."""
+
+
 class BaseMultiUpdater(ABC):
     """Base updater for all sources that can provide multiple documents."""
 
@@ -87,46 +121,135 @@ class BaseMultiUpdater(ABC):
     Will be set automatically by the base updater.
     """
 
-    def __init__(self) -> None:
-        self.requests = requests.Session()
+    resolver: EntityResolver
+    """
+    An entity resolver that the updater should use.
+    Will be set automatically by the base updater.
+    """
+
+    download_workers: int
+    """
+    A number of documents that are downloaded in parallel ahead of handling.
+    Will be set automatically by the base updater.
+    """
+
+    failed: bool
+    """
+    Whether handling of any document has failed during the update.
+    Will be set automatically by the base updater.
+    """
+
+    def __init__(self, download_workers: int = 0, requests_session: RequestsSession | None = None) -> None:
+        self.requests = requests_session or requests.Session()
+        self.resolver = EntityResolver(self.session)
+        self.download_workers = download_workers
+        self.failed = False
 
     def update(self) -> None:
         """Get all available documents and update them."""
 
-        for document in self.get_documents():
+        self.failed = False
+
+        if self.download_workers < 1:
+            for document in self.get_documents():
+                self.update_document(document, None)
+            return
+
+        # Documents are downloaded in parallel ahead of time, but handled in their original order
+        # This keeps parsing and database writes serialized, while hiding the network latency
+        pending: deque[tuple[DocumentInfo, Future[DocumentContent] | None]] = deque()
+
+        with ThreadPoolExecutor(self.download_workers, thread_name_prefix=self.source) as executor:
             try:
-                with self.session.begin_nested():
-                    # Decorators that add keyword arguments currently cannot be typed correctly
-                    # This seems to be a limitation of Python's typing system and cannot be resolved
-                    # Until Python/mypy add support for this, we have to ignore call argument types
-                    self.handle_document(document)  # type: ignore[call-arg]
-            except Exception as error:
-                if sentry_available:
-                    import sentry_sdk
-
-                    # fmt: off
-                    sentry_sdk.set_context("document", {
-                        "URL": document.url,
-                        "source": self.source,
-                        "type​": document.type.value,
-                        "format": document.extension,
-                        "created": document.created,
-                        "modified": document.modified,
-                    })
-                    # fmt: on
-
-                    sentry_sdk.set_tag("document_source", self.source)
-                    sentry_sdk.set_tag("document_type", document.type.value)
-                    sentry_sdk.set_tag("document_format", document.extension)
-
-                self.logger.exception(error)
+                for document in self.get_documents():
+                    pending.append((document, self.prefetch_document(executor, document)))
+
+                    if len(pending) > self.download_workers:
+                        self.update_document(*pending.popleft())
+
+            except Exception:
+                # Documents retrieved before the error should still be handled
+                while pending:
+                    self.update_document(*pending.popleft())
+                raise
+
+            while pending:
+                self.update_document(*pending.popleft())
+
+    def prefetch_document(
+        self,
+        executor: ThreadPoolExecutor,
+        document: DocumentInfo,
+    ) -> Future[DocumentContent] | None:
+        """Start downloading the document in the background if it will likely need to be downloaded."""
+
+        if not self.document_needs_parsing(document) and not self.document_needs_extraction(document):
+            return None
+
+        try:
+            effective = self.get_document_effective(document)
+            record = self.retrieve_document(document, effective)
+        except Exception:
+            # Errors will be handled together with the document
+            return None
+
+        if record and not self.document_has_changed(document, record):
+            return None
+
+        headers = self.get_conditional_headers(document, record)
+
+        # Copy the context, so the download span is attached to the current transaction
+        context = contextvars.copy_context()
+        return executor.submit(context.run, self.download_document, document, headers)
+
+    def update_document(self, document: DocumentInfo, prefetched: Future[DocumentContent] | None) -> None:
+        """Handle the document inside a savepoint and log any errors."""
+
+        try:
+            with self.session.begin_nested():
+                # Decorators that add keyword arguments currently cannot be typed correctly
+                # This seems to be a limitation of Python's typing system and cannot be resolved
+                # Until Python/mypy add support for this, we have to ignore call argument types
+                self.handle_document(document, prefetched)  # type: ignore[call-arg]
+        except Exception as error:
+            # Entities created by the document were rolled back
+            self.resolver.clear()
+            self.failed = True
+
+            record_history(self.session, self.source, "crashed", document.type, document.url)
+
+            if sentry_available:
+                import sentry_sdk
+
+                # fmt: off
+                sentry_sdk.set_context("document", {
+                    "URL": document.url,
+                    "source": self.source,
+                    "type​": document.type.value,
+                    "format": document.extension,
+                    "created": document.created,
+                    "modified": document.modified,
+                })
+                # fmt: on
+
+                sentry_sdk.set_tag("document_source", self.source)
+                sentry_sdk.set_tag("document_type", document.type.value)
+                sentry_sdk.set_tag("document_format", document.extension)
+
+            self.logger.exception(error)
 
     @with_span(op="document", pass_span=True)
-    def handle_document(self, document: DocumentInfo, span: Span) -> None:
+    def handle_document(
+        self,
+        document: DocumentInfo,
+        prefetched: Future[DocumentContent] | None,
+        span: Span,
+    ) -> None:
         """
         Store a document to a database and run a parser.
 
-        This function downloads a document and get its content and hash.
+        This function downloads a document (or waits for it to be prefetched)
+        and get its content and hash.
         If the document has been changed or needs parsing, the function
         runs a parser from the subclassed updater. If needed, the function
         updates or creates a correct record in a database.
@@ -198,13 +321,36 @@ def handle_document(self, document: DocumentInfo, span: Span) -> None:
         if changed and (parsable or extractable):
             # Download the document and get its content and hash
             # If this fails, we can't do anything other than to skip the document
-            stream, new_hash = self.download_document(document)
+            if prefetched:
+                download = prefetched.result()
+            else:
+                download = self.download_document(document, self.get_conditional_headers(document, record))
+
+            # The record may have changed since the document was prefetched
+            # If its content cannot be reused anymore, we need to download the document again
+            if download.stream is None and not self.get_conditional_headers(document, record):
+                download = self.download_document(document, {})
 
-            # Check if the document hash or document URL have changed
-            if record and record.parsed and record.hash == new_hash and record.url == document.url:
+            if download.stream is None:
+                # The document has not been modified since the last download
                 changed = False
             else:
-                action = "updated"
+                stream, new_hash = download.stream, download.hash
+
+                # Check if the document hash or document URL have changed
+                if record and record.parsed and record.hash == new_hash and record.url == document.url:
+                    changed = False
+                else:
+                    action = "updated"
+
+                # Store the response validators, so the next download can be conditional
+                store_validators(self.session, document.url, download.headers)
+
+                # Store the raw document, so it can be reparsed without downloading it
+                if typing.TYPE_CHECKING:
+                    assert new_hash
+
+                self.store_document(document, stream, new_hash)
 
         # Skip parsing if the document is unchanged
         if not changed:
@@ -238,6 +384,7 @@ def handle_document(self, document: DocumentInfo, span: Span) -> None:
             span.set_tag("document.effective", _effective)
             span.set_tag("document.action", "skipped")
 
+            record_history(self.session, self.source, "skipped", document.type, document.url)
             return
 
         if parsable:
@@ -266,6 +413,9 @@ def handle_document(self, document: DocumentInfo, span: Span) -> None:
 
         # == DOCUMENT RECORD (SET)
 
+        # Keep the previous state of the record, so the change can be recorded
+        previous = self._summarize_record(record) if record else None
+
         # Create a new document record if needed
         if not record:
             record = Document()
@@ -295,6 +445,10 @@ def handle_document(self, document: DocumentInfo, span: Span) -> None:
 
             self.session.add(record)
 
+            # Notify clients and caches that the data has changed
+            bump_data_version(self.session, document.type)
+            self._record_change(record, previous)
+
         # Update Sentry span tags with new document info
         _effective = record.effective.isoformat() if record.effective else None
         span.set_tag("document.hash", record.hash)
@@ -303,6 +457,9 @@ def handle_document(self, document: DocumentInfo, span: Span) -> None:
         span.set_tag("document.effective", _effective)
         span.set_tag("document.action", action)
 
+        # Record the action, so the polling interval can adapt to how often documents change
+        record_history(self.session, self.source, action, document.type, document.url)
+
         # Log the document status
         # fmt: off
         match (action, effective):
@@ -334,21 +491,159 @@ def retrieve_document(self, document: DocumentInfo, effective: datetime.date | N
 
         return self.session.query(Document).filter(Document.type == document.type, criterion).first()
 
+    def get_conditional_headers(self, document: DocumentInfo, record: Document | None) -> dict[str, str]:
+        """Return headers that make the document download conditional if the stored content can be reused."""
+
+        # Content of documents that were not parsed or that have changed URL cannot be reused
+        if not record or not record.parsed or record.url != document.url:
+            return {}
+
+        return get_conditional_headers(self.session, document.url)
+
     @with_span(op="download")
-    def download_document(self, document: DocumentInfo) -> tuple[BytesIO, str]:
-        """Download a document and return its content stream and hash"""
+    def download_document(self, document: DocumentInfo, headers: dict[str, str]) -> DocumentContent:
+        """Download a document and return its content stream and hash, unless it has not been modified."""
 
         try:
-            response = self.requests.get(self.tokenize_url(document.url))
+            response = self.requests.get(self.tokenize_url(document.url), headers=headers)
             response.raise_for_status()
 
+            validators = {
+                name: response.headers[name] for name in ("ETag", "Last-Modified") if name in response.headers
+            }
+
+            if response.status_code == 304:
+                return DocumentContent(stream=None, hash=None, headers=validators)
+
             content = response.content
             sha = sha256(content).hexdigest()
-            return BytesIO(content), sha
+            return DocumentContent(stream=BytesIO(content), hash=sha, headers=validators)
 
         except OSError as error:
             raise self.error(f"Error while downloading a {document.type.value} document") from error
 
+    def store_document(self, document: DocumentInfo, stream: BytesIO, hash_: str) -> None:
+        """Store the raw document to the document store if it is configured."""
+
+        store = get_document_store()
+
+        if not store:
+            return
+
+        try:
+            store.put(hash_, stream.getvalue())
+        except OSError as error:
+            self.logger.warning("Failed to store the %s document: %s", document.type.value, error)
+
+    def reparse(self, records: Iterable[Document]) -> None:
+        """Parse stored documents again from the document store, without downloading them."""
+
+        store = get_document_store()
+
+        if not store:
+            raise ValueError("Document store is not configured")
+
+        for record in records:
+            content = store.get(record.hash) if record.hash else None
+
+            if content is None:
+                self.logger.warning(
+                    "Skipped because the %s document %s is not stored", record.type.value, record.url
+                )
+                continue
+
+            document = DocumentInfo(
+                url=record.url,
+                type=record.type,
+                title=record.title,
+                created=record.created,
+                modified=record.modified,
+                extension=os.path.splitext(urlparse(record.url).path)[1][1:],
+            )
+
+            try:
+                with self.session.begin_nested():
+                    self.reparse_document(document, record, BytesIO(content))
+            except Exception as error:
+                # Entities created by the document were rolled back
+                self.resolver.clear()
+                self.failed = True
+
+                created = record.created or datetime.datetime.now(datetime.timezone.utc)
+                modified = record.modified or created
+                self._handle_document_error(error, document, record, created, modified, record.effective)
+
+    def reparse_document(self, document: DocumentInfo, record: Document, stream: BytesIO) -> None:
+        """Run the parser and content extraction on the stored document and update its record."""
+
+        self.logger.info("Reparsing a %s document: %s", document.type.value, document.url)
+
+        previous = self._summarize_record(record)
+        content = record.content
+
+        # Parsers record changes of their rows, which are detected by the flag they set on the session
+        recorded = self.session.info.pop("changes", False)
+
+        try:
+            if self.document_needs_parsing(document):
+                # If there is no date, we can't do anything other than to skip the document
+                if not record.effective:
+                    raise ValueError("Missing effective date for a parsable document")
+
+                self.parse_document(document, stream, record.effective)
+                stream.seek(0)
+
+            if self.document_needs_extraction(document):
+                record.content = self.extract_document(document, stream)
+                stream.seek(0)
+
+            parsed = self.session.info.get("changes", False)
+
+        finally:
+            if recorded:
+                self.session.info["changes"] = True
+
+        record.parsed = True
+        self.session.add(record)
+
+        summary = self._summarize_record(record)
+
+        # Documents that have not changed do not need to notify clients and caches
+        if not parsed and summary == previous and record.content == content:
+            return
+
+        bump_data_version(self.session, document.type)
+
+        if summary != previous:
+            self._record_change(record, previous)
+
+    def _summarize_record(self, record: Document) -> dict[str, Any]:
+        """Summarize the document record in the same format as the API responses, without its content."""
+
+        return {
+            "type": record.type.value,
+            "created": record.created.isoformat() if record.created else None,
+            "modified": record.modified.isoformat() if record.modified else None,
+            "effective": record.effective.isoformat() if record.effective else None,
+            "url": record.url,
+            "title": record.title,
+        }
+
+    def _record_change(self, record: Document, previous: dict[str, Any] | None) -> None:
+        """Record the change of the document record, which does not affect any specific entities."""
+
+        record_change(
+            self.session,
+            record.type,
+            record.effective,
+            entity="documents",
+            before=previous,
+            after=self._summarize_record(record),
+            classes=(),
+            teachers=(),
+            classrooms=(),
+        )
+
     def _handle_document_error(
         self,
         error: Exception,
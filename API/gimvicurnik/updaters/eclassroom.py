@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import enum
+import functools
 import logging
 import os
 import re
@@ -10,8 +11,6 @@
 from urllib.parse import urlparse
 
 import mammoth  # type: ignore
-from openpyxl import load_workbook
-from sqlalchemy import insert
 
 from .base import BaseMultiUpdater, DocumentInfo
 from ..database import Class, DocumentType, LunchSchedule, Substitution
@@ -22,7 +21,8 @@
     LunchScheduleFormatError,
     SubstitutionsFormatError,
 )
-from ..utils.database import get_or_create
+from ..utils.database import reconcile_rows, record_row_changes, refresh_substitutions
+from ..utils.extraction import cached_extraction
 from ..utils.normalizers import (
     format_substitution,
     normalize_classroom_name,
@@ -32,11 +32,13 @@
 )
 from ..utils.pdf import extract_tables
 from ..utils.sentry import with_span
+from ..utils.xlsx import extract_rows
 
 if typing.TYPE_CHECKING:
     from typing import Any
     from collections.abc import Iterator
     from io import BytesIO
+    import requests
     from mammoth.documents import Image, Hyperlink  # type: ignore
     from sqlalchemy.orm import Session
     from sentry_sdk.tracing import Span
@@ -64,6 +66,7 @@ def __init__(
         parse_substitutions: bool,
         parse_lunch_schedules: bool,
         extract_circulars: bool,
+        requests_session: requests.Session | None = None,
     ) -> None:
         self.logger = logging.getLogger(__name__)
         self.config = config
@@ -73,7 +76,7 @@ def __init__(
         self.parse_lunch_schedules = parse_lunch_schedules
         self.extract_circulars = extract_circulars
 
-        super().__init__()
+        super().__init__(config.downloadWorkers, requests_session)
 
     def get_documents(self) -> Iterator[DocumentInfo]:
         """Get all documents from the e-classroom."""
@@ -317,7 +320,7 @@ def document_needs_extraction(self, document: DocumentInfo) -> bool:
         return False
 
     @with_span(op="content", pass_span=True)
-    def extract_document(self, document: DocumentInfo, content: bytes, span: Span) -> str | None:  # type: ignore[override]
+    def extract_document(self, document: DocumentInfo, content: BytesIO, span: Span) -> str | None:  # type: ignore[override]
         """Extract the document content and return it as HTML."""
 
         span.set_tag("document.source", self.source)
@@ -331,16 +334,19 @@ def transform_hyperlinks(hyperlink: Hyperlink) -> Hyperlink:
             hyperlink.target_frame = "_blank"
             return hyperlink
 
+        def convert_to_html(stream: BytesIO) -> str:
+            result = mammoth.convert_to_html(
+                stream,
+                convert_image=ignore_images,
+                transform_document=mammoth.transforms.element_of_type(
+                    mammoth.documents.Hyperlink,
+                    transform_hyperlinks,
+                ),
+            )
+            return typing.cast(str, result.value)
+
         # Convert DOCX to HTML
-        result = mammoth.convert_to_html(
-            content,
-            convert_image=ignore_images,
-            transform_document=mammoth.transforms.element_of_type(
-                mammoth.documents.Hyperlink,
-                transform_hyperlinks,
-            ),
-        )
-        return typing.cast(str, result.value)
+        return cached_extraction("docx", convert_to_html, content)
 
     def _parse_substitutions_pdf(self, stream: BytesIO, effective: date) -> None:
         """Parse the substitutions pdf document."""
@@ -361,7 +367,7 @@ def _parse_substitutions_pdf(self, stream: BytesIO, effective: date) -> None:
         last_original_teacher = None
 
         # Extract all tables from a PDF stream
-        tables = with_span(op="extract")(extract_tables)(stream)
+        tables = with_span(op="extract")(cached_extraction)("pdf", extract_tables, stream)
 
         # Parse tables into substitutions
         for table in tables:
@@ -430,7 +436,7 @@ def _parse_substitutions_pdf(self, stream: BytesIO, effective: date) -> None:
                     # fmt: off
                     for class_, classroom in product(classes, classrooms):
                         substitutions.append(format_substitution(
-                            self.session,
+                            self.resolver,
                             effective, day, time,
                             subject, notes,
                             original_teacher, classroom,
@@ -476,7 +482,7 @@ def _parse_substitutions_pdf(self, stream: BytesIO, effective: date) -> None:
                     # fmt: off
                     for class_, original_classroom, classroom in product(classes, original_classrooms, classrooms):
                         substitutions.append(format_substitution(
-                            self.session,
+                            self.resolver,
                             effective, day, time,
                             subject, notes,
                             original_teacher, original_classroom,
@@ -505,7 +511,7 @@ def _parse_substitutions_pdf(self, stream: BytesIO, effective: date) -> None:
                     # fmt: off
                     for class_ in classes:
                         substitutions.append(format_substitution(
-                            self.session,
+                            self.resolver,
                             effective, day, time,
                             subject, notes,
                             original_teacher, original_classroom,
@@ -539,7 +545,7 @@ def _parse_substitutions_pdf(self, stream: BytesIO, effective: date) -> None:
                             continue
 
                         substitutions.append(format_substitution(
-                            self.session,
+                            self.resolver,
                             effective, day, time,
                             subject, notes,
                             original_teacher, original_classroom,
@@ -550,12 +556,17 @@ def _parse_substitutions_pdf(self, stream: BytesIO, effective: date) -> None:
         # Deduplicate substitutions
         substitutions = list({frozenset(subs.items()): subs for subs in substitutions}.values())
 
-        # Remove old substitutions from a database
-        self.session.query(Substitution).filter(Substitution.date == effective).delete()
+        # Store only changed substitutions to a database
+        added, removed, _ = reconcile_rows(  # type: ignore[call-arg]
+            self.session, Substitution, Substitution.date == effective, substitutions
+        )
+        record_row_changes(
+            self.session, self.resolver, DocumentType.SUBSTITUTIONS, Substitution, added, removed
+        )
 
-        # Store new substitutions to a database
-        if substitutions:
-            self.session.execute(insert(Substitution), substitutions)
+        # Keep denormalized substitutions in sync with the changed substitutions
+        if added or removed:
+            refresh_substitutions(self.session, self.resolver, [effective])
 
     def _parse_lunch_schedule_xlsx(self, stream: BytesIO, effective: date) -> None:
         """
@@ -569,43 +580,39 @@ def _parse_lunch_schedule_xlsx(self, stream: BytesIO, effective: date) -> None:
         - Location (Prostor)
         """
 
-        # Extract workbook from an XLSX stream
-        wb = with_span(op="extract")(load_workbook)(stream, data_only=True)
+        # Extract rows from an XLSX stream
+        extract = functools.partial(extract_rows, min_row=3, max_col=5, remove_hidden_columns=True)
+        rows = with_span(op="extract")(cached_extraction)("xlsx-3-5-visible", extract, stream)
 
         lunch_schedule = []
 
         # Parse lunch schedule
-        for ws in wb:
-            for column in ws.column_dimensions.values():
-                if column.hidden:
-                    ws.delete_cols(1)
-
-            for wr in ws.iter_rows(min_row=3, max_col=5):
-                # Check for correct cell value type
-                if typing.TYPE_CHECKING:
-                    assert isinstance(wr[0].value, datetime)  # Time
-                    assert isinstance(wr[1].value, str)  # Notes
-                    assert isinstance(wr[2].value, str)  # Class
-                    assert isinstance(wr[4].value, str)  # Location
-
-                # Ignore empty and header rows
-                if not wr[2].value or "raz" in wr[2].value:
-                    continue
-
-                schedule = {
-                    "date": effective,
-                    "time": wr[0].value if wr[0].value else None,
-                    "notes": wr[1].value.strip() if wr[1].value else None,
-                    "location": wr[4].value.strip() if wr[4].value else None,
-                    "class_id": get_or_create(self.session, model=Class, name=wr[2].value.strip())[0].id
-                    if wr[2].value
-                    else None,
-                }
+        for wr in rows:
+            # Check for correct cell value type
+            if typing.TYPE_CHECKING:
+                assert isinstance(wr[0], datetime)  # Time
+                assert isinstance(wr[1], str)  # Notes
+                assert isinstance(wr[2], str)  # Class
+                assert isinstance(wr[4], str)  # Location
+
+            # Ignore empty and header rows
+            if not wr[2] or "raz" in wr[2]:
+                continue
 
-                lunch_schedule.append(schedule)
+            schedule = {
+                "date": effective,
+                "time": wr[0] if wr[0] else None,
+                "notes": wr[1].strip() if wr[1] else None,
+                "location": wr[4].strip() if wr[4] else None,
+                "class_id": self.resolver.get(Class, wr[2].strip()),
+            }
 
-        wb.close()
+            lunch_schedule.append(schedule)
 
-        # Store schedule to a database
-        self.session.query(LunchSchedule).filter(LunchSchedule.date == effective).delete()
-        self.session.execute(insert(LunchSchedule), lunch_schedule)
+        # Store only changed schedules to a database
+        added, removed, _ = reconcile_rows(  # type: ignore[call-arg]
+            self.session, LunchSchedule, LunchSchedule.date == effective, lunch_schedule
+        )
+        record_row_changes(
+            self.session, self.resolver, DocumentType.LUNCH_SCHEDULE, LunchSchedule, added, removed
+        )
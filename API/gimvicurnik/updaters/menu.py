@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import datetime
+import functools
 import logging
 import os
 import re
@@ -8,19 +9,20 @@
 from urllib.parse import urlparse
 
 from bs4 import BeautifulSoup, ParserRejectedMarkup
-from openpyxl import load_workbook
-from sqlalchemy import insert
-
 from .base import BaseMultiUpdater, DocumentInfo
-from ..database import DocumentType, LunchMenu, SnackMenu
+from ..database import Document, DocumentType, LunchMenu, SnackMenu
 from ..errors import MenuApiError, MenuDateError, MenuFormatError
+from ..utils.database import get_conditional_headers, reconcile_rows, record_row_changes, store_validators
+from ..utils.extraction import cached_extraction
 from ..utils.pdf import extract_tables
 from ..utils.sentry import with_span
+from ..utils.xlsx import extract_rows
 
 if typing.TYPE_CHECKING:
     from typing import Any
-    from collections.abc import Iterator
+    from collections.abc import Iterator, Mapping
     from io import BytesIO
+    import requests
     from sqlalchemy.orm import Session
     from sentry_sdk.tracing import Span
     from ..config import ConfigSourcesMenu
@@ -30,22 +32,57 @@ class MenuUpdater(BaseMultiUpdater):
     source = "website"
     error = MenuApiError
 
-    def __init__(self, config: ConfigSourcesMenu, session: Session):
+    def __init__(
+        self,
+        config: ConfigSourcesMenu,
+        session: Session,
+        requests_session: requests.Session | None = None,
+    ):
         self.logger = logging.getLogger(__name__)
         self.config = config
         self.session = session
 
-        super().__init__()
+        self.index_headers: Mapping[str, str] | None = None
+
+        super().__init__(config.downloadWorkers, requests_session)
+
+    def update(self) -> None:
+        """Update menus and store validators of the menu index if all menus were handled successfully."""
+
+        super().update()
+
+        # Menus that failed before they were stored need to be retried, so the index must be downloaded again
+        if self.index_headers is not None and not self.failed:
+            store_validators(self.session, self.config.url, self.index_headers)
 
     def get_documents(self) -> Iterator[DocumentInfo]:
         """Download and parse the website to retrieve all menu URLs."""
 
+        self.index_headers = None
+
+        # The menu index only needs to be downloaded if it has been modified
+        # However, if any menu has not been parsed successfully, we need to retry it
+        unparsed = (
+            self.session.query(Document.id)
+            .filter(Document.type.in_((DocumentType.SNACK_MENU, DocumentType.LUNCH_MENU)))
+            .filter(Document.parsed.is_not(True))
+            .first()
+        )
+        headers = get_conditional_headers(self.session, self.config.url) if not unparsed else {}
+
         try:
-            response = self.requests.get(self.config.url)
+            response = self.requests.get(self.config.url, headers=headers)
             response.raise_for_status()
         except OSError as error:
             raise MenuApiError("Error while downloading menu index") from error
 
+        if response.status_code == 304:
+            self.logger.info("Skipped because the menu index has not been modified")
+            yield from ()
+            return
+
+        self.index_headers = response.headers
+
         try:
             soup = with_span(op="soup")(BeautifulSoup)(response.text, features="lxml")
         except ParserRejectedMarkup as error:
@@ -154,7 +191,7 @@ def _parse_snack_menu_pdf(self, stream: BytesIO, effective: datetime.date) -> No
         """Parse the snack menu PDF document."""
 
         # Extract all tables from a PDF stream
-        tables = with_span(op="extract")(extract_tables)(stream)
+        tables = with_span(op="extract")(cached_extraction)("pdf", extract_tables, stream)
 
         days = 0
 
@@ -175,21 +212,14 @@ def _parse_snack_menu_pdf(self, stream: BytesIO, effective: datetime.date) -> No
                     "fruitvegetable": row[4],
                 }
 
-                model = self.session.query(SnackMenu).filter(SnackMenu.date == current).first()
-
-                if not model:
-                    model = SnackMenu()
-
-                for key, value in menu.items():
-                    setattr(model, key, value)
-
-                self.session.add(model)
+                self._store_menu(SnackMenu, DocumentType.SNACK_MENU, menu)
 
     def _parse_snack_menu_xlsx(self, stream: BytesIO, effective: datetime.date) -> None:
         """Parse the snack menu XLSX document."""
 
-        # Extract workbook from an XLSX stream
-        wb = with_span(op="extract")(load_workbook)(stream, read_only=True, data_only=True)
+        # Extract rows from an XLSX stream
+        extract = functools.partial(extract_rows, min_row=2, max_col=5)
+        rows = with_span(op="extract")(cached_extraction)("xlsx-2-5", extract, stream)
 
         snack_menu: dict[str, Any] = {
             "normal": [],
@@ -200,66 +230,61 @@ def _parse_snack_menu_xlsx(self, stream: BytesIO, effective: datetime.date) -> N
         days = 0
 
         # Parse menus and store them
-        for ws in wb:
-            for wr in ws.iter_rows(min_row=2, max_col=5):
-                if days == 5:
-                    break
+        for wr in rows:
+            if days == 5:
+                break
 
-                # Ignore blank cells
-                if not wr[1].value:
-                    continue
-
-                # Check for correct cell value type (else mypy complains)
-                if typing.TYPE_CHECKING:
-                    assert isinstance(wr[1].value, str)
-                    assert isinstance(wr[2].value, str)
-                    assert isinstance(wr[3].value, str)
-                    assert isinstance(wr[4].value, str)
-
-                # Ignore information cells
-                if "NV in N" in wr[1].value:
-                    continue
+            # Ignore blank cells
+            if not wr[1]:
+                continue
 
-                if wr[1].value:
-                    snack_menu["normal"].append(wr[1].value.strip())
+            # Check for correct cell value type (else mypy complains)
+            if typing.TYPE_CHECKING:
+                assert isinstance(wr[1], str)
+                assert isinstance(wr[2], str)
+                assert isinstance(wr[3], str)
+                assert isinstance(wr[4], str)
 
-                if wr[2].value:
-                    snack_menu["poultry"].append(wr[2].value.strip())
+            # Ignore information cells
+            if "NV in N" in wr[1]:
+                continue
 
-                if wr[3].value:
-                    snack_menu["vegetarian"].append(wr[3].value.strip())
+            if wr[1]:
+                snack_menu["normal"].append(wr[1].strip())
 
-                if wr[4].value:
-                    snack_menu["fruitvegetable"].append(wr[4].value.strip())
+            if wr[2]:
+                snack_menu["poultry"].append(wr[2].strip())
 
-                # Store the menu after the end of day
-                if wr[1].value.strip() == "med odmori -  sadje na hodnikih":
-                    snack_menu["date"] = effective + datetime.timedelta(days=days)
-                    self.session.query(SnackMenu).filter(SnackMenu.date == snack_menu["date"]).delete()
+            if wr[3]:
+                snack_menu["vegetarian"].append(wr[3].strip())
 
-                    snack_menu["normal"] = "\n".join(snack_menu["normal"])
-                    snack_menu["poultry"] = "\n".join(snack_menu["poultry"])
-                    snack_menu["vegetarian"] = "\n".join(snack_menu["vegetarian"])
-                    snack_menu["fruitvegetable"] = "\n".join(snack_menu["fruitvegetable"])
+            if wr[4]:
+                snack_menu["fruitvegetable"].append(wr[4].strip())
 
-                    self.session.execute(insert(SnackMenu), snack_menu)
+            # Store the menu after the end of day
+            if wr[1].strip() == "med odmori -  sadje na hodnikih":
+                snack_menu["date"] = effective + datetime.timedelta(days=days)
+                snack_menu["normal"] = "\n".join(snack_menu["normal"])
+                snack_menu["poultry"] = "\n".join(snack_menu["poultry"])
+                snack_menu["vegetarian"] = "\n".join(snack_menu["vegetarian"])
+                snack_menu["fruitvegetable"] = "\n".join(snack_menu["fruitvegetable"])
 
-                    # Set for next day
-                    days += 1
-                    snack_menu = {
-                        "normal": [],
-                        "poultry": [],
-                        "vegetarian": [],
-                        "fruitvegetable": [],
-                    }
+                self._store_menu(SnackMenu, DocumentType.SNACK_MENU, snack_menu)
 
-        wb.close()
+                # Set for next day
+                days += 1
+                snack_menu = {
+                    "normal": [],
+                    "poultry": [],
+                    "vegetarian": [],
+                    "fruitvegetable": [],
+                }
 
     def _parse_lunch_menu_pdf(self, stream: BytesIO, effective: datetime.date) -> None:
         """Parse the lunch menu PDF document."""
 
         # Extract all tables from a PDF stream
-        tables = with_span(op="extract")(extract_tables)(stream)
+        tables = with_span(op="extract")(cached_extraction)("pdf", extract_tables, stream)
 
         days = 0
 
@@ -274,25 +299,19 @@ def _parse_lunch_menu_pdf(self, stream: BytesIO, effective: datetime.date) -> No
 
                 menu = {
                     "date": current,
+                    "until": None,
                     "normal": row[1],
                     "vegetarian": row[2],
                 }
 
-                model = self.session.query(LunchMenu).filter(LunchMenu.date == current).first()
-
-                if not model:
-                    model = LunchMenu()
-
-                for key, value in menu.items():
-                    setattr(model, key, value)
-
-                self.session.add(model)
+                self._store_menu(LunchMenu, DocumentType.LUNCH_MENU, menu)
 
     def _parse_lunch_menu_xlsx(self, stream: BytesIO, effective: datetime.date) -> None:
         """Parse the lunch menu XLSX document."""
 
-        # Extract workbook from an XLSX stream
-        wb = with_span(op="extract")(load_workbook)(stream, read_only=True, data_only=True)
+        # Extract rows from an XLSX stream
+        extract = functools.partial(extract_rows, min_row=2, max_col=3)
+        rows = with_span(op="extract")(cached_extraction)("xlsx-2-3", extract, stream)
 
         lunch_menu: dict[str, Any] = {
             "normal": [],
@@ -301,48 +320,55 @@ def _parse_lunch_menu_xlsx(self, stream: BytesIO, effective: datetime.date) -> N
         days = 0
 
         # Parse menus and store them
-        for ws in wb:
-            for wr in ws.iter_rows(min_row=2, max_col=3):
-                if days == 5:
-                    break
+        for wr in rows:
+            if days == 5:
+                break
 
-                # Ignore blank cells
-                if not wr[1].value:
-                    continue
+            # Ignore blank cells
+            if not wr[1]:
+                continue
 
-                # Check for correct cell value type (else mypy complains)
-                if typing.TYPE_CHECKING:
-                    assert isinstance(wr[1].value, str)
-                    assert isinstance(wr[2].value, str)
+            # Check for correct cell value type (else mypy complains)
+            if typing.TYPE_CHECKING:
+                assert isinstance(wr[1], str)
+                assert isinstance(wr[2], str)
 
-                # Ignore information cells
-                if "N KOSILO" in wr[1].value:
-                    continue
+            # Ignore information cells
+            if "N KOSILO" in wr[1]:
+                continue
 
-                if wr[1].value:
-                    lunch_menu["normal"].append(wr[1].value.strip())
+            if wr[1]:
+                lunch_menu["normal"].append(wr[1].strip())
 
-                if wr[2].value:
-                    lunch_menu["vegetarian"].append(wr[2].value.strip())
+            if wr[2]:
+                lunch_menu["vegetarian"].append(wr[2].strip())
 
-                # Store the menu after the end of day
-                if wr[1].value.strip() == "voda ali sok":
-                    lunch_menu["date"] = effective + datetime.timedelta(days=days)
-                    self.session.query(LunchMenu).filter(LunchMenu.date == lunch_menu["date"]).delete()
+            # Store the menu after the end of day
+            if wr[1].strip() == "voda ali sok":
+                lunch_menu["date"] = effective + datetime.timedelta(days=days)
+                lunch_menu["until"] = None
+                lunch_menu["normal"] = "\n".join(lunch_menu["normal"])
+                lunch_menu["vegetarian"] = "\n".join(lunch_menu["vegetarian"])
 
-                    lunch_menu["normal"] = "\n".join(lunch_menu["normal"])
-                    lunch_menu["vegetarian"] = "\n".join(lunch_menu["vegetarian"])
+                self._store_menu(LunchMenu, DocumentType.LUNCH_MENU, lunch_menu)
 
-                    self.session.execute(insert(LunchMenu), lunch_menu)
+                # Set for next day
+                days += 1
+                lunch_menu = {
+                    "normal": [],
+                    "vegetarian": [],
+                }
 
-                    # Set for next day
-                    days += 1
-                    lunch_menu = {
-                        "normal": [],
-                        "vegetarian": [],
-                    }
+    def _store_menu(
+        self,
+        model: type[SnackMenu] | type[LunchMenu],
+        data_type: DocumentType,
+        menu: dict[str, Any],
+    ) -> None:
+        """Replace the menu for its date and record the change if it is different."""
 
-        wb.close()
+        added, removed, _ = reconcile_rows(self.session, model, model.date == menu["date"], [menu])  # type: ignore[call-arg]
+        record_row_changes(self.session, self.resolver, data_type, model, added, removed)
 
     def document_needs_extraction(self, document: DocumentInfo) -> bool:
         """Return whether the document content needs to be extracted."""
@@ -1,17 +1,28 @@
 from __future__ import annotations
 
+import contextvars
 import logging
+import time as time_
 import typing
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date as date_, timedelta
 from hashlib import sha256
 from itertools import product
 from random import getrandbits
 
 import requests
-from sqlalchemy import insert
+from requests.adapters import HTTPAdapter
 
 from ..database import DocumentType, Substitution
 from ..errors import SolsisApiError
+from ..utils.database import (
+    EntityResolver,
+    bump_data_version,
+    reconcile_rows,
+    record_row_changes,
+    record_history,
+    refresh_substitutions,
+)
 from ..utils.normalizers import (
     format_substitution,
     normalize_classroom_name,
@@ -22,6 +33,7 @@
 from ..utils.sentry import sentry_available, with_span
 
 if typing.TYPE_CHECKING:
+    from concurrent.futures import Future
     from sqlalchemy.orm import Session
     from sentry_sdk.tracing import Span
     from ..config import ConfigSourcesSolsis
@@ -115,53 +127,94 @@ def __init__(
         session: Session,
         date_from: date_,
         date_to: date_,
+        requests_session: requests.Session | None = None,
     ) -> None:
         self.logger = logging.getLogger(__name__)
-        self.requests = requests.Session()
         self.config = config
+
+        if requests_session:
+            self.requests = requests_session
+        else:
+            # Keep a connection for each download worker
+            adapter = HTTPAdapter(pool_maxsize=max(config.downloadWorkers, 1))
+            self.requests = requests.Session()
+            self.requests.mount("http://", adapter)
+            self.requests.mount("https://", adapter)
+
         self.session = session
+        self.resolver = EntityResolver(session)
 
         self.date_from = date_from
         self.date_to = date_to
 
+        self.changed = False
+        self.failed = False
+
     def update(self) -> None:
         """Update Solsis files."""
 
         self.update_substitutions()
 
+        # Record a single action for all dates, so the polling interval can adapt to how often substitutions change
+        action = "updated" if self.changed else "crashed" if self.failed else "skipped"
+        record_history(self.session, self.source, action, DocumentType.SUBSTITUTIONS, self.config.url)
+
     def update_substitutions(self) -> None:
         """Update the substitutions from Solsis."""
 
         # Generate span of dates
         dates = [self.date_from + timedelta(days=i) for i in range((self.date_to - self.date_from).days + 1)]
 
-        for date in dates:
-            try:
-                # Update the substitutions for each date
-                self.update_substitutions_for_date(date)  # type: ignore[call-arg]
-            except Exception as error:
-                if sentry_available:
-                    import sentry_sdk
-
-                    # fmt: off
-                    sentry_sdk.set_context("document", {
-                        "URL": self.config.url,
-                        "source": self.source,
-                        "type​": DocumentType.SUBSTITUTIONS.value,
-                        "format": "json",
-                        "effective": date.isoformat()
-                    })
-                    # fmt: on
-
-                    sentry_sdk.set_tag("document_source", self.source)
-                    sentry_sdk.set_tag("document_type", DocumentType.SUBSTITUTIONS.value)
-                    sentry_sdk.set_tag("document_format", "json")
-
-                self.logger.exception(error)
+        if self.config.downloadWorkers < 1:
+            for date in dates:
+                self._update_substitutions_for_date(date, None)
+            return
+
+        # Substitutions for all dates are downloaded in parallel, but stored one after another
+        with ThreadPoolExecutor(self.config.downloadWorkers, thread_name_prefix=self.source) as executor:
+            downloads = {
+                # Copy the context, so the download span is attached to the current transaction
+                date: executor.submit(
+                    contextvars.copy_context().run, self.download_substitutions_for_date, date
+                )
+                for date in dates
+            }
+
+            for date in dates:
+                self._update_substitutions_for_date(date, downloads[date])
+
+    def _update_substitutions_for_date(self, date: date_, download: Future[TypeRoot] | None) -> None:
+        """Update the substitutions for a specific date and log any errors."""
+
+        try:
+            # Update the substitutions for each date
+            self.update_substitutions_for_date(date, download)  # type: ignore[call-arg]
+        except Exception as error:
+            if sentry_available:
+                import sentry_sdk
+
+                # fmt: off
+                sentry_sdk.set_context("document", {
+                    "URL": self.config.url,
+                    "source": self.source,
+                    "type​": DocumentType.SUBSTITUTIONS.value,
+                    "format": "json",
+                    "effective": date.isoformat()
+                })
+                # fmt: on
+
+                sentry_sdk.set_tag("document_source", self.source)
+                sentry_sdk.set_tag("document_type", DocumentType.SUBSTITUTIONS.value)
+                sentry_sdk.set_tag("document_format", "json")
+
+            self.failed = True
+            self.logger.exception(error)
 
     @with_span(op="substitutions", pass_span=True)
-    def update_substitutions_for_date(self, date: date_, span: Span) -> None:
-        """Update the substitutions for a specific date."""
+    def update_substitutions_for_date(
+        self, date: date_, download: Future[TypeRoot] | None, span: Span
+    ) -> None:
+        """Update the substitutions for a specific date, optionally from an already started download."""
 
         self.logger.info("Handling substitutions for %s", date, extra={"date": date})
 
@@ -173,7 +226,10 @@ def update_substitutions_for_date(self, date: date_, span: Span) -> None:
         span.set_tag("document.effective", date.isoformat())
 
         # Download and parse the Solsis JSON
-        response: TypeRoot = self.download_substitutions_for_date(date)
+        if download:
+            response = download.result()
+        else:
+            response = self.download_substitutions_for_date(date)
 
         # Skip empty substitutions as the API returns only the date
         if "nadomescanja" not in response:
@@ -184,7 +240,31 @@ def update_substitutions_for_date(self, date: date_, span: Span) -> None:
 
     @with_span(op="download")
     def download_substitutions_for_date(self, date: date_) -> TypeRoot:
-        """Download and parse the Solsis JSON file."""
+        """Download and parse the Solsis JSON file, retrying on connection and server errors."""
+
+        attempt = 0
+
+        while True:
+            try:
+                return self._download_substitutions_for_date(date)
+
+            except (OSError, ValueError) as error:
+                # Only connection and server errors may be resolved by retrying
+                retryable = isinstance(error, (requests.ConnectionError, requests.Timeout)) or (
+                    isinstance(error, requests.HTTPError)
+                    and error.response is not None
+                    and error.response.status_code >= 500
+                )
+
+                if not retryable or attempt >= self.config.retries:
+                    raise SolsisApiError("Error while downloading substitutions from Solsis API") from error
+
+                self.logger.warning("Retrying the download of substitutions for %s: %s", date, error)
+                time_.sleep(2**attempt)
+                attempt += 1
+
+    def _download_substitutions_for_date(self, date: date_) -> TypeRoot:
+        """Send a single signed request for the Solsis JSON file."""
 
         # Every request needs a different nonsense
         nonsense = f"{getrandbits(128):032x}"
@@ -195,13 +275,10 @@ def download_substitutions_for_date(self, date: date_) -> TypeRoot:
         signature_hash = sha256(signature_string.encode()).hexdigest()
         url = f"{self.config.url}?{params}&signature={signature_hash}"
 
-        try:
-            response = self.requests.get(url)
-            response.raise_for_status()
-            return typing.cast(TypeRoot, response.json())
-
-        except (OSError, ValueError) as error:
-            raise SolsisApiError("Error while downloading substitutions from Solsis API") from error
+        # Stalled connections would otherwise block the download worker forever
+        response = self.requests.get(url, timeout=self.config.timeout)
+        response.raise_for_status()
+        return typing.cast(TypeRoot, response.json())
 
     @with_span(op="parse")
     def parse_substitutions_for_date(self, response: TypeRoot, date: date_) -> None:
@@ -237,7 +314,7 @@ def parse_substitutions_for_date(self, response: TypeRoot, date: date_) -> None:
                 # fmt: off
                 for class_, classroom in product(classes, classrooms):
                     substitutions.append(format_substitution(
-                            self.session,
+                            self.resolver,
                             date, day, time,
                             subject, notes,
                             original_teacher, classroom,
@@ -267,7 +344,7 @@ def parse_substitutions_for_date(self, response: TypeRoot, date: date_) -> None:
             for class_, classroom in product(classes, classrooms):
                 substitutions.append(
                         format_substitution(
-                            self.session,
+                            self.resolver,
                             date, day, time,
                             subject, notes,
                             teacher, classroom,
@@ -310,7 +387,7 @@ def parse_substitutions_for_date(self, response: TypeRoot, date: date_) -> None:
             for class_, original_classroom, classroom in product(classes, original_classrooms, classrooms):
                 substitutions.append(
                         format_substitution(
-                            self.session,
+                            self.resolver,
                             date, day, time,
                             subject, notes,
                             original_teacher, original_classroom,
@@ -346,7 +423,7 @@ def parse_substitutions_for_date(self, response: TypeRoot, date: date_) -> None:
 
                 substitutions.append(
                         format_substitution(
-                            self.session,
+                            self.resolver,
                             date, day, time,
                             subject, notes,
                             teacher, original_classroom,
@@ -358,9 +435,16 @@ def parse_substitutions_for_date(self, response: TypeRoot, date: date_) -> None:
         # Deduplicate substitutions
         substitutions = list({frozenset(subs.items()): subs for subs in substitutions}.values())
 
-        # Remove old substitutions from the database
-        self.session.query(Substitution).filter(Substitution.date == date).delete()
-
-        # Store new substitutions to the database
-        if substitutions:
-            self.session.execute(insert(Substitution), substitutions)
+        # Store only changed substitutions to the database
+        added, removed, _ = reconcile_rows(  # type: ignore[call-arg]
+            self.session, Substitution, Substitution.date == date, substitutions
+        )
+
+        # Notify clients and caches that the substitutions have changed
+        if added or removed:
+            bump_data_version(self.session, DocumentType.SUBSTITUTIONS)
+            record_row_changes(
+                self.session, self.resolver, DocumentType.SUBSTITUTIONS, Substitution, added, removed
+            )
+            refresh_substitutions(self.session, self.resolver, [date])
+            self.changed = True
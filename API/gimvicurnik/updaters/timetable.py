@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import codecs
 import logging
 import re
 import typing
@@ -7,12 +8,22 @@
 from datetime import datetime, timezone
 from hashlib import sha256
 
+import attrs
 import requests
-from sqlalchemy import insert
+from sqlalchemy import true
 
 from ..database import Class, Classroom, Document, DocumentType, Lesson, Teacher
 from ..errors import TimetableApiError
-from ..utils.database import get_or_create
+from ..utils.database import (
+    EntityResolver,
+    bump_data_version,
+    get_conditional_headers,
+    materialize_timetables,
+    reconcile_rows,
+    record_row_changes,
+    record_history,
+    store_validators,
+)
 from ..utils.sentry import sentry_available, with_span
 
 if typing.TYPE_CHECKING:
@@ -22,17 +33,76 @@
     from ..config import ConfigSourcesTimetable
 
 
+class TimetableTokenizer:
+    """
+    Tokenize the timetable JS file line by line.
+
+    Lesson cells are collected by their lesson key, and names of classes,
+    teachers and classrooms are collected from their lists, so the file can
+    be parsed in a single pass while it is being downloaded.
+    """
+
+    statement = re.compile(
+        r"(?:podatki\[(?P<key>\d+)]\[\d] = \"?(?P<cell>[^\"\n]*)\"?)"
+        r"|(?:(?P<list>razredi|ucitelji|ucilnice)\[\d+] = \"(?P<names>[^\"\n]*)\")"
+    )
+
+    def __init__(self) -> None:
+        self.lessons: dict[str, list[str]] = defaultdict(list)
+        self.names: dict[str, set[str]] = {"razredi": set(), "ucitelji": set(), "ucilnice": set()}
+
+    def feed(self, line: str) -> None:
+        """Tokenize a single line of the file."""
+
+        for match in self.statement.finditer(line):
+            if match["key"] is not None:
+                self.lessons[match["key"]].append(match["cell"].strip())
+            else:
+                self.names[match["list"]].update(match["names"].split("~"))
+
+
+@attrs.define(kw_only=True)
+class TimetableChanges:
+    added: list[dict[str, Any]] = attrs.Factory(list)
+    """Lessons that have been added to the timetable."""
+
+    removed: list[dict[str, Any]] = attrs.Factory(list)
+    """Lessons that have been removed from the timetable."""
+
+    classes: set[str] = attrs.Factory(set)
+    """Names of classes whose lessons have changed."""
+
+    teachers: set[str] = attrs.Factory(set)
+    """Names of teachers whose lessons have changed."""
+
+    classrooms: set[str] = attrs.Factory(set)
+    """Names of classrooms whose lessons have changed."""
+
+
 class TimetableUpdater:
     source = "timetable"
 
-    def __init__(self, config: ConfigSourcesTimetable, session: Session) -> None:
+    changes: TimetableChanges
+    """Lessons and entities that have been changed by the last update."""
+
+    def __init__(
+        self,
+        config: ConfigSourcesTimetable,
+        session: Session,
+        requests_session: requests.Session | None = None,
+    ) -> None:
         self.logger = logging.getLogger(__name__)
+        self.requests = requests_session or requests.Session()
         self.config = config
         self.session = session
+        self.resolver = EntityResolver(session)
+        self.changes = TimetableChanges()
 
     def update(self) -> None:
         """Update the timetable."""
 
+        self.changes = TimetableChanges()
+
         try:
             self._handle()  # type: ignore[call-arg]
 
@@ -66,9 +136,6 @@ def _handle(self, span: Span) -> None:
         span.set_tag("document.format", "js")
         span.set_tag("document.action", "crashed")
 
-        # Download the timetable JS and get its hash
-        raw_data, new_hash = self._download()
-
         # Try to find an existing timetable document
         document = (
             self.session.query(Document)
@@ -76,8 +143,33 @@ def _handle(self, span: Span) -> None:
             .first()
         )
 
+        # Download the timetable JS and get its hash, unless it has not been modified
+        # The download can only be conditional if the existing timetable has been parsed
+        headers = get_conditional_headers(self.session, self.config.url) if document and document.hash else {}
+        download = self._download(headers)
+
+        # Skip parsing if the timetable has not been modified
+        if not download:
+            if typing.TYPE_CHECKING:
+                assert document
+
+            self.logger.info("Skipped because the timetable has not been modified")
+            self.logger.debug("Hash: %s", document.hash)
+            self.logger.debug("Last updated: %s", document.modified)
+
+            span.set_tag("document.hash", document.hash)
+            span.set_tag("document.modified", document.modified)
+            span.set_tag("document.action", "skipped")
+
+            record_history(self.session, self.source, "skipped", DocumentType.TIMETABLE, self.config.url)
+            return
+
+        tokens, new_hash, validators = download
+
         # Skip parsing if the timetable is unchanged
         if document and document.hash == new_hash:
+            store_validators(self.session, self.config.url, validators)
+
             self.logger.info("Skipped because the timetable is unchanged")
             self.logger.debug("Hash: %s", document.hash)
             self.logger.debug("Last updated: %s", document.modified)
@@ -86,78 +178,109 @@ def _handle(self, span: Span) -> None:
             span.set_tag("document.modified", document.modified)
             span.set_tag("document.action", "skipped")
 
+            record_history(self.session, self.source, "skipped", DocumentType.TIMETABLE, self.config.url)
             return
 
-        self._parse(document, raw_data, new_hash, span)
+        self._parse(document, tokens, new_hash, span)
+
+        # Store the response validators after parsing, so a failed timetable is downloaded again
+        store_validators(self.session, self.config.url, validators)
 
     @with_span(op="download")
-    def _download(self) -> tuple[str, str]:
-        """Download the timetable JS file."""
+    def _download(self, headers: dict[str, str]) -> tuple[TimetableTokenizer, str, dict[str, str]] | None:
+        """Download and tokenize the timetable JS file, unless it has not been modified."""
+
+        tokenizer = TimetableTokenizer()
+        hasher = sha256()
 
         try:
-            response = requests.get(self.config.url)
-            response.raise_for_status()
-            content = response.content
+            with self.requests.get(self.config.url, headers=headers, stream=True) as response:
+                response.raise_for_status()
+
+                if response.status_code == 304:
+                    return None
+
+                # Hash and tokenize the file while it is being downloaded
+                decoder = codecs.getincrementaldecoder("utf8")()
+                buffer = ""
+
+                for chunk in response.iter_content(chunk_size=65536):
+                    hasher.update(chunk)
+                    buffer += decoder.decode(chunk)
+
+                    *lines, buffer = buffer.split("\n")
+                    for line in lines:
+                        tokenizer.feed(line)
+
+                tokenizer.feed(buffer + decoder.decode(b"", final=True))
 
         except OSError as error:
             raise TimetableApiError("Error while downloading the timetable") from error
 
-        return content.decode("utf8"), sha256(content).hexdigest()
+        validators = {
+            name: response.headers[name] for name in ("ETag", "Last-Modified") if name in response.headers
+        }
+        return tokenizer, hasher.hexdigest(), validators
 
     @with_span(op="parse")
-    def _parse(self, document: Document | None, raw_data: str, new_hash: str, span: Span) -> None:
-        """Parse the timetable JS file and store lessons."""
+    def _parse(
+        self, document: Document | None, tokens: TimetableTokenizer, new_hash: str, span: Span
+    ) -> None:
+        """Parse the tokenized timetable JS file and store lessons."""
+
+        # Split each cell into multiple values separated by a tilde
+        cells = [
+            (
+                lesson,
+                lesson[1].split("~") if lesson[1] else [None],
+                lesson[2].split("~") if lesson[2] else [None],
+                lesson[4].split("~") if lesson[4] else [None],
+            )
+            for lesson in tokens.lessons.values()
+        ]
 
-        # Get raw data from timetable file
-        data = re.findall(r"podatki\[(\d+)]\[\d] = \"?([^\"\n]*)\"?", raw_data, re.MULTILINE)
+        # Get lists of all classes, teachers and classrooms from timetable
+        classes = tokens.names["razredi"]
+        teachers = tokens.names["ucitelji"]
+        classrooms = tokens.names["ucilnice"]
 
-        lessons = defaultdict(list)
-        for key, value in data:
-            lessons[key].append(value.strip())
+        # Store all classes, teachers and classrooms from lists and lessons at once
+        class_ids = self.resolver.resolve(Class, classes.union(*(cell[1] for cell in cells)))
+        teacher_ids = self.resolver.resolve(Teacher, teachers.union(*(cell[2] for cell in cells)))
+        classroom_ids = self.resolver.resolve(Classroom, classrooms.union(*(cell[3] for cell in cells)))
 
         models: list[dict[str, Any]] = []
 
         # Convert raw data into a model
-        for lesson in lessons.values():
-            # Each cell may contain multiple values separated by a tilde
-            classes = lesson[1].split("~") if lesson[1] else [None]
-            teachers = lesson[2].split("~") if lesson[2] else [None]
-            classrooms = lesson[4].split("~") if lesson[4] else [None]
-
+        for lesson, lesson_classes, lesson_teachers, lesson_classrooms in cells:
             # fmt: off
             models.extend(
                 {
-                    "day": lesson[5],
-                    "time": lesson[6],
+                    "day": int(lesson[5]),
+                    "time": int(lesson[6]),
                     "subject": lesson[3] if lesson[3] else None,
-                    "class_id": get_or_create(self.session, model=Class, name=class_)[0].id if class_ else None,
-                    "teacher_id": get_or_create(self.session, model=Teacher, name=teacher)[0].id if teacher else None,
-                    "classroom_id": get_or_create(self.session, model=Classroom, name=classroom)[0].id if classroom else None,
+                    "class_id": class_ids[class_] if class_ else None,
+                    "teacher_id": teacher_ids[teacher] if teacher else None,
+                    "classroom_id": classroom_ids[classroom] if classroom else None,
                 }
-                for class_ in classes
-                for teacher in teachers
-                for classroom in classrooms
+                for class_ in lesson_classes
+                for teacher in lesson_teachers
+                for classroom in lesson_classrooms
             )
             # fmt: on
 
-        # Store timetable lessons
-        self.session.query(Lesson).delete()
-        self.session.execute(insert(Lesson), models)
-
-        # Store a list of all classes from timetable
-        for classes in re.findall(r"razredi\[\d+] = \"([^\"\n]*)\"", raw_data, re.MULTILINE):
-            for class_ in classes.split("~"):
-                get_or_create(self.session, model=Class, name=class_)
-
-        # Store a list of all teachers from timetable
-        for teachers in re.findall(r"ucitelji\[\d+] = \"([^\"\n]*)\"", raw_data, re.MULTILINE):
-            for teacher in teachers.split("~"):
-                get_or_create(self.session, model=Teacher, name=teacher)
-
-        # Store a list of all classrooms from timetable
-        for classrooms in re.findall(r"ucilnice\[\d+] = \"([^\"\n]*)\"", raw_data, re.MULTILINE):
-            for classroom in classrooms.split("~"):
-                get_or_create(self.session, model=Classroom, name=classroom)
+        # Store only changed timetable lessons
+        added, removed, _ = reconcile_rows(self.session, Lesson, true(), models)  # type: ignore[call-arg]
+
+        # Get entities whose lessons have changed
+        changed = added + removed
+        self.changes = TimetableChanges(
+            added=added,
+            removed=removed,
+            classes=self.resolver.get_names(Class, (lesson["class_id"] for lesson in changed)),
+            teachers=self.resolver.get_names(Teacher, (lesson["teacher_id"] for lesson in changed)),
+            classrooms=self.resolver.get_names(Classroom, (lesson["classroom_id"] for lesson in changed)),
+        )
 
         # Update or create a document
         if not document:
@@ -172,8 +295,28 @@ def _parse(self, document: Document | None, raw_data: str, new_hash: str, span:
         document.hash = new_hash
         self.session.add(document)
 
+        # Notify clients and caches that the timetable has changed
+        if changed:
+            bump_data_version(self.session, DocumentType.TIMETABLE)
+            record_row_changes(self.session, self.resolver, DocumentType.TIMETABLE, Lesson, added, removed)
+            materialize_timetables(self.session, self.resolver)
+
         span.set_tag("document.hash", document.hash)
         span.set_tag("document.modified", document.modified)
         span.set_tag("document.action", "created" if created else "updated")
 
-        self.logger.info("Finished updating the timetable")
+        # Record the action, so the polling interval can adapt to how often the timetable changes
+        record_history(
+            self.session,
+            self.source,
+            "created" if created else "updated",
+            DocumentType.TIMETABLE,
+            self.config.url,
+        )
+
+        self.logger.info(
+            "Finished updating the timetable (%s classes, %s teachers and %s classrooms changed)",
+            len(self.changes.classes),
+            len(self.changes.teachers),
+            len(self.changes.classrooms),
+        )
@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import threading
+import time
+import typing
+from collections import OrderedDict
+
+import attrs
+
+if typing.TYPE_CHECKING:
+    from collections.abc import Hashable, Mapping
+    from ..database import DocumentType
+
+
+@attrs.define
+class CachedResponse:
+    version: str
+    """The data version of the response."""
+
+    types: tuple[DocumentType, ...]
+    """Types of data that the response depends on."""
+
+    data: bytes
+    """The response body."""
+
+    mimetype: str | None
+    """The response MIME type."""
+
+    expires: float
+    """The monotonic time when the response expires."""
+
+
+class ResponseCache:
+    """
+    A thread-safe in-memory cache of responses.
+
+    Responses are evicted when they expire, when the cache is full (the least
+    recently used responses first), or when the data they depend on changes.
+    The data changes are detected from data generations, which are stored in
+    the database and therefore shared between all application workers.
+    """
+
+    def __init__(self, max_entries: int, ttl: int) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+        self.entries: OrderedDict[Hashable, CachedResponse] = OrderedDict()
+        self.generations: dict[DocumentType, int] = {}
+        self.lock = threading.Lock()
+
+    def invalidate(self, generations: Mapping[DocumentType, int]) -> None:
+        """Evict all responses that depend on data types whose generations have changed."""
+
+        with self.lock:
+            changed = {
+                type_
+                for type_, generation in generations.items()
+                if self.generations.setdefault(type_, generation) != generation
+            }
+
+            if not changed:
+                return
+
+            for key, entry in list(self.entries.items()):
+                if changed.intersection(entry.types):
+                    del self.entries[key]
+
+            self.generations.update(generations)
+
+    def get(self, key: Hashable, version: str) -> CachedResponse | None:
+        """Get a cached response if it matches the current data version and has not expired."""
+
+        with self.lock:
+            entry = self.entries.get(key)
+
+            if not entry:
+                return None
+
+            if entry.version != version or entry.expires < time.monotonic():
+                del self.entries[key]
+                return None
+
+            self.entries.move_to_end(key)
+            return entry
+
+    def set(
+        self,
+        key: Hashable,
+        version: str,
+        types: tuple[DocumentType, ...],
+        data: bytes,
+        mimetype: str | None,
+    ) -> None:
+        """Store a response and evict the least recently used responses if the cache is full."""
+
+        with self.lock:
+            self.entries[key] = CachedResponse(
+                version=version,
+                types=types,
+                data=data,
+                mimetype=mimetype,
+                expires=time.monotonic() + self.ttl,
+            )
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
@@ -0,0 +1,389 @@
+from __future__ import annotations
+
+import logging
+import typing
+from collections import defaultdict
+from datetime import date, datetime, timedelta, timezone
+from hashlib import sha256
+
+from icalendar import vCalAddress, vCategory, vDatetime, vDuration, vInt, vRecur, vText, vUri
+from sqlalchemy import delete, insert, select
+
+from ..database import CalendarEvent, CalendarFragment, Class
+from .sentry import with_span
+
+if typing.TYPE_CHECKING:
+    from typing import Any
+    from collections.abc import Collection, Iterable, Iterator
+    from sqlalchemy.orm import Session
+    from ..config import ConfigCalendar, ConfigLessonTime
+
+    Property = tuple[str, Any]
+
+# Lines longer than this number of octets must be folded
+_LINE_LIMIT = 75
+
+
+def fold_line(line: str) -> str:
+    """Fold the content line into lines of at most 75 octets without splitting characters."""
+
+    if len(line.encode("utf-8")) <= _LINE_LIMIT:
+        return line + "\r\n"
+
+    lines = []
+    current = ""
+    size = 0
+
+    for char in line:
+        length = len(char.encode("utf-8"))
+
+        # Continuation lines start with a space, which counts towards their length
+        if size + length > _LINE_LIMIT:
+            lines.append(current)
+            current = " "
+            size = 1
+
+        current += char
+        size += length
+
+    lines.append(current)
+    return "\r\n".join(lines) + "\r\n"
+
+
+def format_property(name: str, value: Any) -> str:
+    """Format the property as a folded content line, escaping its value based on its type."""
+
+    # Values that already have icalendar types, such as URIs and addresses, must not be escaped as text
+    if hasattr(value, "to_ical"):
+        pass
+    elif isinstance(value, str):
+        value = vText(value)
+    elif isinstance(value, int):
+        value = vInt(value)
+    elif isinstance(value, datetime):
+        value = vDatetime(value)
+    elif isinstance(value, timedelta):
+        value = vDuration(value)
+    elif isinstance(value, list):
+        value = vCategory(value)
+
+    # Properties whose default value type is not a duration need to declare it
+    if isinstance(value, vDuration) and name not in ("DURATION", "TRIGGER"):
+        name += ";VALUE=DURATION"
+
+    return fold_line(f"{name}:{value.to_ical().decode('utf-8')}")
+
+
+def write_event(properties: Iterable[Property]) -> str:
+    """Write the event with the properties."""
+
+    return "BEGIN:VEVENT\r\n" + "".join(format_property(*prop) for prop in properties) + "END:VEVENT\r\n"
+
+
+def write_calendar(name: str, url: str, events: Iterable[str]) -> Iterator[str]:
+    """Write the calendar with the events, yielding it in parts as events are generated."""
+
+    yield "BEGIN:VCALENDAR\r\n" + "".join(
+        format_property(*prop)
+        for prop in (
+            ("PRODID", "gimvicurnik"),
+            ("VERSION", "2.0"),
+            ("X-WR-TIMEZONE", "Europe/Ljubljana"),
+            ("X-WR-CALNAME", name),
+            ("X-WR-CALDESC", name),
+            ("NAME", name),
+            ("URL", vUri(url)),
+            ("SOURCE", vUri(url)),
+            ("UID", sha256(url.encode("utf-8")).hexdigest()),
+            ("X-PUBLISHED-TTL", vDuration(timedelta(hours=1))),
+            ("REFRESH-INTERVAL", vDuration(timedelta(hours=1))),
+        )
+    )
+
+    yield from events
+    yield "END:VCALENDAR\r\n"
+
+
+def _get_properties(subject: dict[str, Any]) -> list[Property]:
+    # Cancelled lessons and lessons without classrooms do not have all properties
+    properties = [
+        ("SUMMARY", subject["subject"]),
+        ("ATTENDEE", vCalAddress(subject["class"]) if subject["class"] else None),
+        ("ORGANIZER", vCalAddress(subject["teacher"]) if subject["teacher"] else None),
+        ("LOCATION", subject["classroom"]),
+    ]
+
+    return [(name, value) for name, value in properties if value]
+
+
+class EventRevisions:
+    """
+    Track revisions of calendar events, so clients can tell which events have changed.
+
+    Events are identified by stable UIDs, and their revision is increased only
+    when their content changes. The time of the last change is used for their
+    stamps, so rendering unchanged events produces the same content.
+
+    Exclusions of dates before the revision was hashed are not part of its hash,
+    so exclusions that pass or leave the calendar window do not change events.
+    """
+
+    def __init__(self, session: Session) -> None:
+        self.session = session
+        self.events = {model.uid: model for model in session.scalars(select(CalendarEvent))}
+        self.written: set[str] = set()
+        self.today = datetime.now().date()
+
+    def prune(self) -> None:
+        """Remove revisions of events that have not been written, after all calendars have been rendered."""
+
+        for uid, model in self.events.items():
+            if uid not in self.written:
+                self.session.delete(model)
+
+    @staticmethod
+    def digest(properties: list[Property], since: date | None) -> str:
+        """Hash the properties, without exclusions of dates before the provided date."""
+
+        content = "".join(
+            format_property(name, value)
+            for name, value in properties
+            if not (since and name == "EXDATE" and value.date() < since)
+        )
+
+        return sha256(content.encode("utf-8")).hexdigest()
+
+    def write(self, seed: str, properties: list[Property]) -> tuple[str, str]:
+        """Write the event with a UID derived from the seed and return it with the version of its revision."""
+
+        uid = sha256(seed.encode("utf-8")).hexdigest()
+        content = "".join(format_property(*prop) for prop in properties)
+
+        model = self.events.get(uid)
+        self.written.add(uid)
+
+        if not model:
+            model = CalendarEvent(
+                uid=uid,
+                hash=self.digest(properties, self.today),
+                since=self.today,
+                sequence=0,
+                modified=datetime.now(timezone.utc),
+            )
+            self.events[uid] = model
+            self.session.add(model)
+
+        # The previous hash is compared without exclusions that have passed since it was computed
+        elif model.hash != self.digest(properties, model.since):
+            model.hash = self.digest(properties, self.today)
+            model.since = self.today
+            model.sequence += 1
+            model.modified = datetime.now(timezone.utc)
+
+        elif model.since != self.today:
+            model.hash = self.digest(properties, self.today)
+            model.since = self.today
+
+        modified = (
+            model.modified.replace(tzinfo=timezone.utc) if not model.modified.tzinfo else model.modified
+        )
+
+        event = (
+            "BEGIN:VEVENT\r\n"
+            + format_property("UID", uid)
+            + format_property("DTSTAMP", modified)
+            + format_property("LAST-MODIFIED", modified)
+            + format_property("SEQUENCE", model.sequence)
+            + content
+            + "END:VEVENT\r\n"
+        )
+
+        return event, f"{uid}:{model.sequence}"
+
+
+def join_events(events: Iterable[tuple[str, str]]) -> tuple[str, str]:
+    """Join the events into the fragment content and hash their versions, so the hash only changes with events."""
+
+    contents = []
+    versions = []
+
+    for content, version in events:
+        contents.append(content)
+        versions.append(version)
+
+    return "".join(contents), sha256("\n".join(versions).encode("utf-8")).hexdigest()
+
+
+def render_lessons(
+    lessons: Iterable[dict[str, Any]],
+    substitutions: Iterable[dict[str, Any]],
+    times: list[ConfigLessonTime],
+    revisions: EventRevisions,
+    kind: str,
+) -> tuple[str, str]:
+    """Render weekly repeating events of lessons, excluding dates on which the lessons are substituted."""
+
+    today = datetime.now().date()
+    year = today.year if today >= date(today.year, 9, 1) else today.year - 1
+
+    weekdays = ["SU", "MO", "TU", "WE", "TH", "FR", "SA"]
+    weektable: list[list[list[tuple[str, str | None, list[Property]]]]] = [
+        [[] for _ in range(11)] for _ in range(6)
+    ]
+
+    for subject in lessons:
+        slot = weektable[subject["day"]][subject["time"]]
+
+        # Lessons are identified by their time, so changed lessons keep their UIDs
+        # Lessons of split groups at the same time are numbered
+        seed = f"{kind}|{subject['class']}|{subject['day']}|{subject['time']}|{len(slot) + 1}"
+
+        # Lesson "starts" on -08-31, so it can repeat properly
+        start = datetime(year, 8, 31) + times[subject["time"]].start
+
+        # Add lesson to the week table
+        slot.append(
+            (
+                seed,
+                subject["teacher"],
+                [
+                    ("CATEGORIES", ["Lesson", "Normal"]),
+                    ("COLOR", "darkgreen"),
+                    *_get_properties(subject),
+                    ("DURATION", timedelta(minutes=45)),
+                    ("DTSTART", start),
+                    ("EXDATE", start),
+                    # Lesson repeats every week
+                    (
+                        "RRULE",
+                        vRecur(
+                            freq="WEEKLY", byday=weekdays[subject["day"]], until=datetime(year + 1, 6, 25)
+                        ),
+                    ),
+                ],
+            )
+        )
+
+    # Exclude normal lessons at times of substitutions
+    for subject in substitutions:
+        date_ = datetime.strptime(subject["date"], "%Y-%m-%d")
+        slot = weektable[date_.isoweekday()][subject["time"]]
+
+        # Only lessons of the substituted teacher are excluded, unless the substituted lesson is unknown
+        teacher = subject["original-teacher"]
+        originals = [lesson for lesson in slot if not teacher or lesson[1] == teacher] or slot
+
+        exclusion = ("EXDATE", date_ + times[subject["time"]].start)
+
+        for _, _, properties in originals:
+            if exclusion not in properties:
+                properties.append(exclusion)
+
+    return join_events(
+        revisions.write(seed, properties)
+        for events in weektable
+        for slot in events
+        for seed, _, properties in slot
+    )
+
+
+def render_substitutions(
+    substitutions: Iterable[dict[str, Any]],
+    times: list[ConfigLessonTime],
+    revisions: EventRevisions,
+) -> tuple[str, str]:
+    """Render events of substitutions."""
+
+    rendered = []
+    occurrences: dict[str, int] = defaultdict(int)
+
+    for subject in substitutions:
+        # Substitutions are identified by the lesson they substitute, so changed substitutions keep their UIDs
+        seed = (
+            f"substitution|{subject['class']}|{subject['date']}|{subject['time']}"
+            f"|{subject['original-teacher']}|{subject['original-classroom']}"
+        )
+
+        # Substitutions of the same lesson into multiple classrooms are numbered in the order of their IDs
+        occurrences[seed] += 1
+        seed += f"|{occurrences[seed]}"
+
+        date_ = datetime.strptime(subject["date"], "%Y-%m-%d")
+
+        event = [
+            ("CATEGORIES", ["Lesson", "Substitution"]),
+            ("COLOR", "darkred"),
+            ("DESCRIPTION", subject["notes"] or ""),
+            *_get_properties(subject),
+            ("DTSTART", date_ + times[subject["time"]].start),
+            ("DTEND", date_ + times[subject["time"]].end),
+        ]
+
+        rendered.append(revisions.write(seed, event))
+
+    return join_events(rendered)
+
+
+@with_span(op="render")
+def render_calendars(
+    session: Session,
+    times: list[ConfigLessonTime],
+    config: ConfigCalendar,
+    classes: Collection[str] | None = None,
+) -> None:
+    """
+    Render calendar fragments of the specified classes, or of all classes if classes are not provided.
+
+    Each class has fragments with its timetable, its timetable without lessons
+    that are substituted, and its substitutions, so calendar routes only need
+    to concatenate fragments of the requested classes. Only substitutions
+    within the configured window around the current date are included, so
+    lessons are only excluded on dates within the window. Fragment hashes
+    only change when revisions of their events change, so they can be used
+    as ETags. Exclusions that leave the window do not change revisions, but
+    substitutions that leave the window still change their fragments.
+    """
+
+    today = datetime.now().date()
+    window = (today - timedelta(weeks=config.pastWeeks), today + timedelta(weeks=config.futureWeeks))
+
+    rendering_all = classes is None
+
+    if classes is None:
+        classes = list(session.scalars(select(Class.name)))
+        session.execute(delete(CalendarFragment))
+    else:
+        session.execute(delete(CalendarFragment).where(CalendarFragment.class_.in_(classes)))
+
+    revisions = EventRevisions(session)
+    fragments: list[dict[str, Any]] = []
+
+    for class_ in classes:
+        lessons = list(Class.get_lessons([class_]))
+        substitutions = list(Class.get_substitutions(None, [class_], window))
+
+        rendered = {
+            "timetable": render_lessons(lessons, [], times, revisions, "timetable"),
+            "lessons": render_lessons(lessons, substitutions, times, revisions, "lessons"),
+            "substitutions": render_substitutions(substitutions, times, revisions),
+        }
+
+        fragments.extend(
+            {
+                "class_": class_,
+                "kind": kind,
+                "content": content,
+                "hash": hash_,
+                "rendered": today,
+            }
+            for kind, (content, hash_) in rendered.items()
+        )
+
+    if fragments:
+        session.execute(insert(CalendarFragment), fragments)
+
+    # Events that are no longer in any calendar are only known when all calendars are rendered
+    if rendering_all:
+        revisions.prune()
+
+    logging.getLogger(__name__).info("Rendered calendars of %s classes", len(classes))
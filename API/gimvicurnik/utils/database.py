@@ -1,23 +1,754 @@
 from __future__ import annotations
 
+import logging
+import threading
 import typing
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import date as date_, datetime, time as time_, timedelta, timezone
+from time import sleep
+
+from sqlalchemy import delete, event, func, insert, inspect, or_, select, text, update
+from sqlalchemy.exc import IntegrityError
+
+from ..database import (
+    Base,
+    CalendarFragment,
+    Change,
+    ChangeSequence,
+    Class,
+    Classroom,
+    ClassroomOccupancy,
+    DataLock,
+    DataVersion,
+    DenormalizedSubstitution,
+    DocumentType,
+    Lesson,
+    MaterializedTimetable,
+    SessionFactory,
+    SourceValidator,
+    Substitution,
+    SubstitutionMembership,
+    Teacher,
+    UpdateHistory,
+    dump_lessons,
+)
+from .sentry import with_span
 
 if typing.TYPE_CHECKING:
-    from typing import Any, TypeVar
+    from typing import Any
+    from collections.abc import Collection, Iterable, Iterator, Mapping
+    from sqlalchemy import ColumnElement
+    from sqlalchemy.engine import Engine
     from sqlalchemy.orm import Session
-    from ..database import Base
+    from sentry_sdk.tracing import Span
+    from ..database import Entity
+
+
+# Columns of rows that reference entities
+_ENTITY_COLUMNS: dict[str, type[Entity]] = {
+    "class_id": Class,
+    "teacher_id": Teacher,
+    "original_teacher_id": Teacher,
+    "classroom_id": Classroom,
+    "original_classroom_id": Classroom,
+}
+
+
+class EntityResolver:
+    """
+    Resolve entity names to their IDs from memory.
+
+    Names and IDs of all entities of a type are loaded when the type is first
+    used, so resolving names does not require any database queries. Missing
+    entities are created in a single statement. The resolver should be cleared
+    if the transaction that created entities is rolled back.
+    """
+
+    def __init__(self, session: Session) -> None:
+        self.session = session
+        self.ids: dict[type[Entity], dict[str, int]] = {}
+
+    def _load(self, model: type[Entity]) -> dict[str, int]:
+        """Load names and IDs of all entities of the type."""
+
+        if model not in self.ids:
+            self.ids[model] = {name: id_ for name, id_ in self.session.query(model.name, model.id)}
+
+        return self.ids[model]
+
+    def resolve(self, model: type[Entity], names: Iterable[str | None]) -> dict[str, int]:
+        """Create all missing entities with the specified names and return a mapping of names to IDs."""
+
+        ids = self._load(model)
+        missing = {name for name in names if name and name not in ids}
+
+        if missing:
+            self.session.execute(insert(model), [{"name": name} for name in sorted(missing)])
+            query = self.session.query(model.name, model.id).filter(model.name.in_(missing))
+            ids.update({name: id_ for name, id_ in query})
+
+        return ids
+
+    def get(self, model: type[Entity], name: str | None) -> int | None:
+        """Get an ID of the entity with the specified name and create it if it does not exist."""
+
+        if not name:
+            return None
+
+        ids = self._load(model)
+
+        if name not in ids:
+            self.resolve(model, [name])
+
+        return ids[name]
+
+    def get_names(self, model: type[Entity], ids: Iterable[int | None]) -> set[str]:
+        """Get names of the entities with the specified IDs."""
+
+        ids = set(ids)
+        return {name for name, id_ in self._load(model).items() if id_ in ids}
+
+    def get_name_map(self, model: type[Entity]) -> dict[int, str]:
+        """Get names of all entities of the type by their IDs."""
+
+        return {id_: name for name, id_ in self._load(model).items()}
+
+    def clear(self) -> None:
+        """Clear all loaded entities."""
+
+        self.ids.clear()
+
+
+# Tables that are rebuilt from other data by create-database, so they may be recreated
+_DERIVED_TABLES = {
+    model.__tablename__
+    for model in (
+        MaterializedTimetable,
+        ClassroomOccupancy,
+        DenormalizedSubstitution,
+        SubstitutionMembership,
+        CalendarFragment,
+    )
+}
+
+
+def upgrade_tables(engine: Engine) -> None:
+    """
+    Add columns that are missing in existing tables, so databases do not need to be recreated.
+
+    Missing nullable columns are added to their tables. Tables that are rebuilt
+    from other data are recreated if their missing columns cannot be added.
+    Tables that do not exist yet are left to be created with all their columns.
+    """
+
+    logger = logging.getLogger(__name__)
+    inspector = inspect(engine)
+    preparer = engine.dialect.identifier_preparer
+
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        missing = [column for column in table.columns if column.name not in existing]
+
+        if not missing:
+            continue
+
+        if table.name in _DERIVED_TABLES and not all(column.nullable for column in missing):
+            logger.info("Recreating the %s table", table.name)
+            table.drop(engine)
+            table.create(engine)
+            continue
+
+        with engine.begin() as connection:
+            for column in missing:
+                if not column.nullable:
+                    logger.warning("Column %s.%s cannot be added to existing rows", table.name, column.name)
+                    continue
+
+                logger.info("Adding the %s.%s column", table.name, column.name)
+
+                name = preparer.format_table(table)
+                type_ = column.type.compile(dialect=engine.dialect)
+                connection.execute(
+                    text(f"ALTER TABLE {name} ADD COLUMN {preparer.quote(column.name)} {type_}")
+                )
+
+                # Unique columns cannot be added with their constraint, so they are indexed instead
+                if column.unique:
+                    index = preparer.quote(f"uq_{table.name}_{column.name}")
+                    connection.execute(
+                        text(f"CREATE UNIQUE INDEX {index} ON {name} ({preparer.quote(column.name)})")
+                    )
+
+                # Changes were numbered by their IDs before they had sequence numbers
+                if column is Change.__table__.c.sequence:
+                    connection.execute(update(Change).values(sequence=Change.id))
+
+
+def seed_data_versions(session: Session) -> None:
+    """Create missing data versions of all types, so concurrent updaters only need to update them."""
+
+    existing = set(session.scalars(select(DataVersion.type)))
+    modified = datetime.now(timezone.utc)
+
+    for data_type in DocumentType:
+        if data_type not in existing:
+            session.add(DataVersion(type=data_type, generation=0, modified=modified))
+
+
+def seed_change_sequence(session: Session) -> None:
+    """Create the change sequence if it does not exist, continuing after existing changes."""
+
+    if session.scalar(select(ChangeSequence.id)):
+        return
+
+    # Changes recorded before the sequence do not have their rows, so clients need to fetch the data again
+    last = session.scalar(select(func.max(Change.sequence))) or 0
+    session.add(ChangeSequence(value=last, removed=last))
+
+
+def seed_data_locks(session: Session) -> None:
+    """Create missing data locks of all types, so updaters only need to update them."""
+
+    existing = set(session.scalars(select(DataLock.type)))
+
+    for data_type in DocumentType:
+        if data_type not in existing:
+            session.add(DataLock(type=data_type))
+
+
+# Locks of crashed processes are released after this time
+_LOCK_LEASE = timedelta(minutes=5)
+
+# Number of seconds between renewals of held locks
+_LOCK_RENEW = 60.0
+
+# Number of seconds between attempts to acquire a held lock
+_LOCK_RETRY = 1.0
+
+
+def _acquire_data_lock(data_type: DocumentType, owner: str) -> bool:
+    """Try to acquire the data lock of the type and return whether it has been acquired."""
+
+    now = datetime.now(timezone.utc)
+
+    with SessionFactory.begin() as session:
+        result = session.execute(
+            update(DataLock)
+            .where(DataLock.type == data_type, or_(DataLock.owner.is_(None), DataLock.expires < now))
+            .values(owner=owner, expires=now + _LOCK_LEASE)
+        )
+
+        if result.rowcount:  # type: ignore[attr-defined]
+            return True
+
+        if session.get(DataLock, data_type):
+            return False
+
+    # Locks are seeded by create-database, so this only happens in databases created before them
+    try:
+        with SessionFactory.begin() as session:
+            session.add(DataLock(type=data_type, owner=owner, expires=now + _LOCK_LEASE))
+    except IntegrityError:
+        return False
+
+    return True
+
+
+def _renew_data_locks(acquired: list[DocumentType], owner: str, stop: threading.Event) -> None:
+    """Extend leases of the held data locks until stopped, so long updates do not lose them."""
+
+    logger = logging.getLogger(__name__)
+
+    while not stop.wait(_LOCK_RENEW):
+        held = list(acquired)
+
+        if not held:
+            continue
+
+        try:
+            with SessionFactory.begin() as session:
+                result = session.execute(
+                    update(DataLock)
+                    .where(DataLock.type.in_(held), DataLock.owner == owner)
+                    .values(expires=datetime.now(timezone.utc) + _LOCK_LEASE)
+                )
+
+            if result.rowcount != len(held):  # type: ignore[attr-defined]
+                logger.error("Data locks of %s have been lost", ", ".join(type_.value for type_ in held))
+
+        except Exception:
+            logger.exception("Error while renewing data locks")
+
+
+@contextmanager
+def data_lock(*types: DocumentType) -> Iterator[None]:
+    """
+    Hold locks of the data types within the block, so updates of the same data never overlap.
+
+    Locks are stored in the database, so they are shared between scheduler
+    threads and update commands in other processes. They are acquired in a
+    fixed order to prevent deadlocks. Their leases are renewed in the background
+    while they are held, and expire after a few minutes otherwise, so locks of
+    crashed processes do not block updates forever.
+    """
+
+    logger = logging.getLogger(__name__)
+    owner = uuid.uuid4().hex
+    acquired: list[DocumentType] = []
+
+    # Locks that have already been acquired are renewed while waiting for the others
+    stop = threading.Event()
+    heartbeat = threading.Thread(
+        target=_renew_data_locks,
+        args=(acquired, owner, stop),
+        name="data-lock-heartbeat",
+        daemon=True,
+    )
+    heartbeat.start()
+
+    try:
+        for data_type in sorted(set(types), key=lambda type_: type_.value):
+            if not _acquire_data_lock(data_type, owner):
+                logger.info("Waiting for the %s data lock", data_type.value)
+
+                while not _acquire_data_lock(data_type, owner):
+                    sleep(_LOCK_RETRY)
+
+            acquired.append(data_type)
+
+        yield
+
+    finally:
+        stop.set()
+        heartbeat.join()
+
+        if acquired:
+            with SessionFactory.begin() as session:
+                session.execute(
+                    update(DataLock)
+                    .where(DataLock.type.in_(acquired), DataLock.owner == owner)
+                    .values(owner=None, expires=None)
+                )
+
+
+def bump_data_version(session: Session, data_type: DocumentType) -> None:
+    """Increment the data version of the specified type, so clients and caches notice the change."""
+
+    modified = datetime.now(timezone.utc)
+
+    result = session.execute(
+        update(DataVersion)
+        .where(DataVersion.type == data_type)
+        .values(generation=DataVersion.generation + 1, modified=modified)
+    )
+
+    # Versions are seeded by create-database, so this only happens in databases created before them
+    if not result.rowcount:  # type: ignore[attr-defined]
+        session.add(DataVersion(type=data_type, generation=1, modified=modified))
+
+
+def record_change(
+    session: Session,
+    data_type: DocumentType,
+    date: date_ | None = None,
+    entity: str | None = None,
+    before: dict[str, Any] | None = None,
+    after: dict[str, Any] | None = None,
+    classes: Iterable[str] | None = None,
+    teachers: Iterable[str] | None = None,
+    classrooms: Iterable[str] | None = None,
+) -> None:
+    """
+    Record the change of data, so clients can be notified about it.
+
+    Entities that are not provided are unknown, so clients should assume
+    that data of all entities have changed.
+    """
+
+    session.info["changes"] = True
+    session.add(
+        Change(
+            time=datetime.now(timezone.utc),
+            type=data_type,
+            date=date,
+            entity=entity,
+            before=before,
+            after=after,
+            classes=sorted(classes) if classes is not None else None,
+            teachers=sorted(teachers) if teachers is not None else None,
+            classrooms=sorted(classrooms) if classrooms is not None else None,
+        )
+    )
+
+
+def record_row_changes(
+    session: Session,
+    resolver: EntityResolver,
+    data_type: DocumentType,
+    model: type[Base],
+    added: list[dict[str, Any]],
+    removed: list[dict[str, Any]],
+) -> None:
+    """
+    Record rows that have been added or removed by `reconcile_rows` as changes.
+
+    Each row is summarized in the same format as the API responses, with
+    entity IDs replaced by their names, so clients can apply the change to
+    their copy of the data. Removed rows are stored as the state before the
+    change and added rows as the state after the change.
+    """
+
+    names: dict[type[Entity], dict[int, str]] = {
+        entity: resolver.get_name_map(entity) for entity in (Class, Teacher, Classroom)
+    }
+    modified = datetime.now(timezone.utc)
+    changes = []
+
+    for row, is_added in [(row, False) for row in removed] + [(row, True) for row in added]:
+        summary: dict[str, Any] = {}
+        affected: dict[type[Entity], set[str]] = {Class: set(), Teacher: set(), Classroom: set()}
+
+        for key, value in row.items():
+            if key in _ENTITY_COLUMNS:
+                entity = _ENTITY_COLUMNS[key]
+                name = names[entity].get(value) if value is not None else None
+                summary[key.removesuffix("_id").replace("_", "-")] = name
+
+                if name:
+                    affected[entity].add(name)
+
+            elif isinstance(value, time_):
+                summary[key] = value.isoformat("minutes")
+            elif isinstance(value, date_):
+                summary[key] = value.isoformat()
+            else:
+                summary[key] = value
+
+        changes.append(
+            {
+                "time": modified,
+                "type": data_type,
+                "date": row.get("date"),
+                "entity": model.__tablename__,
+                "before": summary if not is_added else None,
+                "after": summary if is_added else None,
+                "classes": sorted(affected[Class]),
+                "teachers": sorted(affected[Teacher]),
+                "classrooms": sorted(affected[Classroom]),
+            }
+        )
+
+    if changes:
+        session.info["changes"] = True
+        session.execute(insert(Change), changes)
+
+
+@event.listens_for(SessionFactory, "before_commit")
+def _assign_change_sequences(session: Session) -> None:
+    """
+    Assign sequence numbers to changes recorded in the transaction when it commits.
+
+    Change IDs are assigned when changes are inserted, so concurrent transactions
+    may make them visible out of order. Sequence numbers are reserved from the
+    sequence row, which stays locked until the commit, so they always increase
+    in the order in which changes become visible, and clients that request
+    changes since a sequence number never miss any.
+    """
+
+    if session.in_nested_transaction() or not session.info.pop("changes", False):
+        return
+
+    # Changes without sequence numbers can only be from this transaction
+    query = select(func.min(Change.id), func.max(Change.id)).where(Change.sequence.is_(None))
+    first, last = typing.cast("tuple[int | None, int]", session.execute(query).one())
+
+    if first is None:
+        return
+
+    size = last - first + 1
+
+    result = session.execute(update(ChangeSequence).values(value=ChangeSequence.value + size))
+    # The sequence is seeded by create-database, so this only happens in databases created before it
+    if not result.rowcount:  # type: ignore[attr-defined]
+        session.add(ChangeSequence(value=size, removed=0))
+        session.flush()
+
+    end = session.execute(select(ChangeSequence.value)).scalar_one()
+    session.execute(
+        update(Change).where(Change.sequence.is_(None)).values(sequence=Change.id - first + end - size + 1)
+    )
+
+
+def refresh_substitutions(
+    session: Session,
+    resolver: EntityResolver,
+    dates: Collection[date_] | None = None,
+) -> None:
+    """
+    Rebuild denormalized substitutions and their memberships for the specified dates.
+
+    Names of all entities are stored in each denormalized substitution, and
+    each substitution is indexed by its class, teachers and classrooms, so
+    substitutions can be retrieved without any joins. Substitutions of all
+    dates are rebuilt if dates are not provided.
+    """
+
+    if dates is not None and not dates:
+        return
+
+    members = delete(SubstitutionMembership)
+    denormalized = delete(DenormalizedSubstitution)
+    query = select(Substitution).order_by(Substitution.id)
+
+    if dates is not None:
+        members = members.where(SubstitutionMembership.date.in_(dates))
+        denormalized = denormalized.where(DenormalizedSubstitution.date.in_(dates))
+        query = query.where(Substitution.date.in_(dates))
+
+    session.execute(members)
+    session.execute(denormalized)
+
+    classes = resolver.get_name_map(Class)
+    teachers = resolver.get_name_map(Teacher)
+    classrooms = resolver.get_name_map(Classroom)
+
+    rows: list[dict[str, Any]] = []
+    memberships: list[dict[str, Any]] = []
+
+    for substitution in session.scalars(query):
+        row = {
+            "id": substitution.id,
+            "date": substitution.date,
+            "day": substitution.day,
+            "time": substitution.time,
+            "subject": substitution.subject,
+            "notes": substitution.notes,
+            "class_": classes.get(substitution.class_id) if substitution.class_id else None,
+            "original_teacher": teachers.get(substitution.original_teacher_id)
+            if substitution.original_teacher_id
+            else None,
+            "original_classroom": classrooms.get(substitution.original_classroom_id)
+            if substitution.original_classroom_id
+            else None,
+            "teacher": teachers.get(substitution.teacher_id) if substitution.teacher_id else None,
+            "classroom": classrooms.get(substitution.classroom_id) if substitution.classroom_id else None,
+        }
+        rows.append(row)
+
+        entities = {
+            ("classes", row["class_"]),
+            ("teachers", row["original_teacher"]),
+            ("teachers", row["teacher"]),
+            ("classrooms", row["original_classroom"]),
+            ("classrooms", row["classroom"]),
+        }
+
+        memberships.extend(
+            {"entity": entity, "name": name, "date": substitution.date, "substitution_id": substitution.id}
+            for entity, name in entities
+            if name
+        )
+
+    if rows:
+        session.execute(insert(DenormalizedSubstitution), rows)
+
+    if memberships:
+        session.execute(insert(SubstitutionMembership), memberships)
+
+
+def materialize_timetables(session: Session, resolver: EntityResolver) -> None:
+    """
+    Rebuild serialized timetables and occupancies of all classes, teachers and classrooms.
+
+    Lessons are serialized in the same format as the API responses and sorted
+    by their day and time, so timetables of single entities can be served
+    directly and timetables of multiple entities only need to be merged.
+    Occupancies of classrooms are stored as bitmasks of lesson times for
+    each day, so empty classrooms can be found with bitwise operations.
+    """
+
+    names = {
+        "classes": resolver.get_name_map(Class),
+        "teachers": resolver.get_name_map(Teacher),
+        "classrooms": resolver.get_name_map(Classroom),
+    }
+
+    timetables: dict[tuple[str, str], list[dict[str, Any]]] = defaultdict(list)
+    occupancies: dict[tuple[int | None, int], int] = defaultdict(int)
+
+    query = select(
+        Lesson.day,
+        Lesson.time,
+        Lesson.subject,
+        Lesson.class_id,
+        Lesson.teacher_id,
+        Lesson.classroom_id,
+    ).order_by(Lesson.day, Lesson.time, Lesson.id)
+
+    for day, time, subject, class_id, teacher_id, classroom_id in session.execute(query):
+        entities = {
+            "classes": names["classes"].get(class_id) if class_id else None,
+            "teachers": names["teachers"].get(teacher_id) if teacher_id else None,
+            "classrooms": names["classrooms"].get(classroom_id) if classroom_id else None,
+        }
+
+        lesson = {
+            "day": day,
+            "time": time,
+            "subject": subject,
+            "class": entities["classes"],
+            "teacher": entities["teachers"],
+            "classroom": entities["classrooms"],
+        }
+
+        timetables["all", ""].append(lesson)
+
+        occupancies[None, day] |= 1 << time
+        if classroom_id:
+            occupancies[classroom_id, day] |= 1 << time
+
+        for entity, name in entities.items():
+            if name:
+                timetables[entity, name].append(lesson)
+
+    session.execute(delete(MaterializedTimetable))
+
+    if timetables:
+        session.execute(
+            insert(MaterializedTimetable),
+            [
+                {"entity": entity, "name": name, "lessons": dump_lessons(lessons)}
+                for (entity, name), lessons in timetables.items()
+            ],
+        )
+
+    session.execute(delete(ClassroomOccupancy))
+
+    if occupancies:
+        session.execute(
+            insert(ClassroomOccupancy),
+            [
+                {"classroom_id": classroom_id, "day": day, "occupied": occupied}
+                for (classroom_id, day), occupied in occupancies.items()
+            ],
+        )
+
+
+def get_conditional_headers(session: Session, url: str) -> dict[str, str]:
+    """Return headers that make the request conditional on validators of the previous response."""
+
+    model = session.query(SourceValidator).filter(SourceValidator.url == url).first()
+    headers = {}
+
+    if model and model.etag:
+        headers["If-None-Match"] = model.etag
+    if model and model.last_modified:
+        headers["If-Modified-Since"] = model.last_modified
+
+    return headers
+
+
+def store_validators(session: Session, url: str, headers: Mapping[str, str]) -> None:
+    """Store validators from the response headers, so the next request can be conditional."""
+
+    model = session.query(SourceValidator).filter(SourceValidator.url == url).first()
+
+    if not model and not headers.get("ETag") and not headers.get("Last-Modified"):
+        return
+
+    if not model:
+        model = SourceValidator(url=url)
+        session.add(model)
+
+    model.etag = headers.get("ETag")
+    model.last_modified = headers.get("Last-Modified")
+
+
+def record_history(
+    session: Session,
+    source: str,
+    action: str,
+    data_type: DocumentType | None = None,
+    url: str | None = None,
+) -> None:
+    """Record the action of the update, so polling intervals can adapt to how often the source changes."""
+
+    session.add(
+        UpdateHistory(source=source, time=datetime.now(timezone.utc), type=data_type, url=url, action=action)
+    )
+
+
+def get_last_change(session: Session, source: str) -> datetime | None:
+    """Return the time when the update of the source last created or updated data."""
+
+    return session.execute(
+        select(func.max(UpdateHistory.time))
+        .where(UpdateHistory.source == source)
+        .where(UpdateHistory.action.in_(("created", "updated")))
+    ).scalar()
+
+
+@with_span(op="reconcile", pass_span=True)
+def reconcile_rows(
+    session: Session,
+    model: type[Base],
+    criterion: ColumnElement[bool],
+    rows: list[dict[str, Any]],
+    span: Span,
+) -> tuple[list[dict[str, Any]], list[dict[str, Any]], int]:
+    """
+    Replace rows that match the criterion with the provided rows.
+
+    Rows are compared by values of all columns except the primary key, and
+    only rows that have been added or removed are inserted or deleted, so
+    unchanged rows are kept intact. Duplicated rows are compared by their
+    count. Returns added rows, removed rows and the number of unchanged rows.
+    """
+
+    mapper = inspect(model)
+    primary = mapper.primary_key[0]
+    columns = [column for column in mapper.columns if not column.primary_key]
+    keys = [column.key for column in columns]
+
+    # Omitted columns are compared and inserted as nulls
+    rows = [{key: row.get(key) for key in keys} for row in rows]
+
+    # Get IDs of existing rows by their keys
+    existing = defaultdict(list)
+    for row in session.execute(select(primary, *columns).where(criterion)):
+        existing[tuple(row[1:])].append(row[0])
+
+    # Get provided rows by their keys
+    provided = defaultdict(list)
+    for row in rows:
+        provided[tuple(row[key] for key in keys)].append(row)
+
+    added = [row for key, group in provided.items() for row in group[len(existing.get(key, ())) :]]
+    removed = {id_: key for key, ids in existing.items() for id_ in ids[len(provided.get(key, ())) :]}
+    unchanged = len(rows) - len(added)
 
-    BaseModel = TypeVar("BaseModel", bound=Base)
+    if removed:
+        session.execute(delete(model).where(primary.in_(removed)))
 
+    if added:
+        session.execute(insert(model), added)
 
-def get_or_create(session: Session, model: type[BaseModel], **kwargs: Any) -> tuple[BaseModel, bool]:
-    """Get SQLAlchemy model or create a new one."""
+    logging.getLogger(__name__).info(
+        "Reconciled %s: %s added, %s removed, %s unchanged",
+        model.__tablename__,
+        len(added),
+        len(removed),
+        unchanged,
+    )
 
-    instance = session.query(model).filter_by(**kwargs).first()
-    if instance:
-        return instance, False
+    span.description = model.__tablename__
+    span.set_tag("rows.added", len(added))
+    span.set_tag("rows.removed", len(removed))
+    span.set_tag("rows.unchanged", unchanged)
 
-    instance = model(**kwargs)
-    session.add(instance)
-    session.flush()
-    return instance, True
+    return added, [dict(zip(keys, key, strict=True)) for key in removed.values()], unchanged
@@ -0,0 +1,167 @@
+from __future__ import annotations
+
+import json
+import logging
+import queue
+import threading
+import time
+import typing
+from collections import defaultdict
+
+from sqlalchemy import func, select
+
+from ..database import Change, SessionFactory
+
+if typing.TYPE_CHECKING:
+    from typing import Any
+    from collections.abc import Iterable, Iterator
+    from sqlalchemy.orm import Session
+
+    ChangeEvent = tuple[int, dict[str, Any]]
+
+
+def get_changes(session: Session, since: int, limit: int = 1000) -> list[Change]:
+    """Get changes committed after the change with the sequence number."""
+
+    query = select(Change).where(Change.sequence > since).order_by(Change.sequence).limit(limit)
+    return list(session.scalars(query))
+
+
+def iter_changes(session: Session, since: int, limit: int = 1000) -> Iterator[Change]:
+    """Iterate over all changes committed after the change with the sequence number, loading them in pages."""
+
+    while True:
+        changes = get_changes(session, since, limit)
+        yield from changes
+
+        if len(changes) < limit:
+            return
+
+        since = typing.cast(int, changes[-1].sequence)
+
+
+def summarize_changes(changes: Iterable[Change]) -> list[ChangeEvent]:
+    """
+    Summarize the changes into one event of each data type.
+
+    Each event contains the affected dates and the affected entities, where
+    entities are `None` if any change affected unknown entities. Events are
+    returned with the sequence number of their last change, ordered by it.
+    """
+
+    groups: dict[str, list[Change]] = defaultdict(list)
+
+    for change in changes:
+        groups[change.type.value].append(change)
+
+    def _merge(values: Iterable[list[str] | None]) -> list[str] | None:
+        merged: set[str] = set()
+
+        for value in values:
+            if value is None:
+                return None
+            merged.update(value)
+
+        return sorted(merged)
+
+    events = [
+        (
+            max(typing.cast(int, change.sequence) for change in group),
+            {
+                "type": type_,
+                "dates": sorted({change.date.isoformat() for change in group if change.date}),
+                "classes": _merge(change.classes for change in group),
+                "teachers": _merge(change.teachers for change in group),
+                "classrooms": _merge(change.classrooms for change in group),
+            },
+        )
+        for type_, group in groups.items()
+    ]
+
+    return sorted(events, key=lambda event: event[0])
+
+
+def format_event(id_: int, data: dict[str, Any]) -> str:
+    """Format the event as a server-sent event message."""
+
+    return f"id: {id_}\nevent: change\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+class ChangeBroadcaster:
+    """
+    Broadcast recorded changes to all subscribers in the current process.
+
+    A single background thread polls the changes table for new changes, so
+    the number of database queries does not depend on the number of connected
+    clients. The thread is started when the first client subscribes. Clients
+    that do not consume their events fast enough are disconnected.
+    """
+
+    def __init__(self, poll_interval: float, max_queued: int = 100) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.poll_interval = poll_interval
+        self.max_queued = max_queued
+
+        self.lock = threading.Lock()
+        self.subscribers: set[queue.Queue[ChangeEvent | None]] = set()
+        self.thread: threading.Thread | None = None
+
+    def subscribe(self) -> queue.Queue[ChangeEvent | None]:
+        """Subscribe to new events. A `None` event means the subscriber has been disconnected."""
+
+        subscriber: queue.Queue[ChangeEvent | None] = queue.Queue(self.max_queued)
+
+        with self.lock:
+            self.subscribers.add(subscriber)
+
+            if not self.thread:
+                self.thread = threading.Thread(target=self._run, name="change-broadcaster", daemon=True)
+                self.thread.start()
+
+        return subscriber
+
+    def unsubscribe(self, subscriber: queue.Queue[ChangeEvent | None]) -> None:
+        """Unsubscribe from new events."""
+
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def publish(self, events: list[ChangeEvent]) -> None:
+        """Publish the events to all subscribers."""
+
+        with self.lock:
+            subscribers = list(self.subscribers)
+
+        for subscriber in subscribers:
+            try:
+                for event in events:
+                    subscriber.put_nowait(event)
+            except queue.Full:
+                # Disconnect the slow subscriber, so it can reconnect and catch up
+                self.unsubscribe(subscriber)
+
+                try:
+                    while True:
+                        subscriber.get_nowait()
+                except queue.Empty:
+                    subscriber.put_nowait(None)
+
+    def _run(self) -> None:
+        last_sequence = None
+
+        while True:
+            try:
+                with SessionFactory() as session:
+                    if last_sequence is None:
+                        last_sequence = session.execute(select(func.max(Change.sequence))).scalar() or 0
+
+                    changes = get_changes(session, last_sequence)
+
+                    if changes:
+                        last_sequence = typing.cast(int, changes[-1].sequence)
+                        self.publish(summarize_changes(changes))
+
+            except Exception:
+                self.logger.exception("Error while broadcasting changes")
+
+            time.sleep(self.poll_interval)
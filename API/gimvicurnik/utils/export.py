@@ -0,0 +1,242 @@
+from __future__ import annotations
+
+import gzip
+import logging
+import os
+import re
+import typing
+from datetime import date, timedelta
+from urllib.parse import unquote
+
+from werkzeug.exceptions import HTTPException
+
+from ..database import (
+    Class,
+    Classroom,
+    DocumentType,
+    LunchMenu,
+    LunchSchedule,
+    Session,
+    SnackMenu,
+    Substitution,
+    Teacher,
+)
+from .dates import get_weekdays
+
+if typing.TYPE_CHECKING:
+    from typing import Any
+    from collections.abc import Collection, Iterator
+    from flask import Flask
+    from werkzeug.routing import MapAdapter, Rule
+    from ..blueprints.base import BaseHandler
+    from ..database import Entity
+
+try:
+    import brotli  # type: ignore
+except ImportError:
+    brotli = None
+
+__all__ = ["export_static"]
+
+# Entities that can be provided as route list arguments
+_entities: dict[str, type[Entity]] = {
+    "classes": Class,
+    "teachers": Teacher,
+    "classrooms": Classroom,
+}
+
+# Dates of data that can be provided as route date arguments
+_dates = {
+    DocumentType.SUBSTITUTIONS: Substitution.date,
+    DocumentType.LUNCH_SCHEDULE: LunchSchedule.date,
+    DocumentType.SNACK_MENU: SnackMenu.date,
+    DocumentType.LUNCH_MENU: LunchMenu.date,
+}
+
+
+def _get_names(argument: str) -> list[str]:
+    """Get entity names that can be safely used as file names."""
+
+    names = [
+        model.name for model in Session.query(_entities[argument].name).order_by(_entities[argument].name)
+    ]
+    return [name for name in names if "/" not in name and not name.startswith(".")]
+
+
+def _get_dates(types: Collection[DocumentType], since: date, weekly: bool) -> list[date]:
+    """Get dates for which data of the specified types exist."""
+
+    dates: set[date] = set()
+
+    for type_ in types:
+        if type_ not in _dates:
+            continue
+
+        column = _dates[type_]
+        dates.update(model[0] for model in Session.query(column).filter(column >= since).distinct())
+
+    # Weekly routes return the same data for all dates of the week
+    if weekly:
+        dates = {get_weekdays(date_)[0] for date_ in dates}
+
+    return sorted(dates)
+
+
+def _get_values(rule: Rule, types: Collection[DocumentType], since: date) -> Iterator[dict[str, Any]]:
+    """Get all route argument combinations of the rule that should be exported."""
+
+    values: list[dict[str, Any]] = [{}]
+
+    for converter, argument in re.findall(r"<(?:(\w+):)?(\w+)>", rule.rule):
+        # Multiple entities can be requested at once, but we only export single entities
+        if converter == "list" and argument in _entities:
+            choices: list[Any] = [[name] for name in _get_names(argument)]
+        elif converter == "date":
+            choices = _get_dates(types, since, weekly="/week/" in rule.rule)
+        else:
+            return
+
+        values = [{**value, argument: choice} for value in values for choice in choices]
+
+    yield from values
+
+
+def _write_file(path: str, data: bytes) -> bool:
+    """Atomically write the file and its precompressed variants if its content has changed."""
+
+    try:
+        with open(path, "rb") as file:
+            if file.read() == data:
+                return False
+    except OSError:
+        pass
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    variants = [(path + ".gz", gzip.compress(data, 9, mtime=0))]
+    if brotli:
+        variants.append((path + ".br", brotli.compress(data)))
+
+    # Write compressed variants before the file, so they are never older than it
+    for variant, content in [*variants, (path, data)]:
+        with open(variant + ".tmp", "wb") as file:
+            file.write(content)
+        os.replace(variant + ".tmp", variant)
+
+    return True
+
+
+def _remove_stale_files(
+    adapter: MapAdapter,
+    directory: str,
+    prefixes: Collection[str],
+    endpoints: Collection[str],
+    exported: Collection[str],
+    since: date,
+) -> int:
+    """Remove files of the exported endpoints that were not exported, and return the number of removed files."""
+
+    removed = 0
+    checked: set[str] = set()
+
+    for prefix in prefixes:
+        for root, _, files in os.walk(os.path.join(directory, *prefix.strip("/").split("/"))):
+            for name in files:
+                # Compressed variants are checked together with their file
+                path = os.path.join(root, name)
+                path = path.removesuffix(".gz").removesuffix(".br")
+
+                if not path.endswith(".json") or path in checked or path in exported:
+                    continue
+
+                checked.add(path)
+                url = "/" + os.path.relpath(path, directory).removesuffix(".json").replace(os.sep, "/")
+
+                try:
+                    endpoint, values = adapter.match(url)
+                except HTTPException:
+                    continue
+
+                # Files of other routes and dates before the exported range are kept
+                if endpoint not in endpoints:
+                    continue
+                if any(isinstance(value, date) and value < since for value in values.values()):
+                    continue
+
+                for variant in (path, path + ".gz", path + ".br"):
+                    try:
+                        os.remove(variant)
+                    except FileNotFoundError:
+                        pass
+
+                removed += 1
+
+    return removed
+
+
+def export_static(
+    app: Flask,
+    handlers: list[type[BaseHandler]],
+    directory: str,
+    types: Collection[DocumentType] | None = None,
+    weeks: int = 1,
+) -> None:
+    """
+    Export responses of data routes to a directory tree that mirrors the URL space.
+
+    Each route is written to a file with a `.json` extension, together with
+    precompressed `.json.gz` and (if brotli is installed) `.json.br` variants,
+    so it can be served directly by a web server. Only routes of handlers that
+    depend on the specified data types are exported, and only dates since the
+    specified number of weeks in the past are included. Files of exported
+    routes that no longer have data, such as dates whose substitutions have
+    been removed or entities that no longer exist, are removed.
+    """
+
+    logger = logging.getLogger(__name__)
+
+    since = get_weekdays(date.today())[0] - timedelta(weeks=weeks)
+    client = app.test_client()
+    adapter = app.url_map.bind("localhost")
+
+    written = 0
+    skipped = 0
+
+    # Paths and routes that were exported, so files from earlier exports can be removed
+    exported: set[str] = set()
+    endpoints: set[str] = set()
+    prefixes: set[str] = set()
+
+    for handler in handlers:
+        if not handler.data_types or (types is not None and not set(handler.data_types) & set(types)):
+            continue
+
+        for rule in app.url_map.iter_rules():
+            if not rule.endpoint.startswith(handler.name + "."):
+                continue
+
+            endpoints.add(rule.endpoint)
+            if "<" in rule.rule:
+                prefixes.add(rule.rule[: rule.rule.index("<")].rsplit("/", 1)[0])
+
+            for values in _get_values(rule, handler.data_types, since):
+                url = adapter.build(rule.endpoint, values)
+                path = os.path.join(directory, *unquote(url).strip("/").split("/")) + ".json"
+                response = client.get(url)
+
+                if response.status_code != 200 or response.mimetype != "application/json":
+                    logger.warning("Skipped exporting %s because it is not a JSON response", url)
+                    continue
+
+                exported.add(path)
+
+                if _write_file(path, response.get_data()):
+                    written += 1
+                else:
+                    skipped += 1
+
+    removed = _remove_stale_files(adapter, directory, prefixes, endpoints, exported, since)
+
+    logger.info(
+        "Exported %s files, skipped %s unchanged files and removed %s stale files", written, skipped, removed
+    )
@@ -0,0 +1,181 @@
+from __future__ import annotations
+
+import logging
+import os
+import pickle
+import tempfile
+import threading
+import typing
+from functools import cache
+from hashlib import sha256
+from importlib import metadata
+
+if typing.TYPE_CHECKING:
+    from typing import Any, TypeVar
+    from collections.abc import Callable, Iterator
+    from io import BytesIO
+
+    T = TypeVar("T")
+
+# Version of the extractors, which must be increased when their output changes
+_EXTRACTOR_VERSION = 1
+
+# Libraries whose versions may change the output of the extractors
+_EXTRACTOR_LIBRARIES = ("pdfplumber", "pdfminer.six", "openpyxl", "mammoth")
+
+# Number of stored entries after which the cache size is checked again
+_PRUNE_INTERVAL = 32
+
+
+class ExtractionCache:
+    """
+    An on-disk cache of content extracted from documents.
+
+    Entries are addressed by the kind of extraction and the SHA-256 hash of
+    the document content, so the same document is never extracted twice.
+    Each entry is stored as a pickle file, and the least recently used
+    entries are evicted when the total size exceeds the maximum size, which
+    is checked on the first and then on every few stored entries.
+    """
+
+    def __init__(self, directory: str, max_size: int) -> None:
+        self.directory = directory
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.writes = 0
+
+    def _path(self, kind: str, key: str) -> str:
+        return os.path.join(self.directory, kind, key[:2], key + ".pickle")
+
+    def get(self, kind: str, key: str) -> Any | None:
+        """Get the extracted content if it is cached and mark it as recently used."""
+
+        path = self._path(kind, key)
+
+        try:
+            with open(path, "rb") as file:
+                value = pickle.load(file)
+            os.utime(path)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+
+        return value
+
+    def set(self, kind: str, key: str, value: Any) -> None:
+        """Store the extracted content and evict the least recently used entries if needed."""
+
+        path = self._path(kind, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write to a temporary file first, so other processes never read partial entries
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), suffix=".tmp", delete=False) as file:
+            pickle.dump(value, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(file.name, path)
+
+        # Walking the whole cache is expensive, so the size is not checked on every write
+        with self.lock:
+            self.writes += 1
+            due = self.writes % _PRUNE_INTERVAL == 1
+
+        if due:
+            self.prune(self.max_size)
+
+    def entries(self) -> Iterator[tuple[str, str, int, float]]:
+        """Iterate over the kind, key, size and last used time of all entries."""
+
+        if not os.path.isdir(self.directory):
+            return
+
+        for kind in sorted(os.listdir(self.directory)):
+            for root, _, files in os.walk(os.path.join(self.directory, kind)):
+                for name in files:
+                    if not name.endswith(".pickle"):
+                        continue
+
+                    try:
+                        stat = os.stat(os.path.join(root, name))
+                    except OSError:
+                        continue
+
+                    yield kind, name.removesuffix(".pickle"), stat.st_size, stat.st_mtime
+
+    def prune(self, max_size: int) -> tuple[int, int]:
+        """Evict the least recently used entries until the total size is within the limit."""
+
+        with self.lock:
+            entries = sorted(self.entries(), key=lambda entry: entry[3])
+            size = sum(entry[2] for entry in entries)
+
+            removed = 0
+            freed = 0
+
+            for kind, key, entry_size, _ in entries:
+                if size <= max_size:
+                    break
+
+                try:
+                    os.remove(self._path(kind, key))
+                except OSError:
+                    continue
+
+                size -= entry_size
+                removed += 1
+                freed += entry_size
+
+        return removed, freed
+
+
+_cache: ExtractionCache | None = None
+
+
+def configure_extraction_cache(directory: str | None, max_size: int) -> None:
+    """Configure the extraction cache. If the directory is not set, the cache is disabled."""
+
+    global _cache
+    _cache = ExtractionCache(directory, max_size) if directory else None
+
+
+def get_extraction_cache() -> ExtractionCache | None:
+    """Get the configured extraction cache."""
+
+    return _cache
+
+
+@cache
+def get_extractor_version() -> str:
+    """Get the version of the extractors and the libraries they use, so changed extractors do not use stale entries."""
+
+    versions = [str(_EXTRACTOR_VERSION)]
+
+    for library in _EXTRACTOR_LIBRARIES:
+        try:
+            versions.append(metadata.version(library))
+        except metadata.PackageNotFoundError:
+            versions.append("0")
+
+    return sha256("|".join(versions).encode()).hexdigest()[:8]
+
+
+def cached_extraction(kind: str, function: Callable[[BytesIO], T], stream: BytesIO) -> T:
+    """Extract content from the document stream using the function, or get it from the cache."""
+
+    if not _cache:
+        return function(stream)
+
+    kind = f"{kind}-{get_extractor_version()}"
+    key = sha256(stream.getbuffer()).hexdigest()
+
+    cached = _cache.get(kind, key)
+    if cached is not None:
+        logging.getLogger(__name__).debug("Using cached %s extraction of %s", kind, key)
+        return typing.cast("T", cached)
+
+    value = function(stream)
+    stream.seek(0)
+
+    try:
+        _cache.set(kind, key, value)
+    except OSError as error:
+        logging.getLogger(__name__).warning("Failed to cache the %s extraction: %s", kind, error)
+
+    return value
@@ -3,12 +3,11 @@
 import typing
 from datetime import date as date_
 
-from .database import get_or_create
 from ..database import Class, Classroom, Teacher
 
 if typing.TYPE_CHECKING:
     from typing import Any
-    from sqlalchemy.orm import Session
+    from .database import EntityResolver
 
 
 def normalize_subject_name(name: str) -> str | None:
@@ -113,7 +112,7 @@ def is_name_empty(name: str) -> bool:
 
 
 def format_substitution(
-    session: Session,
+    resolver: EntityResolver,
     date: date_,
     day: int,
     time: int,
@@ -127,17 +126,15 @@ def format_substitution(
 ) -> dict[str, Any]:
     """Format the substitution into a dict that can be stored into a database."""
 
-    # fmt: off
     return {
         "date": date,
         "day": day,
         "time": time,
         "subject": subject,
         "notes": notes,
-        "original_teacher_id": get_or_create(session, model=Teacher, name=original_teacher)[0].id if original_teacher else None,
-        "original_classroom_id": get_or_create(session, model=Classroom, name=original_classroom)[0].id if original_classroom else None,
-        "class_id": get_or_create(session, model=Class, name=class_)[0].id if class_ else None,
-        "teacher_id": get_or_create(session, model=Teacher, name=teacher)[0].id if teacher else None,
-        "classroom_id": get_or_create(session, model=Classroom, name=classroom)[0].id if classroom else None,
+        "original_teacher_id": resolver.get(Teacher, original_teacher),
+        "original_classroom_id": resolver.get(Classroom, original_classroom),
+        "class_id": resolver.get(Class, class_),
+        "teacher_id": resolver.get(Teacher, teacher),
+        "classroom_id": resolver.get(Classroom, classroom),
     }
-    # fmt: on
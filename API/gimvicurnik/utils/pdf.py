@@ -1,15 +1,54 @@
 from __future__ import annotations
 
+import atexit
+import multiprocessing
+import time
 import typing
+from io import BytesIO
 
 import pdfplumber
 
+from ..errors import PdfExtractionError, PdfTimeoutError
+
 if typing.TYPE_CHECKING:
     from typing import Any
-    from io import BytesIO
+    from multiprocessing.pool import Pool
 
     Tables = list[list[list[str | None]]]
 
+try:
+    import resource
+except ImportError:
+    resource = None  # type: ignore
+
+# Upper bound of extraction time if the configured timeout is not positive
+_MAX_TIMEOUT = 600
+
+_workers = 0
+_timeout = 0
+_memory_limit = 0
+_pool: Pool | None = None
+
+
+def configure_extraction(workers: int, timeout: int, memory_limit: int) -> None:
+    """
+    Configure the process pool for extraction of PDF tables.
+
+    If the number of workers is zero, tables are extracted in the current
+    process. Otherwise, pages of each document are split between worker
+    processes, and extraction fails after the timeout (in seconds), which
+    is always bounded, so killed workers cannot block the caller forever. If
+    the memory limit (in MiB) is set, worker processes cannot allocate more.
+    """
+
+    global _workers, _timeout, _memory_limit
+
+    _terminate_pool()
+
+    _workers = workers
+    _timeout = timeout if timeout > 0 else _MAX_TIMEOUT
+    _memory_limit = memory_limit
+
 
 def keep_visible_lines(obj: dict[str, Any]) -> bool:
     if obj["object_type"] == "rect":
@@ -18,14 +57,96 @@ def keep_visible_lines(obj: dict[str, Any]) -> bool:
     return True
 
 
-def extract_tables(stream: BytesIO) -> Tables:
-    """Extract tables from a PDF file using pdfplumber."""
+def _count_pages(data: bytes) -> int:
+    """Count pages of a PDF file."""
+
+    with pdfplumber.open(BytesIO(data)) as file:
+        return len(file.pages)
+
+
+def _extract_pages(data: bytes, numbers: range | None = None) -> Tables:
+    """Extract tables from a range of pages of a PDF file, or from all pages if the range is not provided."""
 
     tables = []
+    pages = [number + 1 for number in numbers] if numbers is not None else None
 
-    with pdfplumber.open(stream) as file:
+    with pdfplumber.open(BytesIO(data), pages=pages) as file:
         for page in file.pages:
             page = page.filter(keep_visible_lines)
             tables.extend(page.extract_tables())
 
     return tables
+
+
+def _limit_memory(memory_limit: int) -> None:
+    """Limit the address space of the worker process."""
+
+    if resource and memory_limit:
+        limit = memory_limit * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _get_pool() -> Pool:
+    """Get the process pool or start it if needed."""
+
+    global _pool
+
+    # The pool may be started after other threads, and forking a threaded process can deadlock its children
+    if not _pool:
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        context = multiprocessing.get_context(method)
+        _pool = context.Pool(_workers, initializer=_limit_memory, initargs=(_memory_limit,))
+
+    return _pool
+
+
+def _terminate_pool() -> None:
+    """Terminate the process pool, including any stalled extractions."""
+
+    global _pool
+
+    if _pool:
+        _pool.terminate()
+        _pool.join()
+        _pool = None
+
+
+atexit.register(_terminate_pool)
+
+
+def extract_tables(stream: BytesIO) -> Tables:
+    """Extract tables from a PDF file using pdfplumber."""
+
+    data = stream.getvalue()
+
+    if not _workers:
+        return _extract_pages(data)
+
+    pool = _get_pool()
+    deadline = time.monotonic() + _timeout
+
+    def _remaining() -> float:
+        return max(deadline - time.monotonic(), 0)
+
+    try:
+        # Pages are split between workers, but their tables are returned in order
+        pages = pool.apply_async(_count_pages, (data,)).get(_remaining())
+        size = max(-(-pages // _workers), 1)
+        chunks = [range(start, min(start + size, pages)) for start in range(0, pages, size)]
+        results = [pool.apply_async(_extract_pages, (data, chunk)) for chunk in chunks]
+
+        tables = []
+        for result in results:
+            tables.extend(result.get(_remaining()))
+
+        return tables
+
+    except multiprocessing.TimeoutError as error:
+        # Stalled workers cannot be stopped individually, so the whole pool is restarted
+        _terminate_pool()
+        raise PdfTimeoutError(f"PDF extraction did not finish in {_timeout} seconds") from error
+
+    except MemoryError as error:
+        raise PdfExtractionError(
+            f"PDF extraction exceeded the memory limit of {_memory_limit} MiB"
+        ) from error
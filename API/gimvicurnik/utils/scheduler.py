@@ -0,0 +1,218 @@
+from __future__ import annotations
+
+import logging
+import random
+import signal
+import threading
+import typing
+from datetime import datetime, timedelta, timezone
+
+import attrs
+
+from .database import get_last_change
+from .sentry import with_transaction
+from ..database import SessionFactory
+
+if typing.TYPE_CHECKING:
+    from typing import Any
+    from collections.abc import Callable, Collection
+    from flask import Flask
+    from requests import Session
+
+
+@attrs.define(kw_only=True)
+class PollingPolicy:
+    """
+    Decide how long to wait before polling a source again.
+
+    During active periods (school-day mornings by default), sources are polled
+    at the shorter active interval. Otherwise, the interval grows with the time
+    since the source last changed, so it backs off exponentially during nights
+    and holidays, but never past the start of the next active period. Active
+    periods are treated as holidays if the source has not changed for a while.
+    """
+
+    interval: int
+    """A number of seconds between runs outside active periods."""
+
+    active_interval: int
+    """A number of seconds between runs during active periods."""
+
+    max_interval: int
+    """A maximum number of seconds between runs."""
+
+    backoff: float
+    """A fraction of the time since the last change that is waited before the next run."""
+
+    active_weekdays: Collection[int]
+    """Weekdays with active periods, where Monday is 0."""
+
+    active_start: timedelta
+    """The start time of active periods."""
+
+    active_end: timedelta
+    """The end time of active periods."""
+
+    holiday_after: timedelta
+    """A time without changes after which active periods are treated as holidays."""
+
+    def active_period(self, now: datetime) -> tuple[datetime, datetime] | None:
+        """Return the start and end of the active period that contains the time, if any."""
+
+        if now.weekday() not in self.active_weekdays:
+            return None
+
+        midnight = datetime.combine(now.date(), datetime.min.time(), tzinfo=now.tzinfo)
+        start, end = midnight + self.active_start, midnight + self.active_end
+
+        return (start, end) if start <= now < end else None
+
+    def next_active_start(self, now: datetime) -> datetime | None:
+        """Return the start of the next active period after the time."""
+
+        midnight = datetime.combine(now.date(), datetime.min.time(), tzinfo=now.tzinfo)
+
+        for days in range(8):
+            start = midnight + timedelta(days=days) + self.active_start
+            if start > now and start.weekday() in self.active_weekdays:
+                return start
+
+        return None
+
+    def next_interval(self, now: datetime, last_change: datetime | None) -> float:
+        """Return the number of seconds to wait before the next run."""
+
+        period = self.active_period(now)
+
+        if not last_change:
+            return self.active_interval if period else self.interval
+
+        quiet = now - last_change
+
+        if period and quiet < self.holiday_after:
+            return self.active_interval
+
+        # Each run waits for a fraction of the time since the last change, so the interval grows exponentially
+        max_interval = max(self.max_interval, self.interval)
+        delay = min(max(self.interval, quiet.total_seconds() * self.backoff), max_interval)
+
+        # The backoff must not delay the first run of the next active period
+        if not period and (start := self.next_active_start(now)):
+            delay = min(delay, max((start - now).total_seconds(), self.active_interval))
+
+        return delay
+
+
+@attrs.define
+class ScheduledJob:
+    name: str
+    """The job name that is used in logs and transactions."""
+
+    source: str
+    """The updater source whose history is used for the polling policy."""
+
+    function: Callable[[Session | None], Session]
+    """A function that runs the job with the previous requests session and returns the used session."""
+
+    policy: PollingPolicy
+    """A policy that decides the number of seconds between runs."""
+
+    jitter: int
+    """A maximum number of seconds that runs are randomly shifted by."""
+
+    requests: Session | None = None
+    """A requests session that is reused between runs, so its connection pool stays warm."""
+
+
+class Scheduler:
+    """
+    Run jobs periodically in a single long-running process.
+
+    Each job runs in its own thread inside a new application context, and
+    waits for the interval from its polling policy with a random jitter
+    between runs, so sources are not requested at exactly the same times.
+    Jobs that write the same data are serialized by data locks of updaters.
+    The database engine and the requests sessions of jobs are reused between runs.
+    """
+
+    def __init__(self, app: Flask) -> None:
+        self.app = app
+        self.logger = logging.getLogger(__name__)
+        self.jobs: list[ScheduledJob] = []
+        self.stopped = threading.Event()
+
+    def add(
+        self,
+        name: str,
+        source: str,
+        function: Callable[[Session | None], Session],
+        policy: PollingPolicy,
+        jitter: int,
+    ) -> None:
+        """Add the job to the scheduler."""
+
+        self.jobs.append(ScheduledJob(name, source, function, policy, jitter))
+
+    def run(self) -> None:
+        """Run all jobs until the process is interrupted or terminated."""
+
+        def _stop(*args: Any) -> None:
+            self.stopped.set()
+
+        signal.signal(signal.SIGTERM, _stop)
+
+        threads = [
+            threading.Thread(target=self._loop, args=(job,), name=f"scheduler-{job.name}", daemon=True)
+            for job in self.jobs
+        ]
+
+        for thread in threads:
+            thread.start()
+
+        try:
+            self.stopped.wait()
+        except KeyboardInterrupt:
+            self.stopped.set()
+
+        self.logger.info("Stopping the scheduler after the running jobs finish")
+
+        for thread in threads:
+            thread.join()
+
+    def run_job(self, job: ScheduledJob) -> None:
+        """Run the job once."""
+
+        try:
+            with self.app.app_context():
+                job.requests = with_transaction(name=f"scheduler-{job.name}", op="command")(job.function)(
+                    job.requests
+                )
+        except Exception:
+            self.logger.exception("Error while running %s", job.name)
+
+    def next_delay(self, job: ScheduledJob) -> float:
+        """Return the number of seconds to wait before the next run of the job."""
+
+        try:
+            with SessionFactory() as session:
+                last_change = get_last_change(session, job.source)
+        except Exception:
+            self.logger.exception("Error while retrieving the update history of %s", job.name)
+            last_change = None
+
+        # History is recorded in UTC, while active periods are in local time
+        if last_change and not last_change.tzinfo:
+            last_change = last_change.replace(tzinfo=timezone.utc)
+
+        interval = job.policy.next_interval(datetime.now(timezone.utc).astimezone(), last_change)
+        self.logger.info("Next run of %s in %d seconds", job.name, interval)
+
+        return max(interval + random.uniform(-job.jitter, job.jitter), 0)
+
+    def _loop(self, job: ScheduledJob) -> None:
+        # Spread the first runs of jobs, so they do not all start at once
+        delay = random.uniform(0, job.jitter)
+
+        while not self.stopped.wait(delay):
+            self.run_job(job)
+            delay = self.next_delay(job)
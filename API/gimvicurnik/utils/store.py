@@ -0,0 +1,59 @@
+from __future__ import annotations
+
+import os
+import tempfile
+
+
+class DocumentStore:
+    """
+    A content-addressed store of raw documents in a local directory.
+
+    Documents are stored by the SHA-256 hash of their content, so the same
+    content is only stored once, even if it is provided by multiple URLs.
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key: str) -> bytes | None:
+        """Get the content of the document with the hash if it is stored."""
+
+        try:
+            with open(self._path(key), "rb") as file:
+                return file.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key: str, content: bytes) -> None:
+        """Store the document content with the hash if it is not already stored."""
+
+        path = self._path(key)
+
+        if os.path.exists(path):
+            return
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write to a temporary file first, so other processes never read partial documents
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), suffix=".tmp", delete=False) as file:
+            file.write(content)
+        os.replace(file.name, path)
+
+
+_store: DocumentStore | None = None
+
+
+def configure_document_store(directory: str | None) -> None:
+    """Configure the document store. If the directory is not set, documents are not stored."""
+
+    global _store
+    _store = DocumentStore(directory) if directory else None
+
+
+def get_document_store() -> DocumentStore | None:
+    """Get the configured document store."""
+
+    return _store
@@ -0,0 +1,31 @@
+from __future__ import annotations
+
+import typing
+
+from openpyxl import load_workbook
+
+if typing.TYPE_CHECKING:
+    from typing import Any
+    from io import BytesIO
+
+    Rows = list[list[Any]]
+
+
+def extract_rows(stream: BytesIO, min_row: int, max_col: int, remove_hidden_columns: bool = False) -> Rows:
+    """Extract cell values of rows from all worksheets of an XLSX file using openpyxl."""
+
+    # Hidden columns can only be removed from worksheets that are not read-only
+    wb = load_workbook(stream, read_only=not remove_hidden_columns, data_only=True)
+    rows = []
+
+    for ws in wb:
+        if remove_hidden_columns:
+            for column in ws.column_dimensions.values():
+                if column.hidden:
+                    ws.delete_cols(1)
+
+        for wr in ws.iter_rows(min_row=min_row, max_col=max_col):
+            rows.append([cell.value for cell in wr])
+
+    wb.close()
+    return rows